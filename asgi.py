@@ -0,0 +1,18 @@
+"""
+ASGI entry point para o J.A.R.V.I.S (modo assíncrono)
+Uso: gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+O app Flask de wsgi.py continua disponível como alternativa.
+"""
+import sys
+import os
+
+# Adicionar o diretório backend ao path
+backend_dir = os.path.join(os.path.dirname(__file__), 'backend')
+sys.path.insert(0, backend_dir)
+
+# Importar o app assíncrono do backend
+from asgi_main import app
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get('PORT', 10000)))
@@ -0,0 +1,169 @@
+"""
+Modo de execução assíncrono (ASGI) do JARVIS.
+
+As rotas /api/chat, /api/chat/stream, /api/teach_rule e /api/health são
+atendidas por handlers assíncronos: enquanto uma conversa espera pelo Gemini,
+o mesmo processo continua atendendo as demais. As outras rotas (métricas,
+importação em lote, frontend...) continuam sendo servidas pelo app Flask de
+main.py, montado como fallback. Para servir só com o Flask, use wsgi.py.
+"""
+import json
+import sys
+import time
+# Importar main garante o schema do banco e monta o app Flask de fallback.
+from main import app as flask_app
+from startup import startup_phase
+with startup_phase('asgi_imports'):
+    from a2wsgi import WSGIMiddleware
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Mount, Route
+from connection_pool import run_in_db_thread
+from jarvis_controller import process_chat_message_async, stream_chat_message_async
+from learning_module import learn_new_rule
+from knowledge_base_manager import log_message
+from llm_gateway import LLMOverloaded
+from metrics import request_timing, request_seconds, format_server_timing
+from config import METRICS_TIMING_HEADER
+
+def _cors_headers(request):
+    # Mesma política do Flask-CORS em main.py: qualquer origem.
+    return {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+        "Access-Control-Allow-Headers": request.headers.get('Access-Control-Request-Headers', '*'),
+    }
+
+def _api_handler(endpoint: str):
+    """
+    Equivalente aos hooks before/after_request e ao CORS de main.py para os
+    handlers assíncronos.
+    """
+    def decorator(handler):
+        async def wrapper(request):
+            if request.method == 'OPTIONS':
+                return Response(status_code=204, headers=_cors_headers(request))
+            started = time.perf_counter()
+            with request_timing() as timings:
+                response = await handler(request)
+            request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+            if timings and (METRICS_TIMING_HEADER or request.headers.get('X-Request-Timing') == '1'):
+                response.headers['Server-Timing'] = format_server_timing(timings)
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            return response
+        return wrapper
+    return decorator
+
+async def _read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+# Mesma mensagem de main._OVERLOADED_MESSAGE.
+_OVERLOADED_MESSAGE = "O JARVIS está recebendo muitas mensagens agora. Tente novamente em instantes."
+
+def _overloaded_response(error: LLMOverloaded):
+    return JSONResponse({"error": _OVERLOADED_MESSAGE, "retry_after": error.retry_after}, status_code=429,
+                        headers={"Retry-After": str(error.retry_after)})
+
+def _use_cache(request, data: dict):
+    """Mesma regra de main._use_cache."""
+    if data.get('cache') is False:
+        return False
+    return 'no-cache' not in request.headers.get('Cache-Control', '').lower()
+
+def _preferred_mimetype(request):
+    """Primeiro tipo do cabeçalho Accept (os clientes de SSE enviam só text/event-stream)."""
+    return request.headers.get('Accept', '').split(',')[0].split(';')[0].strip().lower()
+
+def _format_sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _event_stream(prompt: str, conversation_id: str = None, use_cache: bool = True):
+    """Resposta HTTP que repassa os eventos de stream_chat_message_async ao cliente."""
+    async def generate():
+        try:
+            async for event, data in stream_chat_message_async(prompt, conversation_id, use_cache):
+                yield _format_sse(event, data)
+        except LLMOverloaded as e:
+            log_message("WARN", f"Streaming de /api/chat recusado: {e}")
+            yield _format_sse('error', {"error": _OVERLOADED_MESSAGE, "retry_after": e.retry_after})
+        except Exception as e:
+            log_message("CRITICAL", f"Erro fatal no streaming de /api/chat: {e}")
+            yield _format_sse('error', {"error": "Ocorreu um erro interno no servidor."})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@_api_handler('chat')
+async def chat(request):
+    """Endpoint principal para interação com o JARVIS."""
+    try:
+        data = await _read_json(request)
+        if not isinstance(data, dict) or 'prompt' not in data:
+            log_message("WARN", "Recebida requisição para /api/chat sem o campo 'prompt'.")
+            return JSONResponse({"error": "O campo 'prompt' é obrigatório."}, status_code=400)
+
+        prompt = data.get('prompt')
+        conversation_id = data.get('conversation_id')
+        log_message("INFO", f"Nova requisição recebida em /api/chat para a conversa: {conversation_id or 'nova'}")
+
+        use_cache = _use_cache(request, data)
+        if _preferred_mimetype(request) == 'text/event-stream':
+            return _event_stream(prompt, conversation_id, use_cache)
+
+        response = await process_chat_message_async(prompt, conversation_id, use_cache)
+        return JSONResponse(response)
+
+    except LLMOverloaded as e:
+        log_message("WARN", f"Requisição para /api/chat recusada: {e}")
+        return _overloaded_response(e)
+    except Exception as e:
+        log_message("CRITICAL", f"Erro fatal no endpoint /api/chat: {e}")
+        print(f"Erro em /api/chat: {e}", file=sys.stderr)
+        return JSONResponse({"error": "Ocorreu um erro interno no servidor."}, status_code=500)
+
+@_api_handler('chat_stream')
+async def chat_stream(request):
+    """Versão do /api/chat que transmite a resposta via Server-Sent Events."""
+    data = await _read_json(request)
+    if not isinstance(data, dict) or 'prompt' not in data:
+        log_message("WARN", "Recebida requisição para /api/chat/stream sem o campo 'prompt'.")
+        return JSONResponse({"error": "O campo 'prompt' é obrigatório."}, status_code=400)
+
+    conversation_id = data.get('conversation_id')
+    log_message("INFO", f"Nova requisição recebida em /api/chat/stream para a conversa: {conversation_id or 'nova'}")
+    return _event_stream(data.get('prompt'), conversation_id, _use_cache(request, data))
+
+@_api_handler('teach_rule')
+async def teach_rule(request):
+    """Endpoint para ensinar uma nova regra diretamente."""
+    try:
+        data = await _read_json(request)
+        if not isinstance(data, dict) or 'rule' not in data:
+            return JSONResponse({"error": "O campo 'rule' é obrigatório."}, status_code=400)
+
+        response_text = await run_in_db_thread(learn_new_rule, data.get('rule'))
+        return JSONResponse({"text": response_text})
+
+    except Exception as e:
+        log_message("CRITICAL", f"Erro fatal no endpoint /api/teach_rule: {e}")
+        return JSONResponse({"error": "Ocorreu um erro interno no servidor."}, status_code=500)
+
+@_api_handler('health')
+async def health(request):
+    """Endpoint de health check"""
+    return JSONResponse({"status": "ok", "service": "JARVIS Backend", "mode": "asgi"})
+
+app = Starlette(routes=[
+    Route('/api/chat', chat, methods=['POST', 'OPTIONS']),
+    Route('/api/chat/stream', chat_stream, methods=['POST', 'OPTIONS']),
+    Route('/api/teach_rule', teach_rule, methods=['POST', 'OPTIONS']),
+    Route('/api/health', health, methods=['GET']),
+    # Todo o resto continua com o app Flask.
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
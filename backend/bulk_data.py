@@ -0,0 +1,198 @@
+"""
+Importação e exportação em lote de regras e fatos, em NDJSON (um objeto JSON
+por linha).
+
+Uso pela linha de comando:
+    python bulk_data.py import rules regras.ndjson
+    python bulk_data.py import facts fatos.ndjson
+    python bulk_data.py export rules -o regras.ndjson
+    python bulk_data.py export facts            # grava na saída padrão
+
+Formato das regras: {"condition": "...", "action": "...", "priority": 0}
+ou {"rule": "Se [condição], então [ação]"}.
+Formato dos fatos: {"fact": "...", "concept": "geral", "relationship": "...",
+"source": "...", "confidence": 1.0, "metadata": {}}.
+"""
+import argparse
+import contextlib
+import json
+import sys
+from datetime import datetime
+from connection_pool import db_connection
+from knowledge_base_manager import log_message
+from learning_module import parse_rule_text
+from rule_engine import rule_index, validate_condition
+from response_cache import response_cache
+from config import BULK_CHUNK_SIZE
+
+# Quantos erros de validação são devolvidos no resumo da importação.
+_MAX_REPORTED_ERRORS = 100
+
+def _as_text(name: str, value):
+    """Converte um campo escalar para texto (None continua None); objetos e listas invalidam a linha."""
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"o campo '{name}' deve ser um texto, não um {'objeto' if isinstance(value, dict) else 'array'}")
+    return str(value)
+
+def _parse_rule(record: dict):
+    """Valida uma linha de regra e retorna a tupla para o INSERT."""
+    if 'rule' in record:
+        parsed = parse_rule_text(str(record['rule']))
+        if not parsed:
+            raise ValueError("formato inválido; use 'Se [condição], então [ação]'")
+        condition, action = parsed
+    else:
+        condition = record.get('condition', record.get('rule_condition'))
+        action = record.get('action', record.get('rule_action'))
+    if not condition or not action:
+        raise ValueError("os campos 'condition' e 'action' são obrigatórios")
+    condition, action = _as_text('condition', condition), _as_text('action', action)
+    # A condição é usada como regex pelo motor de regras: valida já na carga.
+    validate_condition(condition)
+    priority = int(record.get('priority', 0))
+    is_active = 1 if record.get('is_active', True) else 0
+    return condition, action, priority, is_active
+
+def _parse_fact(record: dict):
+    """Valida uma linha de fato e retorna a tupla para o INSERT."""
+    fact = record.get('fact')
+    if not fact:
+        raise ValueError("o campo 'fact' é obrigatório")
+    metadata = record.get('metadata') or {}
+    modification_history = json.dumps([{"timestamp": str(datetime.now()), "change": "Imported"}])
+    return (
+        _as_text('fact', fact),
+        _as_text('concept', record.get('concept')) or 'geral',
+        _as_text('relationship', record.get('relationship')) or 'declaração do usuário',
+        _as_text('source', record.get('source', 'bulk_import')),
+        float(record.get('confidence', 1.0)),
+        json.dumps(metadata),
+        modification_history,
+    )
+
+_IMPORTS = {
+    "rules": (
+        _parse_rule,
+        'INSERT INTO rule_set (rule_condition, rule_action, priority, is_active) VALUES (?, ?, ?, ?)',
+    ),
+    "facts": (
+        _parse_fact,
+        '''INSERT INTO knowledge_base (fact, concept, relationship, source, confidence, metadata, modification_history)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+    ),
+}
+
+def import_ndjson(kind: str, lines, chunk_size: int = BULK_CHUNK_SIZE):
+    """
+    Importa regras ou fatos de um iterável de linhas NDJSON.
+    As linhas válidas são gravadas em blocos de chunk_size, cada bloco com
+    executemany em uma única transação; linhas inválidas são ignoradas e
+    relatadas no resumo retornado.
+    """
+    parse, insert_sql = _IMPORTS[kind]
+    imported = 0
+    error_count = 0
+    errors = []
+    chunk = []
+
+    def flush():
+        nonlocal imported
+        if chunk:
+            with db_connection() as conn:
+                conn.executemany(insert_sql, chunk)
+            imported += len(chunk)
+            chunk.clear()
+
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("cada linha deve ser um objeto JSON")
+                chunk.append(parse(record))
+            except (ValueError, TypeError) as e:
+                error_count += 1
+                if len(errors) < _MAX_REPORTED_ERRORS:
+                    errors.append({"line": line_number, "error": str(e)})
+                continue
+            if len(chunk) >= chunk_size:
+                flush()
+        flush()
+    finally:
+        # Os blocos já gravados valem mesmo se a importação for interrompida.
+        if imported:
+            if kind == "rules":
+                # Aplica as novas regras ao índice sem reconstruí-lo.
+                rule_index.refresh_if_stale(force=True)
+            # Uma única invalidação para toda a importação.
+            response_cache.invalidate()
+    log_message("INFO", f"Importação em lote de {kind}: {imported} registros importados, {error_count} rejeitados.")
+    return {"imported": imported, "error_count": error_count, "errors": errors}
+
+_EXPORTS = {
+    "rules": ('SELECT id, rule_condition, rule_action, priority, is_active FROM rule_set WHERE id > ? ORDER BY id LIMIT ?',
+              lambda row: {"condition": row["rule_condition"], "action": row["rule_action"],
+                           "priority": row["priority"], "is_active": bool(row["is_active"])}),
+    "facts": ('''SELECT id, fact, concept, relationship, source, confidence, metadata, timestamp
+                 FROM knowledge_base WHERE id > ? ORDER BY id LIMIT ?''',
+              lambda row: {"fact": row["fact"], "concept": row["concept"], "relationship": row["relationship"],
+                           "source": row["source"], "confidence": row["confidence"],
+                           "metadata": json.loads(row["metadata"] or "{}"), "timestamp": row["timestamp"]}),
+}
+
+def export_ndjson(kind: str, chunk_size: int = BULK_CHUNK_SIZE):
+    """
+    Gera as linhas NDJSON de todas as regras ou fatos.
+    A leitura é paginada pelo id, então o uso de memória não depende do
+    tamanho da tabela e nenhuma transação de leitura fica aberta entre blocos.
+    """
+    select_sql, to_record = _EXPORTS[kind]
+    last_id = 0
+    while True:
+        with db_connection() as conn:
+            rows = conn.execute(select_sql, (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield json.dumps(to_record(row), ensure_ascii=False) + "\n"
+        last_id = rows[-1]["id"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa/exporta regras e fatos do JARVIS em NDJSON.")
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('kind', choices=sorted(_IMPORTS))
+    parser.add_argument('path', nargs='?', default='-', help="Arquivo de entrada para import ('-' = entrada padrão).")
+    parser.add_argument('-o', '--output', default='-', help="Arquivo de saída para export ('-' = saída padrão).")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    from database_schema import create_schema
+    # As mensagens do schema vão para stderr para não misturar com o NDJSON.
+    with contextlib.redirect_stdout(sys.stderr):
+        create_schema()
+
+    if args.command == 'import':
+        if args.path == '-':
+            summary = import_ndjson(args.kind, sys.stdin, args.chunk_size)
+        else:
+            with open(args.path, encoding='utf-8') as source:
+                summary = import_ndjson(args.kind, source, args.chunk_size)
+        print(json.dumps(summary, indent=2, ensure_ascii=False), file=sys.stderr)
+        return 1 if summary["error_count"] else 0
+
+    if args.output == '-':
+        sys.stdout.writelines(export_ndjson(args.kind, args.chunk_size))
+    else:
+        with open(args.output, 'w', encoding='utf-8') as target:
+            target.writelines(export_ndjson(args.kind, args.chunk_size))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
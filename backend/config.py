@@ -4,4 +4,132 @@ import os
 # Define o caminho do banco de dados. Em um ambiente serverless como o Vercel,
 # o único diretório gravável é /tmp. Para desenvolvimento local,
 # pode ser útil usar um caminho local, mas /tmp funciona em ambos.
-DB_PATH = os.path.join('/tmp', 'jarvis.db')
+# JARVIS_DB_PATH permite apontar para outro arquivo (ex.: nos benchmarks).
+DB_PATH = os.getenv('JARVIS_DB_PATH', os.path.join('/tmp', 'jarvis.db'))
+
+# Intervalo (em segundos) entre as verificações de regras adicionadas por
+# outros processos (ex.: outros workers do Gunicorn). Dentro do mesmo processo
+# o índice de regras é atualizado imediatamente por add_rule.
+RULE_INDEX_REFRESH_SECONDS = float(os.getenv('RULE_INDEX_REFRESH_SECONDS', '5'))
+
+# Casamento seguro das condições das regras (ver safe_regex.py). Ligado, as
+# condições são analisadas ao serem ensinadas e, quando possível, avaliadas
+# por um motor de tempo linear; as que exigem o módulo re (retrorreferências,
+# lookarounds) rodam com um orçamento de tempo por mensagem e só veem os
+# primeiros RULE_MATCH_MAX_INPUT_CHARS caracteres. Uma regra que sozinha
+# estoura o orçamento é colocada em quarentena.
+RULE_SAFE_MATCHING = os.getenv('RULE_SAFE_MATCHING', 'true').lower() in ('1', 'true', 'yes')
+RULE_MATCH_BUDGET_MS = float(os.getenv('RULE_MATCH_BUDGET_MS', '25'))
+RULE_MATCH_MAX_INPUT_CHARS = int(os.getenv('RULE_MATCH_MAX_INPUT_CHARS', '2000'))
+
+# Ajustes das conexões SQLite (ver connection_pool.py).
+# busy_timeout em milissegundos; cache_size negativo = tamanho em KiB.
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '8192'))
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+
+# Gravação assíncrona de logs (ver log_writer.py). Com LOG_ASYNC desativado,
+# cada log_message grava diretamente no banco, como antes.
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+LOG_QUEUE_MAX_SIZE = int(os.getenv('LOG_QUEUE_MAX_SIZE', '10000'))
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '200'))
+LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv('LOG_FLUSH_INTERVAL_SECONDS', '1.0'))
+
+# Classificação de intenção em camadas (ver intent_classifier.py).
+INTENT_LOCAL_CLASSIFIER = os.getenv('INTENT_LOCAL_CLASSIFIER', 'true').lower() in ('1', 'true', 'yes')
+INTENT_CACHE_SIZE = int(os.getenv('INTENT_CACHE_SIZE', '2048'))
+
+# Recuperação de fatos (FTS5) para contextualizar as respostas do LLM.
+# O orçamento limita o tempo gasto pelo SQLite na busca; se estourar, a
+# resposta segue sem fatos.
+FACT_RETRIEVAL_ENABLED = os.getenv('FACT_RETRIEVAL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+FACT_RETRIEVAL_TOP_K = int(os.getenv('FACT_RETRIEVAL_TOP_K', '3'))
+FACT_RETRIEVAL_BUDGET_MS = float(os.getenv('FACT_RETRIEVAL_BUDGET_MS', '10'))
+
+# Estado das conversas (ver conversation_state.py). Estados abandonados expiram
+# após o TTL.
+CONVERSATION_STATE_TTL_SECONDS = float(os.getenv('CONVERSATION_STATE_TTL_SECONDS', '900'))
+
+# Cache de respostas do LLM (ver response_cache.py).
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '86400'))
+RESPONSE_CACHE_MEMORY_SIZE = int(os.getenv('RESPONSE_CACHE_MEMORY_SIZE', '512'))
+RESPONSE_CACHE_MAX_ROWS = int(os.getenv('RESPONSE_CACHE_MAX_ROWS', '50000'))
+# Quantas mensagens recentes do histórico entram na chave do cache.
+RESPONSE_CACHE_HISTORY_WINDOW = int(os.getenv('RESPONSE_CACHE_HISTORY_WINDOW', '4'))
+# Por quanto tempo cada processo reutiliza a geração do cache lida do banco;
+# uma invalidação feita em outro worker é vista após, no máximo, esse tempo.
+RESPONSE_CACHE_GENERATION_CACHE_SECONDS = float(os.getenv('RESPONSE_CACHE_GENERATION_CACHE_SECONDS', '1.0'))
+
+# Execução concorrente das etapas independentes de process_chat_message.
+PIPELINE_CONCURRENT = os.getenv('PIPELINE_CONCURRENT', 'true').lower() in ('1', 'true', 'yes')
+PIPELINE_MAX_WORKERS = int(os.getenv('PIPELINE_MAX_WORKERS', '8'))
+
+# Inclui o cabeçalho Server-Timing (tempo por etapa) em todas as respostas da
+# API. Mesmo desativado, o cliente pode pedi-lo com 'X-Request-Timing: 1'.
+METRICS_TIMING_HEADER = os.getenv('METRICS_TIMING_HEADER', 'false').lower() in ('1', 'true', 'yes')
+
+# Importação em lote (ver bulk_data.py): linhas por transação.
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '5000'))
+
+# Contexto enviado ao LLM (ver context_builder.py). Os tokens são estimados
+# a partir do tamanho do texto (~4 caracteres por token).
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+CONTEXT_MAX_MESSAGE_TOKENS = int(os.getenv('CONTEXT_MAX_MESSAGE_TOKENS', '1000'))
+CONTEXT_SUMMARY_ENABLED = os.getenv('CONTEXT_SUMMARY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv('CONTEXT_SUMMARY_MAX_TOKENS', '400'))
+# Páginas de mensagens antigas (ver _MAX_WINDOW_ROWS em context_builder.py)
+# resumidas pelo LLM em uma mesma requisição; as anteriores a elas entram no
+# resumo de forma extrativa, sem chamadas ao LLM.
+CONTEXT_SUMMARY_MAX_PAGES = int(os.getenv('CONTEXT_SUMMARY_MAX_PAGES', '2'))
+
+# Modo de execução assíncrono (ASGI, ver asgi_main.py): threads usadas para o
+# acesso ao SQLite, que não tem API assíncrona.
+ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', '16'))
+
+# Inicialização: com importações preguiçosas, o SDK do Gemini só é importado
+# e configurado na primeira chamada ao modelo (ver gemini_integration.py).
+STARTUP_LAZY_IMPORTS = os.getenv('STARTUP_LAZY_IMPORTS', 'true').lower() in ('1', 'true', 'yes')
+
+# Retenção dos logs (ver log_retention.py). Limites iguais a 0 desativam a
+# regra correspondente; os logs removidos ficam contados por hora em log_rollup.
+LOG_RETENTION_DAYS = float(os.getenv('LOG_RETENTION_DAYS', '7'))
+LOG_RETENTION_MAX_ROWS = int(os.getenv('LOG_RETENTION_MAX_ROWS', '200000'))
+LOG_RETENTION_INTERVAL_SECONDS = float(os.getenv('LOG_RETENTION_INTERVAL_SECONDS', '300'))
+LOG_RETENTION_BATCH_SIZE = int(os.getenv('LOG_RETENTION_BATCH_SIZE', '1000'))
+# Com autostart, a poda começa com o primeiro log de cada processo; o
+# gunicorn.conf.py o desativa quando o app é pré-carregado no processo mestre.
+LOG_RETENTION_AUTOSTART = os.getenv('LOG_RETENTION_AUTOSTART', 'true').lower() in ('1', 'true', 'yes')
+
+# Token exigido por /api/logs e /api/logs/hourly (cabeçalho
+# "Authorization: Bearer <token>"). Os logs contêm os prompts dos usuários,
+# então sem token configurado os endpoints ficam desativados (404).
+LOGS_API_TOKEN = os.getenv('LOGS_API_TOKEN', '')
+# Token exigido por /api/bulk/<tipo>, no mesmo formato. A exportação devolve
+# toda a base de conhecimento e a importação altera as regras de todos os
+# usuários; sem token configurado, os endpoints ficam desativados (404). A
+# linha de comando (bulk_data.py) não depende dele.
+BULK_API_TOKEN = os.getenv('BULK_API_TOKEN', '')
+
+# Arquivos estáticos do frontend (ver static_assets.py). Sem variantes .gz/.br
+# geradas no build, os arquivos compressíveis são comprimidos na inicialização
+# (STATIC_PRECOMPRESS). Assets com hash no nome recebem cache imutável.
+STATIC_PRECOMPRESS = os.getenv('STATIC_PRECOMPRESS', 'true').lower() in ('1', 'true', 'yes')
+STATIC_MIN_COMPRESS_BYTES = int(os.getenv('STATIC_MIN_COMPRESS_BYTES', '1024'))
+STATIC_IMMUTABLE_MAX_AGE = int(os.getenv('STATIC_IMMUTABLE_MAX_AGE', '31536000'))
+
+# Controle de admissão das chamadas ao Gemini (ver llm_gateway.py), por
+# processo. Além de LLM_MAX_CONCURRENCY chamadas simultâneas, as requisições
+# esperam em uma fila de até LLM_MAX_QUEUE posições por no máximo
+# LLM_QUEUE_TIMEOUT_SECONDS; fila cheia ou espera esgotada resultam em HTTP
+# 429 com Retry-After. LLM_MAX_CONCURRENCY=0 desativa o limite.
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '32'))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', '128'))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', '15'))
+# Novas tentativas após erros transitórios da API (429, 5xx, falhas de rede),
+# com espera aleatória ("full jitter") entre 0 e base * 2^tentativa, até o máximo.
+LLM_RETRY_ATTEMPTS = int(os.getenv('LLM_RETRY_ATTEMPTS', '3'))
+LLM_RETRY_BASE_SECONDS = float(os.getenv('LLM_RETRY_BASE_SECONDS', '0.5'))
+LLM_RETRY_MAX_SECONDS = float(os.getenv('LLM_RETRY_MAX_SECONDS', '8'))
+# Requisições idênticas em andamento compartilham uma única chamada à API.
+LLM_COALESCE = os.getenv('LLM_COALESCE', 'true').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,91 @@
+import asyncio
+import contextvars
+import functools
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+# Importa as configurações do arquivo de configuração centralizado.
+from config import DB_PATH, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_SYNCHRONOUS, ASYNC_DB_WORKERS
+
+# Cada thread mantém sua própria conexão, reutilizada entre as operações.
+# Conexões SQLite não podem ser compartilhadas entre threads (check_same_thread)
+# nem herdadas por processos filhos, por isso guardamos o PID junto.
+_local = threading.local()
+
+def _open_connection():
+    """Abre uma nova conexão já configurada com WAL e os pragmas de desempenho."""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    # WAL permite leitores concorrentes com um escritor, evitando a maior
+    # parte dos erros "database is locked" entre workers do Gunicorn.
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+def get_connection():
+    """Retorna a conexão reutilizável da thread atual, abrindo-a se necessário."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _open_connection()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+    return conn
+
+@contextmanager
+def db_connection():
+    """
+    Context manager para operações no banco de dados.
+    Faz commit ao sair do bloco mais externo e rollback em caso de exceção.
+    Blocos aninhados na mesma thread compartilham a mesma transação.
+    """
+    conn = get_connection()
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+        raise
+    else:
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            conn.commit()
+
+def close_connection():
+    """Fecha a conexão da thread atual (ex.: ao encerrar uma thread de trabalho)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        if _local.pid == os.getpid():
+            conn.close()
+        _local.conn = None
+
+# Threads que executam o acesso ao banco para o modo assíncrono (ASGI). Cada
+# uma mantém sua conexão em _local, como qualquer outra thread.
+_db_executor = None
+_db_executor_pid = None
+_db_executor_lock = threading.Lock()
+
+def _get_db_executor():
+    global _db_executor, _db_executor_pid
+    if _db_executor is None or _db_executor_pid != os.getpid():
+        with _db_executor_lock:
+            if _db_executor is None or _db_executor_pid != os.getpid():
+                _db_executor = ThreadPoolExecutor(max_workers=ASYNC_DB_WORKERS, thread_name_prefix="jarvis-db")
+                _db_executor_pid = os.getpid()
+    return _db_executor
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """
+    Executa uma função bloqueante (acesso ao SQLite) em uma das threads de
+    banco, sem bloquear o event loop. O contexto (contextvars) é preservado.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(_get_db_executor(), call)
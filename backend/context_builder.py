@@ -0,0 +1,216 @@
+import json
+from collections import namedtuple
+from knowledge_base_manager import (
+    get_history_rows,
+    get_conversation_summary,
+    save_conversation_summary,
+    log_message
+)
+from gemini_integration import summarize_history, summarize_history_async
+from connection_pool import run_in_db_thread
+from config import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_MAX_MESSAGE_TOKENS,
+    CONTEXT_SUMMARY_ENABLED,
+    CONTEXT_SUMMARY_MAX_TOKENS,
+    CONTEXT_SUMMARY_MAX_PAGES
+)
+
+# Estimativa grosseira usada para o orçamento: ~4 caracteres por token.
+CHARS_PER_TOKEN = 4
+
+# Quando a janela estoura o orçamento, as mensagens mantidas ocupam só esta
+# fração dele. Assim o resumo não precisa ser refeito a cada nova mensagem,
+# apenas quando a folga se esgota de novo.
+_REFILL_RATIO = 0.6
+
+# Limite de mensagens lidas do banco por requisição. Quando há mais
+# mensagens ainda não resumidas do que isso, as excedentes são resumidas em
+# páginas deste tamanho, da mais antiga para a mais nova: até
+# CONTEXT_SUMMARY_MAX_PAGES páginas pelo LLM e, antes delas, o restante de
+# forma extrativa (ver _load_overflow).
+_MAX_WINDOW_ROWS = 200
+
+def estimate_tokens(text_or_size) -> int:
+    """Estima os tokens de um texto (ou de um tamanho em caracteres)."""
+    size = text_or_size if isinstance(text_or_size, int) else len(text_or_size or '')
+    return (size + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars - 1] + "…"
+
+def _message_text(row) -> str:
+    parts = json.loads(row["parts"])
+    return "\n".join(part.get("text", "") for part in parts if isinstance(part, dict))
+
+def _to_history(row) -> dict:
+    """Converte uma linha do banco para o formato do histórico, cortando mensagens muito longas."""
+    if estimate_tokens(row["size"]) <= CONTEXT_MAX_MESSAGE_TOKENS:
+        return {"role": row["role"], "parts": json.loads(row["parts"])}
+    return {"role": row["role"], "parts": [{"text": _truncate(_message_text(row), CONTEXT_MAX_MESSAGE_TOKENS)}]}
+
+def _extractive_summary(previous_summary: str, messages: list) -> str:
+    """Resumo sem o LLM: o resumo anterior seguido do início de cada mensagem, limitado pelo final."""
+    lines = [previous_summary] if previous_summary else []
+    lines.extend(f"{'Usuário' if role == 'user' else 'JARVIS'}: {_truncate(text, 40)}" for role, text in messages)
+    text = "\n".join(lines)
+    max_chars = CONTEXT_SUMMARY_MAX_TOKENS * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else "…" + text[-(max_chars - 1):]
+
+# Limite de palavras pedido ao LLM: ~0,75 palavra por token.
+_SUMMARY_MAX_WORDS = max(1, CONTEXT_SUMMARY_MAX_TOKENS * 3 // 4)
+
+def _summary_fallback(conversation_id: str, previous_summary: str, messages: list, error: Exception) -> str:
+    log_message("WARN", f"Falha ao resumir a conversa {conversation_id} com o LLM; usando resumo extrativo: {error}")
+    return _extractive_summary(previous_summary, messages)
+
+def _refresh_summary(conversation_id: str, previous_summary: str, rows: list) -> str:
+    """Incorpora ao resumo as mensagens (em ordem cronológica) que saíram da janela e grava o resultado."""
+    messages = [(row["role"], _message_text(row)) for row in rows]
+    try:
+        summary = _truncate(summarize_history(previous_summary, messages, _SUMMARY_MAX_WORDS), CONTEXT_SUMMARY_MAX_TOKENS)
+    except Exception as e:
+        summary = _summary_fallback(conversation_id, previous_summary, messages, e)
+    save_conversation_summary(conversation_id, summary, max(row["id"] for row in rows))
+    return summary
+
+async def _refresh_summary_async(conversation_id: str, previous_summary: str, rows: list) -> str:
+    """Versão assíncrona de _refresh_summary: o LLM é aguardado no event loop e só a gravação usa uma thread de banco."""
+    messages = [(row["role"], _message_text(row)) for row in rows]
+    try:
+        summary = await summarize_history_async(previous_summary, messages, _SUMMARY_MAX_WORDS)
+        summary = _truncate(summary, CONTEXT_SUMMARY_MAX_TOKENS)
+    except Exception as e:
+        summary = _summary_fallback(conversation_id, previous_summary, messages, e)
+    await run_in_db_thread(save_conversation_summary, conversation_id, summary, max(row["id"] for row in rows))
+    return summary
+
+# Contexto lido do banco, antes da atualização do resumo: o resumo gravado e
+# o id da última mensagem que ele cobre, as mensagens que cabem no orçamento
+# (mais recentes primeiro), as que saíram da janela e ainda precisam ser
+# resumidas e, se a janela veio cheia, o id a partir do qual há mensagens
+# mais antigas não lidas (overflow_before_id).
+ConversationContext = namedtuple('ConversationContext', [
+    'conversation_id', 'summary', 'covered_until_id', 'rows', 'dropped', 'overflow_before_id'])
+
+def load_conversation_context(conversation_id: str, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Lê o resumo acumulado e as mensagens posteriores a ele, e decide quais
+    cabem no orçamento de tokens. Só faz leituras no banco, então pode rodar
+    de forma especulativa, antes de se saber se o LLM será consultado.
+    """
+    record = get_conversation_summary(conversation_id) if CONTEXT_SUMMARY_ENABLED else None
+    summary = record["summary"] if record else ''
+    covered_until_id = record["covered_until_id"] if record else 0
+    rows = get_history_rows(conversation_id, after_id=covered_until_id, limit=_MAX_WINDOW_ROWS)
+
+    # Linhas da mais recente para a mais antiga; o tamanho vem do SQL, sem decodificar o JSON.
+    costs = [min(estimate_tokens(row["size"]), CONTEXT_MAX_MESSAGE_TOKENS) for row in rows]
+    available = token_budget - estimate_tokens(summary)
+    overflow_before_id = None
+    if CONTEXT_SUMMARY_ENABLED and len(rows) == _MAX_WINDOW_ROWS:
+        # Pode haver mensagens mais antigas ainda não resumidas; o resumo vai
+        # crescer, então reserva o seu tamanho máximo.
+        overflow_before_id = rows[-1]["id"]
+        available = token_budget - CONTEXT_SUMMARY_MAX_TOKENS
+    dropped = []
+    if sum(costs) > available:
+        # A janela andou: mantém as mensagens mais recentes que cabem na
+        # fração de reabastecimento e resume o restante.
+        limit = available * _REFILL_RATIO if CONTEXT_SUMMARY_ENABLED else available
+        used = 0
+        keep = 0
+        for cost in costs:
+            if used + cost > limit:
+                break
+            used += cost
+            keep += 1
+        keep = max(keep, 1) if rows else 0
+        dropped = rows[keep:] if CONTEXT_SUMMARY_ENABLED else []
+        rows = rows[:keep]
+    return ConversationContext(conversation_id, summary, covered_until_id, rows, dropped, overflow_before_id)
+
+def _to_llm_history(summary: str, rows: list):
+    history = [_to_history(row) for row in reversed(rows)]
+    if summary:
+        history = [
+            {"role": "user", "parts": [{"text": f"Resumo da nossa conversa até aqui:\n{summary}"}]},
+            {"role": "model", "parts": [{"text": "Entendido. Vou continuar a partir desse resumo."}]},
+        ] + history
+    return history
+
+def _load_overflow(context: ConversationContext):
+    """
+    Lê as mensagens entre o resumo gravado e a janela (overflow_before_id).
+    Retorna (trecho antigo, páginas recentes), em ordem cronológica: as até
+    CONTEXT_SUMMARY_MAX_PAGES páginas mais recentes vão para o LLM; do trecho
+    anterior a elas, só a última página é lida, pois o resumo extrativo
+    guarda apenas o final do texto. São no máximo duas consultas.
+    """
+    limit = _MAX_WINDOW_ROWS * CONTEXT_SUMMARY_MAX_PAGES
+    recent = []
+    if limit > 0:
+        recent = get_history_rows(context.conversation_id, after_id=context.covered_until_id,
+                                  before_id=context.overflow_before_id, limit=limit)
+    older = []
+    if len(recent) == limit:
+        boundary = recent[-1]["id"] if recent else context.overflow_before_id
+        older = get_history_rows(context.conversation_id, after_id=context.covered_until_id,
+                                 before_id=boundary, limit=_MAX_WINDOW_ROWS)
+    recent.reverse()
+    pages = [recent[start:start + _MAX_WINDOW_ROWS] for start in range(0, len(recent), _MAX_WINDOW_ROWS)]
+    return list(reversed(older)), pages
+
+def _fold_extractive(previous_summary: str, rows: list) -> str:
+    return _extractive_summary(previous_summary, [(row["role"], _message_text(row)) for row in rows])
+
+def complete_conversation_context(context: ConversationContext):
+    """
+    Atualiza o resumo com as mensagens que saíram da janela (chamada ao LLM e
+    gravação no banco) e monta o histórico enviado ao LLM. Deve rodar só
+    depois que o roteamento decidiu consultar o LLM. O número de chamadas ao
+    LLM por requisição é limitado a CONTEXT_SUMMARY_MAX_PAGES + 1.
+    """
+    summary = context.summary
+    if context.overflow_before_id is not None:
+        older, pages = _load_overflow(context)
+        if older:
+            summary = _fold_extractive(summary, older)
+            save_conversation_summary(context.conversation_id, summary, older[-1]["id"])
+        for page in pages:
+            summary = _refresh_summary(context.conversation_id, summary, page)
+    if context.dropped:
+        summary = _refresh_summary(context.conversation_id, summary, list(reversed(context.dropped)))
+    return _to_llm_history(summary, context.rows)
+
+async def complete_conversation_context_async(context: ConversationContext):
+    """
+    Versão assíncrona de complete_conversation_context, para o modo ASGI: as
+    leituras e gravações vão para as threads de banco e as chamadas ao LLM são
+    aguardadas no event loop, sem ocupar uma thread de banco durante a espera.
+    """
+    summary = context.summary
+    if context.overflow_before_id is not None:
+        older, pages = await run_in_db_thread(_load_overflow, context)
+        if older:
+            summary = _fold_extractive(summary, older)
+            await run_in_db_thread(save_conversation_summary, context.conversation_id, summary, older[-1]["id"])
+        for page in pages:
+            summary = await _refresh_summary_async(context.conversation_id, summary, page)
+    if context.dropped:
+        summary = await _refresh_summary_async(context.conversation_id, summary, list(reversed(context.dropped)))
+    return _to_llm_history(summary, context.rows)
+
+def build_conversation_context(conversation_id: str, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Monta o histórico enviado ao LLM limitado por um orçamento de tokens.
+
+    As mensagens antigas são representadas por um resumo acumulado, gravado
+    por conversa junto com o id da última mensagem que ele cobre. Cada
+    requisição lê apenas o resumo e as mensagens posteriores a ele; o resumo
+    só é refeito quando essas mensagens deixam de caber no orçamento.
+    """
+    return complete_conversation_context(load_conversation_context(conversation_id, token_budget))
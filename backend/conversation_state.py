@@ -0,0 +1,54 @@
+import time
+from connection_pool import db_connection
+from config import CONVERSATION_STATE_TTL_SECONDS
+
+# Intervalo mínimo entre as limpezas de estados expirados no banco.
+_PURGE_INTERVAL_SECONDS = 60
+
+class ConversationStateStore:
+    """
+    Estado das conversas (ex.: 'awaiting_rule_definition') guardado no SQLite,
+    para que qualquer worker possa atender a próxima mensagem da conversa.
+    Os estados expiram após ttl segundos. Não há cache local: outro worker
+    pode ter definido ou limpado o estado, então toda leitura vai ao banco
+    (uma consulta pela chave primária).
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._last_purge = 0.0
+
+    def get(self, conversation_id: str):
+        """Retorna o estado atual da conversa, ou None."""
+        with db_connection() as conn:
+            row = conn.execute(
+                'SELECT state FROM conversation_state WHERE conversation_id = ? AND expires_at > ?',
+                (conversation_id, time.time())
+            ).fetchone()
+        return row['state'] if row else None
+
+    def set(self, conversation_id: str, state: str):
+        """Define o estado da conversa, renovando seu prazo de expiração."""
+        with db_connection() as conn:
+            conn.execute('''
+                INSERT INTO conversation_state (conversation_id, state, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (conversation_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at
+            ''', (conversation_id, state, time.time() + self._ttl))
+        self._purge_expired()
+
+    def clear(self, conversation_id: str):
+        """Remove o estado da conversa."""
+        with db_connection() as conn:
+            conn.execute('DELETE FROM conversation_state WHERE conversation_id = ?', (conversation_id,))
+
+    def _purge_expired(self):
+        """Apaga do banco os estados abandonados (no máximo uma vez por minuto)."""
+        now = time.monotonic()
+        if now - self._last_purge < _PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        with db_connection() as conn:
+            conn.execute('DELETE FROM conversation_state WHERE expires_at <= ?', (time.time(),))
+
+
+conversation_states = ConversationStateStore(CONVERSATION_STATE_TTL_SECONDS)
@@ -1,12 +1,26 @@
 import sqlite3
 # Importa o DB_PATH do novo arquivo de configuração centralizado.
 from config import DB_PATH
+from connection_pool import db_connection
 
 def create_schema():
-    # Conecta ao banco de dados usando o caminho centralizado
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    # Usa a conexão compartilhada (WAL) da thread atual
+    with db_connection() as conn:
+        _create_tables(conn.cursor())
+    applied = run_migrations()
+    fts_ready = ensure_knowledge_base_fts()
+    if fts_ready:
+        # Sem o índice FTS5 o marcador não é gravado: a próxima inicialização
+        # volta a verificar o schema e cria o índice se o FTS5 estiver disponível.
+        with db_connection() as conn:
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    _checked_paths.add(DB_PATH)
+    print(f"Schema do banco de dados em '{DB_PATH}' verificado e/ou criado com sucesso.")
+    if applied:
+        print(f"Migrações aplicadas: {', '.join(str(version) for version in applied)}.")
 
+def _create_tables(c):
+    """Cria as tabelas principais, caso ainda não existam."""
     # Tabela da Base de Conhecimento (KB)
     c.execute('''
         CREATE TABLE IF NOT EXISTS knowledge_base (
@@ -54,9 +68,220 @@ def create_schema():
         )
     ''')
 
-    conn.commit()
-    conn.close()
-    print(f"Schema do banco de dados em '{DB_PATH}' verificado e/ou criado com sucesso.")
+# --- Migrações ---
+# Cada migração é aplicada uma única vez, em ordem, sobre bancos já
+# existentes. Para evoluir o schema, acrescente uma nova entrada ao final de
+# MIGRATIONS; nunca altere uma migração que já foi publicada.
+
+def _add_column_if_missing(c, table: str, column: str, definition: str):
+    """Adiciona uma coluna à tabela, se ela ainda não existir."""
+    columns = {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def _migration_001_indexes(c):
+    # get_conversation_history: filtra por conversation_id e ordena por timestamp
+    # (o id desempata mensagens gravadas no mesmo segundo).
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_conversation_history_conversation
+        ON conversation_history (conversation_id, timestamp, id)
+    ''')
+    # get_fact_by_concept: busca exata por concept
+    c.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_base_concept ON knowledge_base (concept)')
+    # get_all_rules: filtra por is_active e ordena por priority
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_rule_set_active_priority
+        ON rule_set (is_active, priority DESC, id)
+    ''')
+
+def _migration_002_knowledge_base_fts(c):
+    # Se o FTS5 não estiver disponível, a migração é registrada mesmo assim e
+    # ensure_knowledge_base_fts cria o índice numa inicialização posterior.
+    _create_knowledge_base_fts(c)
+
+def _knowledge_base_fts_exists(c):
+    row = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'knowledge_base_fts'"
+    ).fetchone()
+    return row is not None
+
+def _create_knowledge_base_fts(c):
+    """
+    Cria o índice FTS5 dos fatos e seus triggers, indexando os fatos existentes.
+    Retorna False se o SQLite foi compilado sem FTS5.
+    """
+    # Índice de texto completo sobre os fatos, mantido em sincronia por triggers.
+    # remove_diacritics permite que "informacao" encontre "informação".
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_base_fts USING fts5(
+                fact,
+                content='knowledge_base',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite compilado sem FTS5: a recuperação de fatos fica desativada.
+        print(f"AVISO: FTS5 indisponível, recuperação de fatos desativada: {e}")
+        return False
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_insert AFTER INSERT ON knowledge_base BEGIN
+            INSERT INTO knowledge_base_fts (rowid, fact) VALUES (new.id, new.fact);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_delete AFTER DELETE ON knowledge_base BEGIN
+            INSERT INTO knowledge_base_fts (knowledge_base_fts, rowid, fact) VALUES ('delete', old.id, old.fact);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_update AFTER UPDATE OF fact ON knowledge_base BEGIN
+            INSERT INTO knowledge_base_fts (knowledge_base_fts, rowid, fact) VALUES ('delete', old.id, old.fact);
+            INSERT INTO knowledge_base_fts (rowid, fact) VALUES (new.id, new.fact);
+        END
+    ''')
+    # Indexa os fatos que já existiam antes da migração.
+    c.execute("INSERT INTO knowledge_base_fts (knowledge_base_fts) VALUES ('rebuild')")
+    return True
+
+def _migration_003_conversation_state(c):
+    # Estado das conversas compartilhado entre workers (ver conversation_state.py).
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            conversation_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_conversation_state_expires ON conversation_state (expires_at)')
+
+def _migration_004_response_cache(c):
+    # Camada persistente do cache de respostas do LLM (ver response_cache.py).
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_hit_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_last_hit ON response_cache (last_hit_at)')
+    # Pares chave/valor de uso interno (ex.: a geração atual do cache).
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS app_metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+def _migration_005_conversation_summary(c):
+    # Resumo acumulado das mensagens antigas de cada conversa (ver context_builder.py).
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_summary (
+            conversation_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_until_id INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_006_logs_retention(c):
+    # Consulta paginada dos logs (por tipo ou não) e poda por idade (ver log_retention.py).
+    c.execute('CREATE INDEX IF NOT EXISTS idx_logs_type_id ON logs (log_type, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)')
+    # Contagem por hora e tipo dos logs já removidos pela retenção.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS log_rollup (
+            hour TEXT NOT NULL,
+            log_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (hour, log_type)
+        )
+    ''')
+
+MIGRATIONS = [
+    (1, "Índices para histórico, conceitos e regras ativas", _migration_001_indexes),
+    (2, "Índice FTS5 da base de conhecimento", _migration_002_knowledge_base_fts),
+    (3, "Tabela de estado das conversas", _migration_003_conversation_state),
+    (4, "Cache persistente de respostas do LLM", _migration_004_response_cache),
+    (5, "Resumos de conversas", _migration_005_conversation_summary),
+    (6, "Índices e resumo por hora dos logs", _migration_006_logs_retention),
+]
+
+def get_schema_version(c):
+    """Retorna a versão atual do schema (0 para bancos sem migrações)."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    row = c.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()
+    return row[0]
+
+def run_migrations():
+    """
+    Aplica as migrações pendentes, cada uma em sua própria transação.
+    BEGIN IMMEDIATE garante que, com vários workers iniciando ao mesmo tempo,
+    apenas um aplique cada migração.
+    """
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        with db_connection() as conn:
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            if get_schema_version(c) >= version:
+                continue
+            migrate(c)
+            c.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+            applied.append(version)
+    return applied
+
+def ensure_knowledge_base_fts():
+    """
+    Cria o índice FTS5 caso a migração 2 tenha sido aplicada num SQLite sem
+    FTS5 (ex.: o binário foi atualizado depois). Retorna True se o índice existe.
+    """
+    with db_connection() as conn:
+        c = conn.cursor()
+        if _knowledge_base_fts_exists(c):
+            return True
+        c.execute('BEGIN IMMEDIATE')
+        if _knowledge_base_fts_exists(c):
+            return True
+        return _create_knowledge_base_fts(c)
+
+# --- Verificação rápida na inicialização ---
+# create_schema grava a versão do schema no cabeçalho do arquivo (PRAGMA
+# user_version). Na inicialização, basta ler esse marcador: o DDL e as
+# migrações só rodam se o banco estiver desatualizado, e uma única vez por
+# arquivo em cada processo (com o preload do Gunicorn, só no processo mestre).
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+_checked_paths = set()
+
+def schema_is_current():
+    """Indica se o marcador de versão do banco corresponde ao schema atual."""
+    with db_connection() as conn:
+        return conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION
+
+def ensure_schema():
+    """
+    Garante o schema do banco, executando create_schema apenas quando
+    necessário. Retorna True se o schema precisou ser criado ou atualizado.
+    """
+    if DB_PATH in _checked_paths:
+        return False
+    if schema_is_current():
+        _checked_paths.add(DB_PATH)
+        return False
+    create_schema()
+    return True
 
 if __name__ == '__main__':
     create_schema()
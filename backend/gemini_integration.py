@@ -1,65 +1,364 @@
+import hashlib
+import json
 import os
-import google.generativeai as genai
+import threading
 from knowledge_base_manager import log_message
+from llm_gateway import llm_gateway, LLMOverloaded
+from response_cache import response_cache, cache_enabled
+from connection_pool import run_in_db_thread
+from metrics import instrumented, llm_seconds, llm_api_calls
+from startup import startup_phase
+from config import STARTUP_LAZY_IMPORTS
 
 # Carrega a chave da API no início, mas não lança erro aqui.
 API_KEY = os.getenv('GEMINI_API_KEY')
 CONFIGURABLE_MODEL_NAME = os.getenv('GEMINI_MODEL_NAME', 'gemini-1.5-pro-latest')
 
+# O SDK (google.generativeai) é a importação mais pesada do backend. Com
+# STARTUP_LAZY_IMPORTS ele só é importado e configurado na primeira chamada
+# ao modelo, e não durante a inicialização de cada worker.
+_genai = None
 _is_configured = False
-if API_KEY:
-    try:
-        genai.configure(api_key=API_KEY)
-        _is_configured = True
-        print("Integração com Gemini API configurada com sucesso.")
-    except Exception as e:
-        log_message("ERROR", f"Falha ao configurar a API Gemini com a chave fornecida: {e}")
+_genai_lock = threading.Lock()
+
+def _load_sdk():
+    """Importa e configura o SDK do Gemini, uma única vez por processo."""
+    global _genai, _is_configured
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                with startup_phase('sdk_import'):
+                    import google.generativeai as genai
+                if API_KEY:
+                    try:
+                        genai.configure(api_key=API_KEY)
+                        _is_configured = True
+                        print("Integração com Gemini API configurada com sucesso.")
+                    except Exception as e:
+                        log_message("ERROR", f"Falha ao configurar a API Gemini com a chave fornecida: {e}")
+                _genai = genai
+    return _genai
+
+if not STARTUP_LAZY_IMPORTS:
+    _load_sdk()
+
+# Instâncias de GenerativeModel reutilizadas entre as chamadas, por nome de modelo.
+_models = {}
+_models_lock = threading.Lock()
+
+def _get_model(model_name: str = CONFIGURABLE_MODEL_NAME):
+    """Retorna a instância compartilhada do modelo, criando-a no primeiro uso."""
+    model = _models.get(model_name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = _load_sdk().GenerativeModel(model_name)
+                _models[model_name] = model
+    return model
 
 def _check_api_key():
     """Verifica se a API está configurada antes de fazer uma chamada."""
+    if API_KEY:
+        _load_sdk()
     if not _is_configured:
         log_message("ERROR", "A API do Gemini não está configurada. Uma chave é necessária.")
         # Esta mensagem será retornada ao usuário se a chave não estiver configurada.
         raise ValueError("A funcionalidade principal de IA não está disponível. A chave da API do Gemini não foi configurada no backend.")
 
-def generate_collaborative_response(prompt: str, conversation_history: list = None):
+def _build_history(conversation_history: list = None, knowledge: list = None):
+    """
+    Monta o histórico enviado ao modelo. Fatos recuperados da base de
+    conhecimento são apresentados como um turno inicial de contexto.
+    """
+    history = list(conversation_history or [])
+    if knowledge:
+        facts = "\n".join(f"- {item['fact']}" for item in knowledge)
+        history = [
+            {"role": "user", "parts": [{"text": f"Fatos que você aprendeu com os usuários e pode usar nas respostas:\n{facts}"}]},
+            {"role": "model", "parts": [{"text": "Entendido. Vou considerar esses fatos."}]},
+        ] + history
+    return history
+
+def _flight_key(prompt: str, conversation_history: list, knowledge: list, use_cache: bool):
+    """
+    Chave de coalescência de uma geração: o pedido completo enviado ao modelo.
+    Com use_cache=False o cliente pediu uma resposta nova, e nada é compartilhado.
+    """
+    if not use_cache:
+        return None
+    payload = json.dumps([CONFIGURABLE_MODEL_NAME, prompt, conversation_history or [], knowledge or []],
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return ('chat', hashlib.sha256(payload.encode('utf-8')).hexdigest())
+
+def _start_chat(conversation_history: list, knowledge: list):
+    _check_api_key()
+    return _get_model().start_chat(history=_build_history(conversation_history, knowledge))
+
+def _send_chat(prompt: str, conversation_history: list, knowledge: list):
+    """Uma tentativa de geração, sem cache (ver llm_gateway.call)."""
+    chat = _start_chat(conversation_history, knowledge)
+    llm_api_calls.inc(operation='chat')
+    response = chat.send_message(prompt)
+    log_message("INFO", f"Resposta gerada com sucesso pelo modelo {CONFIGURABLE_MODEL_NAME}.")
+    return response.text
+
+def _open_chat_stream(prompt: str, conversation_history: list, knowledge: list):
+    chat = _start_chat(conversation_history, knowledge)
+    llm_api_calls.inc(operation='chat_stream')
+    return chat.send_message(prompt, stream=True)
+
+async def _send_chat_async(prompt: str, conversation_history: list, knowledge: list):
+    chat = _start_chat(conversation_history, knowledge)
+    llm_api_calls.inc(operation='chat')
+    response = await chat.send_message_async(prompt)
+    log_message("INFO", f"Resposta gerada com sucesso pelo modelo {CONFIGURABLE_MODEL_NAME}.")
+    return response.text
+
+async def _open_chat_stream_async(prompt: str, conversation_history: list, knowledge: list):
+    chat = _start_chat(conversation_history, knowledge)
+    llm_api_calls.inc(operation='chat_stream')
+    return await chat.send_message_async(prompt, stream=True)
+
+@instrumented(llm_seconds, 'generate_collaborative_response')
+def generate_collaborative_response(prompt: str, conversation_history: list = None, knowledge: list = None, use_cache: bool = True):
     """
-    Gera uma resposta consultando o LLM (Gemini), usando o histórico da conversa como contexto.
+    Gera uma resposta consultando o LLM (Gemini), usando o histórico da conversa
+    e os fatos recuperados da base de conhecimento como contexto.
+    Respostas idênticas já geradas são servidas do cache, exceto com use_cache=False.
+    A chamada passa pelo llm_gateway: requisições idênticas em andamento
+    compartilham a mesma resposta e, sem vaga, LLMOverloaded é propagada.
     """
+    cache_key = None
+    if cache_enabled(use_cache):
+        cache_key = response_cache.make_key(CONFIGURABLE_MODEL_NAME, prompt, conversation_history, knowledge)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            log_message("INFO", f"Resposta servida do cache para o modelo {CONFIGURABLE_MODEL_NAME}.")
+            return cached
+
+    def generate():
+        text = llm_gateway.call(lambda: _send_chat(prompt, conversation_history, knowledge))
+        if cache_key is not None:
+            response_cache.put(cache_key, CONFIGURABLE_MODEL_NAME, text)
+        return text
+
+    try:
+        return llm_gateway.coalesce(_flight_key(prompt, conversation_history, knowledge, use_cache), generate)
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        log_message("ERROR", f"Erro ao interagir com a API Gemini: {e}")
+        return f"Desculpe, ocorreu um erro interno ao processar sua solicitação: {e}"
+
+@instrumented(llm_seconds, 'stream_collaborative_response')
+def stream_collaborative_response(prompt: str, conversation_history: list = None, knowledge: list = None, use_cache: bool = True):
+    """
+    Versão em streaming de generate_collaborative_response.
+    Gera os trechos de texto à medida que o modelo os produz; respostas em
+    cache são entregues em um único trecho.
+    """
+    cache_key = None
+    if cache_enabled(use_cache):
+        cache_key = response_cache.make_key(CONFIGURABLE_MODEL_NAME, prompt, conversation_history, knowledge)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            log_message("INFO", f"Resposta servida do cache para o modelo {CONFIGURABLE_MODEL_NAME}.")
+            yield cached
+            return
+    chunks = []
+    try:
+        # A vaga fica ocupada enquanto a resposta é transmitida; só a abertura
+        # do stream é repetida em caso de erro transitório.
+        with llm_gateway.slot():
+            response = llm_gateway.retry(lambda: _open_chat_stream(prompt, conversation_history, knowledge))
+            for chunk in response:
+                # Trechos sem texto (ex.: apenas metadados de segurança) são ignorados.
+                text = getattr(chunk, 'text', '') if chunk.parts else ''
+                if text:
+                    chunks.append(text)
+                    yield text
+        log_message("INFO", f"Resposta transmitida com sucesso pelo modelo {CONFIGURABLE_MODEL_NAME}.")
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        log_message("ERROR", f"Erro ao interagir com a API Gemini (streaming): {e}")
+        yield f"Desculpe, ocorreu um erro interno ao processar sua solicitação: {e}"
+        return
+    if cache_key is not None and chunks:
+        response_cache.put(cache_key, CONFIGURABLE_MODEL_NAME, ''.join(chunks))
+
+# --- Versões assíncronas (modo ASGI, ver asgi_main.py) ---
+# Usam as chamadas *_async do SDK, que não ocupam uma thread enquanto esperam
+# pela API; a leitura e a gravação do cache de respostas rodam nas threads de
+# banco (run_in_db_thread).
+
+@instrumented(llm_seconds, 'generate_collaborative_response_async')
+async def generate_collaborative_response_async(prompt: str, conversation_history: list = None, knowledge: list = None, use_cache: bool = True):
+    """Versão assíncrona de generate_collaborative_response."""
+    cache_key = None
+    if cache_enabled(use_cache):
+        cache_key = response_cache.make_key(CONFIGURABLE_MODEL_NAME, prompt, conversation_history, knowledge)
+        cached = await run_in_db_thread(response_cache.get, cache_key)
+        if cached is not None:
+            log_message("INFO", f"Resposta servida do cache para o modelo {CONFIGURABLE_MODEL_NAME}.")
+            return cached
+
+    async def generate():
+        text = await llm_gateway.call_async(lambda: _send_chat_async(prompt, conversation_history, knowledge))
+        if cache_key is not None:
+            await run_in_db_thread(response_cache.put, cache_key, CONFIGURABLE_MODEL_NAME, text)
+        return text
+
     try:
-        _check_api_key()
-        model = genai.GenerativeModel(CONFIGURABLE_MODEL_NAME)
-        chat = model.start_chat(history=conversation_history or [])
-        response = chat.send_message(prompt)
-        log_message("INFO", f"Resposta gerada com sucesso pelo modelo {CONFIGURABLE_MODEL_NAME}.")
-        return response.text
+        return await llm_gateway.coalesce_async(_flight_key(prompt, conversation_history, knowledge, use_cache), generate)
+    except LLMOverloaded:
+        raise
     except Exception as e:
         log_message("ERROR", f"Erro ao interagir com a API Gemini: {e}")
         return f"Desculpe, ocorreu um erro interno ao processar sua solicitação: {e}"
 
+@instrumented(llm_seconds, 'stream_collaborative_response_async')
+async def stream_collaborative_response_async(prompt: str, conversation_history: list = None, knowledge: list = None, use_cache: bool = True):
+    """Versão assíncrona de stream_collaborative_response."""
+    cache_key = None
+    if cache_enabled(use_cache):
+        cache_key = response_cache.make_key(CONFIGURABLE_MODEL_NAME, prompt, conversation_history, knowledge)
+        cached = await run_in_db_thread(response_cache.get, cache_key)
+        if cached is not None:
+            log_message("INFO", f"Resposta servida do cache para o modelo {CONFIGURABLE_MODEL_NAME}.")
+            yield cached
+            return
+    chunks = []
+    try:
+        async with llm_gateway.slot_async():
+            response = await llm_gateway.retry_async(lambda: _open_chat_stream_async(prompt, conversation_history, knowledge))
+            async for chunk in response:
+                text = getattr(chunk, 'text', '') if chunk.parts else ''
+                if text:
+                    chunks.append(text)
+                    yield text
+        log_message("INFO", f"Resposta transmitida com sucesso pelo modelo {CONFIGURABLE_MODEL_NAME}.")
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        log_message("ERROR", f"Erro ao interagir com a API Gemini (streaming): {e}")
+        yield f"Desculpe, ocorreu um erro interno ao processar sua solicitação: {e}"
+        return
+    if cache_key is not None and chunks:
+        await run_in_db_thread(response_cache.put, cache_key, CONFIGURABLE_MODEL_NAME, ''.join(chunks))
+
+def _summary_prompt(previous_summary: str, messages: list, max_words: int):
+    transcript = "\n".join(f"{'Usuário' if role == 'user' else 'JARVIS'}: {text}" for role, text in messages)
+    return f"""
+        Atualize o resumo de uma conversa entre um usuário e o assistente JARVIS.
+        Mantenha nomes, fatos, preferências e pedidos em aberto; omita cumprimentos.
+        Responda apenas com o novo resumo, em no máximo {max_words} palavras.
+
+        Resumo anterior: "{previous_summary or '(nenhum)'}"
+
+        Novas mensagens:
+        {transcript}
+
+        Novo resumo:
+    """
+
+def _parse_summary(response):
+    summary = response.text.strip()
+    if not summary:
+        raise ValueError("O modelo retornou um resumo vazio.")
+    return summary
+
+@instrumented(llm_seconds, 'summarize_history')
+def summarize_history(previous_summary: str, messages: list, max_words: int):
+    """
+    Pede ao LLM um resumo atualizado da conversa: o resumo anterior mais as
+    mensagens (lista de (papel, texto)) que saíram da janela de contexto.
+    Propaga as exceções da API para que o chamador use outra estratégia.
+    """
+    _check_api_key()
+    model = _get_model()
+    structured_prompt = _summary_prompt(previous_summary, messages, max_words)
+
+    def send():
+        llm_api_calls.inc(operation='summary')
+        return model.generate_content(structured_prompt)
+
+    return _parse_summary(llm_gateway.call(send))
+
+@instrumented(llm_seconds, 'summarize_history_async')
+async def summarize_history_async(previous_summary: str, messages: list, max_words: int):
+    """Versão assíncrona de summarize_history."""
+    _check_api_key()
+    model = _get_model()
+    structured_prompt = _summary_prompt(previous_summary, messages, max_words)
+
+    def send():
+        llm_api_calls.inc(operation='summary')
+        return model.generate_content_async(structured_prompt)
+
+    return _parse_summary(await llm_gateway.call_async(send))
+
+# Intenções reconhecidas pelo JARVIS.
+VALID_INTENTS = ('ensinar_regra', 'ensinar_fato', 'conversa_geral')
+
+def _intent_prompt(prompt: str):
+    return f"""
+        Analise o seguinte texto e identifique a intenção do usuário.
+        As intenções possíveis são: 'ensinar_regra', 'ensinar_fato', 'conversa_geral'.
+        Retorne apenas uma das três opções.
+
+        Texto do usuário: "{prompt}"
+
+        Intenção:
+    """
+
+def _parse_intent(prompt: str, response):
+    intent = response.text.strip().lower()
+    log_message("INFO", f"Intenção identificada para '{prompt}': {intent}")
+    # Validação simples da resposta do modelo
+    if intent in VALID_INTENTS:
+        return intent
+    return 'conversa_geral'
+
+@instrumented(llm_seconds, 'request_intent')
+def request_intent(prompt: str):
+    """
+    Pede ao LLM a classificação da intenção do usuário.
+    Diferente de analyze_intent, propaga as exceções da API, permitindo ao
+    chamador distinguir uma classificação real de uma falha.
+    """
+    _check_api_key()
+    model = _get_model()
+
+    def send():
+        llm_api_calls.inc(operation='intent')
+        return model.generate_content(_intent_prompt(prompt))
+
+    return llm_gateway.coalesce(('intent', prompt), lambda: _parse_intent(prompt, llm_gateway.call(send)))
+
+@instrumented(llm_seconds, 'request_intent_async')
+async def request_intent_async(prompt: str):
+    """Versão assíncrona de request_intent."""
+    _check_api_key()
+    model = _get_model()
+
+    def send():
+        llm_api_calls.inc(operation='intent')
+        return model.generate_content_async(_intent_prompt(prompt))
+
+    async def classify():
+        return _parse_intent(prompt, await llm_gateway.call_async(send))
+
+    return await llm_gateway.coalesce_async(('intent', prompt), classify)
+
+@instrumented(llm_seconds, 'analyze_intent')
 def analyze_intent(prompt: str):
     """
     Usa o LLM para analisar a intenção do usuário.
     """
     try:
-        _check_api_key()
-        model = genai.GenerativeModel(CONFIGURABLE_MODEL_NAME)
-        structured_prompt = f"""
-            Analise o seguinte texto e identifique a intenção do usuário.
-            As intenções possíveis são: 'ensinar_regra', 'ensinar_fato', 'conversa_geral'.
-            Retorne apenas uma das três opções.
-
-            Texto do usuário: "{prompt}"
-
-            Intenção:
-        """
-        response = model.generate_content(structured_prompt)
-        intent = response.text.strip().lower()
-        log_message("INFO", f"Intenção identificada para '{prompt}': {intent}")
-        # Validação simples da resposta do modelo
-        if intent in ['ensinar_regra', 'ensinar_fato', 'conversa_geral']:
-            return intent
-        return 'conversa_geral'
+        return request_intent(prompt)
     except Exception as e:
         log_message("ERROR", f"Erro na análise de intenção com a API Gemini: {e}")
         return 'conversa_geral'
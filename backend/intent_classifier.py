@@ -0,0 +1,179 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from gemini_integration import request_intent, request_intent_async
+from knowledge_base_manager import log_message
+from metrics import register_collector
+from config import INTENT_LOCAL_CLASSIFIER, INTENT_CACHE_SIZE
+
+# --- Camada 1: classificador local por padrões ---
+# Os padrões são aplicados sobre o texto normalizado (minúsculo e sem acentos)
+# e só cobrem os casos em que a intenção é inequívoca. Todo o resto segue
+# para o cache e, por fim, para o LLM.
+_TEACH_RULE_PATTERNS = [
+    re.compile(r"\b(quero|vou|queria|posso|gostaria de) (te |lhe )?ensinar (uma |a |essa |esta |outra |nova )?regra\b"),
+    re.compile(r"\b(aprenda|aprender|anote|grave|memorize) (uma |essa |esta |a |nova |outra )?(nova )?regra\b"),
+    re.compile(r"^(nova regra|ensinar regra)\b"),
+]
+
+_TEACH_FACT_PATTERNS = [
+    re.compile(r"\b(quero|vou|queria|posso|gostaria de) (te |lhe )?ensinar (um fato|uma coisa|algo|uma informacao)\b"),
+    re.compile(r"^(aprenda|saiba|lembre-se de|lembre-se|lembre|memorize|anote|grave) que\b"),
+    re.compile(r"^(fato|novo fato):"),
+]
+
+_GENERAL_PATTERNS = [
+    re.compile(r"^(oi|ola|opa|e ai|hey|bom dia|boa tarde|boa noite|tudo bem|tudo bom|como vai)(,? jarvis)?$"),
+    re.compile(r"^(obrigad[oa]|valeu|tchau|ate logo|ate mais|ok|certo|beleza|entendi)(,? jarvis)?$"),
+    re.compile(r"^(o que|qual|quais|quem|quando|onde|por que|porque|quanto|quantos|quantas|como)\b.*\?$"),
+]
+
+# Perguntas que mencionam aprendizado são deixadas para o LLM decidir.
+_TEACHING_WORDS = re.compile(r"\b(ensin\w*|aprend\w*|regra\w*|fato\w*|memoriz\w*)\b")
+
+def normalize_prompt(prompt: str):
+    """Normaliza o prompt: minúsculas, sem acentos e com espaços colapsados."""
+    text = unicodedata.normalize('NFKD', prompt.casefold())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = ' '.join(text.split())
+    return text.strip(' .!')
+
+def classify_locally(normalized: str):
+    """Retorna a intenção quando o texto é inequívoco, ou None."""
+    for pattern in _TEACH_RULE_PATTERNS:
+        if pattern.search(normalized):
+            return 'ensinar_regra'
+    for pattern in _TEACH_FACT_PATTERNS:
+        if pattern.search(normalized):
+            return 'ensinar_fato'
+    if _TEACHING_WORDS.search(normalized):
+        return None
+    for pattern in _GENERAL_PATTERNS:
+        if pattern.search(normalized):
+            return 'conversa_geral'
+    return None
+
+
+class IntentCache:
+    """Cache LRU das intenções retornadas pelo LLM, chaveado pelo prompt normalizado."""
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            intent = self._entries.get(key)
+            if intent is not None:
+                self._entries.move_to_end(key)
+            return intent
+
+    def put(self, key: str, intent: str):
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = intent
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+intent_cache = IntentCache(INTENT_CACHE_SIZE)
+
+# Contadores de acertos/erros por camada.
+_stats_lock = threading.Lock()
+_stats = {
+    "local": {"hits": 0, "misses": 0},
+    "cache": {"hits": 0, "misses": 0},
+    "remote": {"calls": 0, "errors": 0},
+}
+
+def _count(tier: str, field: str):
+    with _stats_lock:
+        _stats[tier][field] += 1
+
+def classify_intent(prompt: str):
+    """
+    Classifica a intenção do usuário em camadas:
+    1. padrões locais para os casos inequívocos;
+    2. cache LRU de classificações anteriores do LLM;
+    3. chamada ao LLM (request_intent) apenas como último recurso.
+    """
+    normalized, intent = _classify_without_llm(prompt)
+    if intent is not None:
+        return intent
+
+    _count("remote", "calls")
+    try:
+        intent = request_intent(prompt)
+    except Exception as e:
+        return _remote_failure(e)
+    intent_cache.put(normalized, intent)
+    return intent
+
+async def classify_intent_async(prompt: str):
+    """Versão assíncrona de classify_intent; só a chamada ao LLM é aguardada."""
+    normalized, intent = _classify_without_llm(prompt)
+    if intent is not None:
+        return intent
+
+    _count("remote", "calls")
+    try:
+        intent = await request_intent_async(prompt)
+    except Exception as e:
+        return _remote_failure(e)
+    intent_cache.put(normalized, intent)
+    return intent
+
+def _classify_without_llm(prompt: str):
+    """Camadas 1 e 2: retorna (prompt normalizado, intenção ou None)."""
+    normalized = normalize_prompt(prompt)
+
+    if INTENT_LOCAL_CLASSIFIER:
+        intent = classify_locally(normalized)
+        if intent is not None:
+            _count("local", "hits")
+            return normalized, intent
+        _count("local", "misses")
+
+    intent = intent_cache.get(normalized)
+    if intent is not None:
+        _count("cache", "hits")
+        return normalized, intent
+    _count("cache", "misses")
+    return normalized, None
+
+def _remote_failure(error: Exception):
+    # Falhas não são armazenadas no cache, para que a próxima tentativa
+    # possa obter uma classificação real.
+    _count("remote", "errors")
+    log_message("ERROR", f"Erro na análise de intenção com a API Gemini: {error}")
+    return 'conversa_geral'
+
+def get_intent_stats():
+    """Retorna os contadores por camada e o tamanho atual do cache."""
+    with _stats_lock:
+        stats = {tier: dict(counters) for tier, counters in _stats.items()}
+    stats["cache"]["size"] = len(intent_cache)
+    return stats
+
+def _collect_metrics():
+    stats = get_intent_stats()
+    return {
+        "jarvis_intent_classifier_total": ("counter", "Resultados por camada do classificador de intenção.", {
+            (("result", result), ("tier", tier)): value
+            for tier, counters in stats.items()
+            for result, value in counters.items()
+            if result != "size"
+        }),
+        "jarvis_intent_cache_entries": ("gauge", "Entradas no cache de intenções.", {
+            (): stats["cache"]["size"],
+        }),
+    }
+
+register_collector(_collect_metrics)
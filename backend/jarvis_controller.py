@@ -1,11 +1,26 @@
 from rule_engine import process_rules
 from learning_module import learn_new_rule, learn_new_fact
-from gemini_integration import generate_collaborative_response, analyze_intent
+from gemini_integration import (
+    generate_collaborative_response,
+    stream_collaborative_response,
+    generate_collaborative_response_async,
+    stream_collaborative_response_async
+)
+from intent_classifier import classify_intent, classify_intent_async
 from knowledge_base_manager import (
     add_message_to_history,
-    get_conversation_history,
+    search_facts,
     log_message
 )
+from connection_pool import run_in_db_thread
+from conversation_state import conversation_states
+from context_builder import load_conversation_context, complete_conversation_context, complete_conversation_context_async
+from config import FACT_RETRIEVAL_ENABLED, PIPELINE_CONCURRENT, PIPELINE_MAX_WORKERS
+from metrics import timed_stage
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import inspect
 import uuid
 
 # Mapeamento de intenções para ações
@@ -15,51 +30,251 @@ intent_actions = {
     'conversa_geral': 'general_conversation',
 }
 
-# Gerenciamento de estado de conversação para aprendizado interativo
-# TODO: Mover o estado da conversa para o banco de dados para persistência.
-conversation_states = {}
+# O estado de conversação para aprendizado interativo fica no banco de dados
+# (ver conversation_state.py), compartilhado entre os workers.
+
+# Threads para as etapas independentes do processamento de uma mensagem.
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix="jarvis-pipeline")
+
+def _run_stage(name: str, func, *args):
+    """Executa uma etapa medindo sua duração (ver metrics.py)."""
+    with timed_stage(name):
+        return func(*args)
+
+def _submit_stage(name: str, func, *args):
+    """Executa a etapa no pool de threads, preservando o contexto da requisição."""
+    return _executor.submit(contextvars.copy_context().run, _run_stage, name, func, *args)
 
-def process_chat_message(prompt: str, conversation_id: str = None):
+def _llm_context(prompt: str, conversation_id: str):
     """
-    Processa a mensagem de chat do usuário, orquestrando as diferentes
-    partes do JARVIS.
+    Reúne o contexto da conversa (ver context_builder) e os fatos relevantes
+    para o LLM. Só faz leituras: roda especulativamente e pode ser descartado.
     """
-    if not conversation_id:
-        conversation_id = str(uuid.uuid4())
+    context = load_conversation_context(conversation_id)
+    knowledge = search_facts(prompt) if FACT_RETRIEVAL_ENABLED else []
+    return context, knowledge
 
-    # 1. Adiciona a mensagem do usuário ao histórico
-    add_message_to_history(conversation_id, 'user', [{"text": prompt}])
+def _route_message(prompt: str, conversation_id: str):
+    """
+    Executa as etapas que não dependem da geração pelo LLM.
+    Retorna (texto, origem, contexto), onde origem é 'rule' para respostas do
+    motor de regras e 'message' para as demais. Texto None indica que o LLM
+    deve ser consultado; nesse caso contexto traz (histórico, fatos).
 
+    A análise de intenção, o processamento de regras e a busca do contexto do
+    LLM são independentes entre si e rodam em paralelo. O resultado é o mesmo
+    da execução sequencial: a intenção continua tendo precedência sobre as
+    regras, e o contexto buscado especulativamente é descartado (ou cancelado,
+    se ainda não começou) quando não é necessário. Por isso essa busca só faz
+    leituras; o resumo da conversa só é atualizado depois que o roteamento
+    escolheu o LLM.
+    """
     # 2. Verifica o estado atual da conversa
-    current_state = conversation_states.get(conversation_id)
+    current_state = _run_stage('state', conversation_states.get, conversation_id)
 
     if current_state == 'awaiting_rule_definition':
         # Usuário está definindo uma regra
-        response_text = learn_new_rule(prompt)
-        conversation_states.pop(conversation_id, None) # Limpa o estado
+        response_text = _run_stage('learning', learn_new_rule, prompt)
+        conversation_states.clear(conversation_id) # Limpa o estado
+        return response_text, 'message', None
+
+    if PIPELINE_CONCURRENT:
+        # 3. Análise de Intenção e busca do contexto em segundo plano
+        intent_future = _submit_stage('intent', classify_intent, prompt)
+        context_future = _submit_stage('context', _llm_context, prompt, conversation_id)
     else:
-        # 3. Análise de Intenção
-        intent = analyze_intent(prompt)
+        intent_future = context_future = None
+
+    if "quero te ensinar uma regra" in prompt.lower():
+        # A frase explícita dispensa o resultado da análise de intenção.
+        action = 'learning_rule'
+    else:
+        # 4. Processamento de Regras (em memória) enquanto a intenção é analisada
+        rule_response = _run_stage('rules', process_rules, prompt) if PIPELINE_CONCURRENT else None
+        intent = intent_future.result() if intent_future else _run_stage('intent', classify_intent, prompt)
         action = intent_actions.get(intent, 'general_conversation')
 
-        if action == 'learning_rule' or "quero te ensinar uma regra" in prompt.lower():
-            response_text = "Ótimo! Por favor, me diga a regra. Tente usar um formato como 'Se [condição], então [ação ou conclusão]'."
-            conversation_states[conversation_id] = 'awaiting_rule_definition'
-        elif action == 'learning_fact':
-            response_text = learn_new_fact(prompt)
-        else: # Conversa geral
-            # 4. Processamento de Regras
-            rule_response = process_rules(prompt)
-            if rule_response:
-                response_text = rule_response
-                log_message("INFO", f"Regra acionada para o prompt: '{prompt}'. Resposta: '{response_text}'")
-            else:
-                # 5. Se nenhuma regra for acionada, consulta o LLM
-                history = get_conversation_history(conversation_id)
-                response_text = generate_collaborative_response(prompt, history)
-                log_message("INFO", f"Nenhuma regra acionada. Consultando o LLM para o prompt: '{prompt}'")
+    if action != 'general_conversation' and context_future:
+        context_future.cancel()
+        intent_future.cancel()
+
+    if action == 'learning_rule':
+        conversation_states.set(conversation_id, 'awaiting_rule_definition')
+        return "Ótimo! Por favor, me diga a regra. Tente usar um formato como 'Se [condição], então [ação ou conclusão]'.", 'message', None
+    if action == 'learning_fact':
+        return _run_stage('learning', learn_new_fact, prompt), 'message', None
+
+    # Conversa geral
+    if not PIPELINE_CONCURRENT:
+        rule_response = _run_stage('rules', process_rules, prompt)
+    if rule_response:
+        if context_future:
+            context_future.cancel()
+        log_message("INFO", f"Regra acionada para o prompt: '{prompt}'. Resposta: '{rule_response}'")
+        return rule_response, 'rule', None
+
+    # 5. Nenhuma regra acionada: o LLM deve ser consultado. Só agora o resumo
+    # da conversa é atualizado, se necessário.
+    context, knowledge = context_future.result() if context_future else _run_stage('context', _llm_context, prompt, conversation_id)
+    history = _run_stage('summary', complete_conversation_context, context)
+    return None, 'llm', (history, knowledge)
+
+def process_chat_message(prompt: str, conversation_id: str = None, use_cache: bool = True):
+    """
+    Processa a mensagem de chat do usuário, orquestrando as diferentes
+    partes do JARVIS. Com use_cache=False a resposta do LLM não vem do cache.
+    """
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+
+    # 1. Adiciona a mensagem do usuário ao histórico
+    _run_stage('history_user', add_message_to_history, conversation_id, 'user', [{"text": prompt}])
+
+    response_text, _, context = _route_message(prompt, conversation_id)
+    if response_text is None:
+        # 5. Se nenhuma regra for acionada, consulta o LLM
+        history, knowledge = context
+        response_text = _run_stage('llm', generate_collaborative_response, prompt, history, knowledge, use_cache)
+        log_message("INFO", f"Nenhuma regra acionada. Consultando o LLM para o prompt: '{prompt}'")
 
     # 6. Adiciona a resposta do modelo ao histórico
-    add_message_to_history(conversation_id, 'model', [{"text": response_text}])
+    _run_stage('history_model', add_message_to_history, conversation_id, 'model', [{"text": response_text}])
+
+    return {"text": response_text, "conversation_id": conversation_id}
+
+def stream_chat_message(prompt: str, conversation_id: str = None, use_cache: bool = True):
+    """
+    Versão em streaming de process_chat_message.
+    Gera tuplas (evento, dados): respostas que não vêm do LLM (incluindo as do
+    motor de regras) são enviadas em um único evento; respostas do LLM são
+    enviadas como eventos 'token' e finalizadas por um evento 'done'.
+    A resposta completa é gravada no histórico quando o stream termina.
+    """
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+
+    _run_stage('history_user', add_message_to_history, conversation_id, 'user', [{"text": prompt}])
+
+    response_text, source, context = _route_message(prompt, conversation_id)
+    if response_text is not None:
+        add_message_to_history(conversation_id, 'model', [{"text": response_text}])
+        yield source, {"text": response_text, "conversation_id": conversation_id}
+        return
+
+    history, knowledge = context
+    log_message("INFO", f"Nenhuma regra acionada. Consultando o LLM (streaming) para o prompt: '{prompt}'")
+    chunks = []
+    try:
+        yield 'start', {"conversation_id": conversation_id}
+        for chunk in stream_collaborative_response(prompt, history, knowledge, use_cache):
+            chunks.append(chunk)
+            yield 'token', {"text": chunk}
+    finally:
+        # Grava o que foi gerado mesmo que o cliente tenha se desconectado.
+        response_text = ''.join(chunks)
+        if response_text:
+            add_message_to_history(conversation_id, 'model', [{"text": response_text}])
+    yield 'done', {"text": response_text, "conversation_id": conversation_id}
+
+
+# --- Versões assíncronas (modo ASGI, ver asgi_main.py) ---
+# Mesma lógica das funções acima, mas as etapas rodam como tarefas do event
+# loop: as chamadas ao LLM são aguardadas sem ocupar threads e o acesso ao
+# banco roda nas threads de banco (run_in_db_thread).
+
+async def _run_stage_async(name: str, func, *args):
+    """Executa uma etapa medindo sua duração; funções bloqueantes vão para uma thread de banco."""
+    with timed_stage(name):
+        if inspect.iscoroutinefunction(func):
+            return await func(*args)
+        return await run_in_db_thread(func, *args)
+
+async def _route_message_async(prompt: str, conversation_id: str):
+    """Versão assíncrona de _route_message."""
+    current_state = await _run_stage_async('state', conversation_states.get, conversation_id)
+
+    if current_state == 'awaiting_rule_definition':
+        response_text = await _run_stage_async('learning', learn_new_rule, prompt)
+        await run_in_db_thread(conversation_states.clear, conversation_id)
+        return response_text, 'message', None
+
+    # O contexto do LLM é buscado em paralelo e descartado se não for usado.
+    context_task = asyncio.create_task(_run_stage_async('context', _llm_context, prompt, conversation_id))
+    try:
+        rule_response = None
+        if "quero te ensinar uma regra" in prompt.lower():
+            action = 'learning_rule'
+        else:
+            intent_task = asyncio.create_task(_run_stage_async('intent', classify_intent_async, prompt))
+            try:
+                rule_response = await _run_stage_async('rules', process_rules, prompt)
+                intent = await intent_task
+            finally:
+                intent_task.cancel()
+            action = intent_actions.get(intent, 'general_conversation')
+
+        if action == 'learning_rule':
+            await run_in_db_thread(conversation_states.set, conversation_id, 'awaiting_rule_definition')
+            return "Ótimo! Por favor, me diga a regra. Tente usar um formato como 'Se [condição], então [ação ou conclusão]'.", 'message', None
+        if action == 'learning_fact':
+            return await _run_stage_async('learning', learn_new_fact, prompt), 'message', None
+        if rule_response:
+            log_message("INFO", f"Regra acionada para o prompt: '{prompt}'. Resposta: '{rule_response}'")
+            return rule_response, 'rule', None
+
+        context, knowledge = await context_task
+        history = await _run_stage_async('summary', complete_conversation_context_async, context)
+        return None, 'llm', (history, knowledge)
+    finally:
+        context_task.cancel()
+
+async def process_chat_message_async(prompt: str, conversation_id: str = None, use_cache: bool = True):
+    """Versão assíncrona de process_chat_message."""
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+
+    await _run_stage_async('history_user', add_message_to_history, conversation_id, 'user', [{"text": prompt}])
+
+    response_text, _, context = await _route_message_async(prompt, conversation_id)
+    if response_text is None:
+        history, knowledge = context
+        response_text = await _run_stage_async('llm', generate_collaborative_response_async, prompt, history, knowledge, use_cache)
+        log_message("INFO", f"Nenhuma regra acionada. Consultando o LLM para o prompt: '{prompt}'")
+
+    await _run_stage_async('history_model', add_message_to_history, conversation_id, 'model', [{"text": response_text}])
 
     return {"text": response_text, "conversation_id": conversation_id}
+
+async def stream_chat_message_async(prompt: str, conversation_id: str = None, use_cache: bool = True):
+    """Versão assíncrona de stream_chat_message; gera as mesmas tuplas (evento, dados)."""
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+
+    await _run_stage_async('history_user', add_message_to_history, conversation_id, 'user', [{"text": prompt}])
+
+    response_text, source, context = await _route_message_async(prompt, conversation_id)
+    if response_text is not None:
+        await run_in_db_thread(add_message_to_history, conversation_id, 'model', [{"text": response_text}])
+        yield source, {"text": response_text, "conversation_id": conversation_id}
+        return
+
+    history, knowledge = context
+    log_message("INFO", f"Nenhuma regra acionada. Consultando o LLM (streaming) para o prompt: '{prompt}'")
+    chunks = []
+    completed = False
+    try:
+        yield 'start', {"conversation_id": conversation_id}
+        async for chunk in stream_collaborative_response_async(prompt, history, knowledge, use_cache):
+            chunks.append(chunk)
+            yield 'token', {"text": chunk}
+        completed = True
+    finally:
+        response_text = ''.join(chunks)
+        if response_text and not completed:
+            # Cliente desconectado: a tarefa foi cancelada e não pode mais
+            # aguardar, então a gravação segue sozinha na thread de banco.
+            asyncio.get_running_loop().run_in_executor(
+                None, add_message_to_history, conversation_id, 'model', [{"text": response_text}])
+    if response_text:
+        await run_in_db_thread(add_message_to_history, conversation_id, 'model', [{"text": response_text}])
+    yield 'done', {"text": response_text, "conversation_id": conversation_id}
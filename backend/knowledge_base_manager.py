@@ -1,91 +1,252 @@
 import sqlite3
 import json
+import re
+import sys
+import time
 from datetime import datetime
-# Importa o DB_PATH do novo arquivo de configuração centralizado.
-from config import DB_PATH
+# Conexões reutilizáveis por thread, em modo WAL (ver connection_pool.py).
+from connection_pool import db_connection
+from metrics import instrumented, db_seconds
+from log_writer import log_writer
+from log_retention import log_retention
+from config import LOG_ASYNC, FACT_RETRIEVAL_TOP_K, FACT_RETRIEVAL_BUDGET_MS
 
-def get_db_connection():
-    """Cria e retorna uma conexão com o banco de dados."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Maior valor possível para um id do SQLite (INTEGER de 64 bits).
+_MAX_ROW_ID = 2 ** 63 - 1
 
 def log_message(log_type: str, message: str):
-    """Registra uma mensagem de log no banco de dados."""
+    """
+    Registra uma mensagem de log no banco de dados.
+    Por padrão a mensagem é apenas enfileirada e gravada em lote por uma
+    thread em segundo plano (ver log_writer.py, que mede a gravação dos lotes).
+    """
+    # A poda periódica da tabela começa junto com o primeiro log do processo.
+    log_retention.ensure_started()
+    if LOG_ASYNC:
+        log_writer.submit(log_type, message)
+        return
+    _insert_log(log_type, message)
+
+@instrumented(db_seconds, 'log_message')
+def _insert_log(log_type: str, message: str):
     try:
-        conn = get_db_connection()
-        conn.execute('INSERT INTO logs (log_type, message) VALUES (?, ?)', (log_type, message))
-        conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            conn.execute('INSERT INTO logs (log_type, message) VALUES (?, ?)', (log_type, message))
     except sqlite3.Error as e:
         # Evita um loop de logs se o próprio log falhar
         print(f"Erro ao registrar log no banco de dados: {e}", file=sys.stderr)
 
-# ... (o resto do arquivo permanece o mesmo)
+@instrumented(db_seconds, 'get_logs')
+def get_logs(log_type: str = None, before_id: int = None, limit: int = 50):
+    """
+    Retorna os logs mais recentes (opcionalmente de um tipo), do mais novo para
+    o mais antigo. A paginação é por id: passe o menor id recebido como
+    before_id para obter a página seguinte.
+    """
+    conditions = ['id < ?']
+    params = [before_id if before_id is not None else _MAX_ROW_ID]
+    if log_type:
+        conditions.append('log_type = ?')
+        params.append(log_type)
+    with db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT id, log_type, message, timestamp FROM logs
+            WHERE {' AND '.join(conditions)} ORDER BY id DESC LIMIT ?
+        ''', (*params, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+@instrumented(db_seconds, 'get_log_counts')
+def get_log_counts(since: str, log_type: str = None):
+    """
+    Contagem de logs por hora e tipo desde o instante indicado (UTC,
+    'AAAA-MM-DD HH:MM:SS'), somando os logs já removidos pela retenção
+    (log_rollup) e os que ainda estão na tabela.
+    """
+    type_filter = 'AND log_type = ?' if log_type else ''
+    params = (since[:13] + ':00:00', *([log_type] if log_type else []), since, *([log_type] if log_type else []))
+    with db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT hour, log_type, SUM(count) AS count FROM (
+                SELECT hour, log_type, count FROM log_rollup WHERE hour >= ? {type_filter}
+                UNION ALL
+                SELECT strftime('%Y-%m-%d %H:00:00', timestamp), log_type, COUNT(*) FROM logs
+                WHERE timestamp >= ? {type_filter} GROUP BY 1, 2
+            ) GROUP BY hour, log_type ORDER BY hour, log_type
+        ''', params).fetchall()
+    return [dict(row) for row in rows]
+
 # Funções para a Base de Conhecimento (KB)
+
+# Funções chamadas sempre que um fato é adicionado neste processo
+# (ex.: a invalidação do cache de respostas).
+_fact_listeners = []
+
+def register_fact_listener(callback):
+    """Registra uma função chamada com o dicionário do fato recém-adicionado."""
+    _fact_listeners.append(callback)
+
+@instrumented(db_seconds, 'add_fact')
 def add_fact(fact: str, concept: str, relationship: str, source: str = "user", confidence: float = 1.0, metadata: dict = None):
     """Adiciona um novo fato à base de conhecimento."""
-    conn = get_db_connection()
     modification_history = json.dumps([{"timestamp": str(datetime.now()), "change": "Created"}])
     metadata_str = json.dumps(metadata) if metadata else "{}"
-    conn.execute('''
-        INSERT INTO knowledge_base (fact, concept, relationship, source, confidence, metadata, modification_history)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (fact, concept, relationship, source, confidence, metadata_str, modification_history))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.execute('''
+            INSERT INTO knowledge_base (fact, concept, relationship, source, confidence, metadata, modification_history)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (fact, concept, relationship, source, confidence, metadata_str, modification_history))
+        fact_id = cursor.lastrowid
     log_message("INFO", f"Novo fato adicionado: {fact}")
 
+    new_fact = {"id": fact_id, "fact": fact, "concept": concept, "relationship": relationship}
+    for listener in _fact_listeners:
+        try:
+            listener(new_fact)
+        except Exception as e:
+            log_message("ERROR", f"Falha ao notificar a adição do fato {fact_id}: {e}")
+
+@instrumented(db_seconds, 'get_fact_by_concept')
 def get_fact_by_concept(concept: str):
     """Busca fatos na KB por um conceito específico."""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM knowledge_base WHERE concept = ?', (concept,))
-    facts = cursor.fetchall()
-    conn.close()
+    with db_connection() as conn:
+        facts = conn.execute('SELECT * FROM knowledge_base WHERE concept = ?', (concept,)).fetchall()
     return [dict(row) for row in facts] if facts else None
 
+# Palavras muito comuns que não ajudam a encontrar fatos relevantes.
+_SEARCH_STOPWORDS = frozenset(
+    "que para com uma umas uns por mais como mas dos das nos nas num numa "
+    "ele ela eles elas isso isto esse essa este esta sao ser foi tem ter "
+    "você vocês são está também então até meu minha seu sua qual quais "
+    "quem onde quando sobre muito the and".split()
+)
+_SEARCH_MAX_TERMS = 8
+
+def _build_fact_query(text: str):
+    """Monta uma consulta FTS5 (termos unidos por OR) a partir do texto livre."""
+    terms = []
+    for word in re.findall(r"\w+", text.lower()):
+        if len(word) < 3 or word in _SEARCH_STOPWORDS or word in terms:
+            continue
+        terms.append(word)
+    # Termos mais longos tendem a ser mais específicos (e mais baratos de buscar).
+    terms = sorted(terms, key=len, reverse=True)[:_SEARCH_MAX_TERMS]
+    return " OR ".join(f'"{term}"' for term in terms)
+
+@instrumented(db_seconds, 'search_facts')
+def search_facts(text: str, limit: int = FACT_RETRIEVAL_TOP_K, budget_ms: float = FACT_RETRIEVAL_BUDGET_MS):
+    """
+    Retorna os fatos mais relevantes para o texto, ordenados por BM25.
+    A busca é interrompida se ultrapassar budget_ms; nesse caso (ou se o
+    índice FTS5 não existir) retorna uma lista vazia.
+    """
+    query = _build_fact_query(text)
+    if not query or limit <= 0:
+        return []
+
+    deadline = time.perf_counter() + budget_ms / 1000
+    def _over_budget():
+        # Um valor diferente de zero faz o SQLite interromper a consulta.
+        return time.perf_counter() > deadline
+
+    with db_connection() as conn:
+        conn.set_progress_handler(_over_budget, 1000)
+        try:
+            # O ranking é feito apenas sobre o índice FTS5; o JOIN com a tabela
+            # de fatos acontece só para as linhas já selecionadas.
+            rows = conn.execute('''
+                SELECT kb.id, kb.fact, kb.concept, kb.relationship, kb.confidence, top.score
+                FROM (
+                    SELECT rowid, rank AS score FROM knowledge_base_fts
+                    WHERE knowledge_base_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                ) AS top
+                JOIN knowledge_base kb ON kb.id = top.rowid
+                ORDER BY top.score
+            ''', (query, limit)).fetchall()
+        except sqlite3.OperationalError as e:
+            if not _over_budget():
+                log_message("WARN", f"Falha na busca de fatos: {e}")
+            return []
+        finally:
+            conn.set_progress_handler(None, 0)
+    return [dict(row) for row in rows]
+
 # Funções para o Conjunto de Regras
+
+# Funções chamadas sempre que uma regra é adicionada neste processo
+# (ex.: o índice compilado do rule_engine).
+_rule_listeners = []
+
+def register_rule_listener(callback):
+    """Registra uma função chamada com o dicionário da regra recém-adicionada."""
+    _rule_listeners.append(callback)
+
+@instrumented(db_seconds, 'add_rule')
 def add_rule(condition: str, action: str, priority: int = 0):
     """Adiciona uma nova regra ao conjunto de regras."""
-    conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO rule_set (rule_condition, rule_action, priority)
-        VALUES (?, ?, ?)
-    ''', (condition, action, priority))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.execute('''
+            INSERT INTO rule_set (rule_condition, rule_action, priority)
+            VALUES (?, ?, ?)
+        ''', (condition, action, priority))
+        rule_id = cursor.lastrowid
     log_message("INFO", f"Nova regra adicionada: IF {condition} THEN {action}")
+
+    rule = {
+        "id": rule_id,
+        "rule_condition": condition,
+        "rule_action": action,
+        "priority": priority,
+        "is_active": 1,
+    }
+    for listener in _rule_listeners:
+        try:
+            listener(rule)
+        except Exception as e:
+            log_message("ERROR", f"Falha ao notificar a adição da regra {rule_id}: {e}")
     return True
 
+@instrumented(db_seconds, 'get_all_rules')
 def get_all_rules():
     """Retorna todas as regras ativas do banco de dados."""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM rule_set WHERE is_active = 1 ORDER BY priority DESC')
-    rules = cursor.fetchall()
-    conn.close()
+    with db_connection() as conn:
+        rules = conn.execute('SELECT * FROM rule_set WHERE is_active = 1 ORDER BY priority DESC, id').fetchall()
     return [dict(row) for row in rules]
 
+@instrumented(db_seconds, 'get_rules_after')
+def get_rules_after(rule_id: int):
+    """Retorna as regras ativas com id maior que o informado."""
+    with db_connection() as conn:
+        rules = conn.execute('SELECT * FROM rule_set WHERE is_active = 1 AND id > ? ORDER BY id', (rule_id,)).fetchall()
+    return [dict(row) for row in rules]
+
+@instrumented(db_seconds, 'get_rule_set_signature')
+def get_rule_set_signature():
+    """Retorna (quantidade, maior id) das regras ativas, usado para detectar mudanças."""
+    with db_connection() as conn:
+        row = conn.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM rule_set WHERE is_active = 1').fetchone()
+    return row[0], row[1]
+
 # Funções para o Histórico de Conversas
+@instrumented(db_seconds, 'add_message_to_history')
 def add_message_to_history(conversation_id: str, role: str, parts: list):
     """Adiciona uma mensagem ao histórico de conversas."""
-    conn = get_db_connection()
     parts_str = json.dumps(parts)
-    conn.execute('''
-        INSERT INTO conversation_history (conversation_id, role, parts)
-        VALUES (?, ?, ?)
-    ''', (conversation_id, role, parts_str))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        conn.execute('''
+            INSERT INTO conversation_history (conversation_id, role, parts)
+            VALUES (?, ?, ?)
+        ''', (conversation_id, role, parts_str))
 
+@instrumented(db_seconds, 'get_conversation_history')
 def get_conversation_history(conversation_id: str, limit: int = 20):
     """Obtém o histórico de uma conversa específica."""
-    conn = get_db_connection()
-    cursor = conn.execute('''
-        SELECT role, parts FROM conversation_history
-        WHERE conversation_id = ? ORDER BY timestamp DESC LIMIT ?
-    ''', (conversation_id, limit))
-    history_rows = cursor.fetchall()
-    conn.close()
+    with db_connection() as conn:
+        history_rows = conn.execute('''
+            SELECT role, parts FROM conversation_history
+            WHERE conversation_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?
+        ''', (conversation_id, limit)).fetchall()
 
     # Monta o histórico no formato esperado (lista de dicionários)
     history = []
@@ -95,3 +256,45 @@ def get_conversation_history(conversation_id: str, limit: int = 20):
             "parts": json.loads(row["parts"])
         })
     return history
+
+@instrumented(db_seconds, 'get_history_rows')
+def get_history_rows(conversation_id: str, after_id: int = 0, before_id: int = None, limit: int = 50):
+    """
+    Retorna as mensagens brutas (id, role, parts em JSON e seu tamanho) da
+    conversa com after_id < id < before_id, da mais recente para a mais antiga.
+    O tamanho permite estimar tokens sem decodificar o JSON.
+    """
+    with db_connection() as conn:
+        return conn.execute('''
+            SELECT id, role, parts, length(parts) AS size FROM conversation_history
+            WHERE conversation_id = ? AND id > ? AND id < ?
+            ORDER BY timestamp DESC, id DESC LIMIT ?
+        ''', (conversation_id, after_id, before_id if before_id is not None else _MAX_ROW_ID, limit)).fetchall()
+
+# Funções para os resumos de conversas
+@instrumented(db_seconds, 'get_conversation_summary')
+def get_conversation_summary(conversation_id: str):
+    """Retorna o resumo acumulado da conversa, ou None."""
+    with db_connection() as conn:
+        row = conn.execute(
+            'SELECT summary, covered_until_id FROM conversation_summary WHERE conversation_id = ?',
+            (conversation_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+@instrumented(db_seconds, 'save_conversation_summary')
+def save_conversation_summary(conversation_id: str, summary: str, covered_until_id: int):
+    """
+    Grava o resumo das mensagens da conversa até covered_until_id (inclusive).
+    Um resumo que cobre menos mensagens que o já gravado é ignorado.
+    """
+    with db_connection() as conn:
+        conn.execute('''
+            INSERT INTO conversation_summary (conversation_id, summary, covered_until_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                summary = excluded.summary,
+                covered_until_id = excluded.covered_until_id,
+                updated_at = excluded.updated_at
+            WHERE excluded.covered_until_id > conversation_summary.covered_until_id
+        ''', (conversation_id, summary, covered_until_id))
@@ -1,21 +1,41 @@
 from knowledge_base_manager import add_rule, add_fact, log_message
+from rule_engine import validate_condition
 import re
 
+# Regex para extrair condição e ação. '(?i)' para case-insensitive, '.' para nova linha
+_RULE_WITH_COMMA = re.compile(r"Se\s+(.+),\s+então\s+(.+)", re.IGNORECASE | re.DOTALL)
+_RULE_WITHOUT_COMMA = re.compile(r"Se\s+(.+)\s+então\s+(.+)", re.IGNORECASE | re.DOTALL)
+
+def parse_rule_text(text: str):
+    """
+    Extrai (condição, ação) de um texto no formato 'Se [condição], então [ação]'.
+    Retorna None se o formato não corresponder.
+    """
+    match = _RULE_WITH_COMMA.search(text)
+    if not match:
+        # Tenta uma versão sem vírgula
+        match = _RULE_WITHOUT_COMMA.search(text)
+    if not match:
+        return None
+    return match.group(1).strip(), match.group(2).strip()
+
 def learn_new_rule(prompt: str):
     """
     Processa um prompt do usuário para aprender uma nova regra.
     Aprende regras no formato 'Se [condição], então [ação]'.
     """
-    # Regex para extrair condição e ação. '(?i)' para case-insensitive, '.' para nova linha
-    match = re.search(r"Se\s+(.+),\s+então\s+(.+)", prompt, re.IGNORECASE | re.DOTALL)
+    parsed = parse_rule_text(prompt)
 
-    if not match:
-        # Tenta uma versão sem vírgula
-        match = re.search(r"Se\s+(.+)\s+então\s+(.+)", prompt, re.IGNORECASE | re.DOTALL)
+    if parsed:
+        condition, action = parsed
 
-    if match:
-        condition = match.group(1).strip()
-        action = match.group(2).strip()
+        # A condição é avaliada como regex em toda mensagem: recusa as que
+        # são inválidas ou podem travar o motor de regras.
+        try:
+            validate_condition(condition)
+        except ValueError as e:
+            log_message("WARN", f"Regra recusada do prompt '{prompt}': {e}")
+            return f"Não posso aprender essa regra: {e}."
 
         # Adiciona a regra ao banco de dados
         if add_rule(condition, action):
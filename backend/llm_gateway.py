@@ -0,0 +1,385 @@
+"""
+Gateway das chamadas ao Gemini: controle de admissão, novas tentativas e
+coalescência de requisições idênticas em andamento.
+
+- Admissão: no máximo LLM_MAX_CONCURRENCY chamadas simultâneas por processo.
+  As demais esperam, em ordem de chegada, numa fila limitada; com a fila
+  cheia ou a espera esgotada, LLMOverloaded é lançada imediatamente com um
+  Retry-After estimado, e a API responde 429 em vez de acumular requisições.
+  A fila é compartilhada pelas chamadas síncronas (threads) e assíncronas
+  (event loop), que disputam a mesma cota da API.
+- Novas tentativas: erros transitórios (429, 5xx, falhas de rede) são
+  repetidos com espera aleatória exponencial ("full jitter"), para que os
+  clientes não voltem todos ao mesmo tempo.
+- Coalescência ("singleflight"): enquanto uma chamada com a mesma chave está
+  em andamento, as requisições idênticas esperam pelo resultado dela em vez
+  de chamar a API de novo.
+"""
+import asyncio
+import collections
+import functools
+import math
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from metrics import llm_queue_wait_seconds, register_collector
+from config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+    LLM_RETRY_ATTEMPTS,
+    LLM_RETRY_BASE_SECONDS,
+    LLM_RETRY_MAX_SECONDS,
+    LLM_COALESCE
+)
+
+# Status HTTP (atributo code das exceções do google.api_core) e nomes de
+# exceções tratados como transitórios. Os nomes evitam importar o SDK aqui.
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+_RATE_LIMIT_ERRORS = frozenset({'ResourceExhausted', 'TooManyRequests'})
+_TRANSIENT_ERRORS = frozenset({'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout', 'BadGateway'})
+# Limites do Retry-After sugerido aos clientes, em segundos.
+_MIN_RETRY_AFTER = 1
+_MAX_RETRY_AFTER = 60
+# Peso de cada nova amostra na média móvel da duração das chamadas.
+_DURATION_WEIGHT = 0.2
+
+
+class LLMOverloaded(Exception):
+    """A chamada não foi admitida: fila cheia, espera esgotada ou limite de taxa da API."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Gemini sobrecarregado ({reason}); tente novamente em {retry_after} s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+def _status_code(error: Exception):
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+def is_rate_limited(error: Exception):
+    return _status_code(error) == 429 or type(error).__name__ in _RATE_LIMIT_ERRORS
+
+def is_retryable(error: Exception):
+    """Indica se o erro é transitório e vale uma nova tentativa."""
+    if isinstance(error, LLMOverloaded):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return (_status_code(error) in _RETRYABLE_STATUS
+            or type(error).__name__ in _RATE_LIMIT_ERRORS or type(error).__name__ in _TRANSIENT_ERRORS)
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    """Uma posição na fila de admissão: uma thread (Event) ou uma corrotina (Future)."""
+    __slots__ = ('event', 'loop', 'future', 'granted')
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self.granted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+class _Flight:
+    """Chamada síncrona em andamento, aguardada pelas requisições idênticas."""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMGateway:
+    """Controle de admissão, novas tentativas e coalescência das chamadas ao LLM."""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float,
+                 retry_attempts: int, retry_base: float, retry_max: float, coalesce: bool):
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self._retry_attempts = max(1, retry_attempts)
+        self._retry_base = retry_base
+        self._retry_max = retry_max
+        self._coalesce = coalesce
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queue = collections.deque()
+        self._flights = {}
+        self._async_flights = {}
+        self._avg_call_seconds = 1.0
+        self._counts = {"admitted": 0, "queued": 0, "queue_full": 0, "timeout": 0,
+                        "rate_limited": 0, "retries": 0, "coalesced": 0}
+
+    # --- Admissão ---
+
+    def _free_slot(self):
+        """Com o lock: há vaga e ninguém à frente na fila."""
+        return self._max_concurrency <= 0 or (self._in_flight < self._max_concurrency and not self._queue)
+
+    def _retry_after(self):
+        """Estimativa de quando a fila terá andado o suficiente, em segundos."""
+        backlog = len(self._queue) + 1
+        estimate = self._avg_call_seconds * backlog / max(1, self._max_concurrency)
+        return min(_MAX_RETRY_AFTER, max(_MIN_RETRY_AFTER, math.ceil(estimate)))
+
+    def _reject(self, reason: str, retry_after: int = None):
+        """Com o lock: conta a recusa e cria a exceção."""
+        self._counts[reason] += 1
+        return LLMOverloaded(reason, retry_after or self._retry_after())
+
+    def _admit_or_enqueue(self, loop=None):
+        """Com o lock: ocupa uma vaga (retorna None) ou entra na fila (retorna a posição)."""
+        if self._free_slot():
+            self._in_flight += 1
+            self._counts["admitted"] += 1
+            return None
+        if len(self._queue) >= self._max_queue:
+            raise self._reject("queue_full")
+        waiter = _Waiter(loop)
+        self._queue.append(waiter)
+        self._counts["queued"] += 1
+        return waiter
+
+    def _release_locked(self):
+        if self._queue:
+            # A vaga passa direto para o próximo da fila.
+            waiter = self._queue.popleft()
+            waiter.granted = True
+            self._counts["admitted"] += 1
+            waiter.wake()
+        else:
+            self._in_flight -= 1
+
+    def release(self):
+        with self._lock:
+            self._release_locked()
+
+    def acquire(self):
+        """Ocupa uma vaga, esperando na fila se necessário; lança LLMOverloaded."""
+        started = time.monotonic()
+        with self._lock:
+            waiter = self._admit_or_enqueue()
+        if waiter is not None:
+            waiter.event.wait(self._queue_timeout)
+            with self._lock:
+                if not waiter.granted:
+                    self._queue.remove(waiter)
+                    raise self._reject("timeout")
+        llm_queue_wait_seconds.observe(time.monotonic() - started)
+
+    async def acquire_async(self):
+        """Versão assíncrona de acquire: a espera na fila não ocupa uma thread."""
+        started = time.monotonic()
+        with self._lock:
+            waiter = self._admit_or_enqueue(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.future, self._queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+                with self._lock:
+                    if not waiter.granted:
+                        self._queue.remove(waiter)
+                    elif isinstance(error, asyncio.CancelledError):
+                        # A vaga chegou junto com o cancelamento: devolve.
+                        self._release_locked()
+                    if isinstance(error, asyncio.CancelledError):
+                        raise
+                    if not waiter.granted:
+                        raise self._reject("timeout") from None
+        llm_queue_wait_seconds.observe(time.monotonic() - started)
+
+    @contextmanager
+    def slot(self):
+        """Mantém uma vaga durante o bloco (ex.: enquanto uma resposta é transmitida)."""
+        self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_duration(time.monotonic() - started)
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        await self.acquire_async()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_duration(time.monotonic() - started)
+            self.release()
+
+    def _record_duration(self, elapsed: float):
+        with self._lock:
+            self._avg_call_seconds += _DURATION_WEIGHT * (elapsed - self._avg_call_seconds)
+
+    # --- Novas tentativas ---
+
+    def _backoff(self, attempt: int):
+        return random.uniform(0, min(self._retry_max, self._retry_base * 2 ** (attempt - 1)))
+
+    def _give_up(self, error: Exception, attempt: int):
+        """
+        Decide se o erro encerra as tentativas. Limites de taxa da API que
+        persistem viram LLMOverloaded, para que o cliente receba um 429.
+        """
+        if attempt < self._retry_attempts and is_retryable(error):
+            with self._lock:
+                self._counts["retries"] += 1
+            return None
+        if is_rate_limited(error):
+            with self._lock:
+                return self._reject("rate_limited", max(_MIN_RETRY_AFTER, math.ceil(self._retry_max)))
+        return error
+
+    def retry(self, func):
+        """Executa func() repetindo os erros transitórios."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return func()
+            except Exception as error:
+                final = self._give_up(error, attempt)
+                if final is error:
+                    raise
+                if final is not None:
+                    raise final from error
+            time.sleep(self._backoff(attempt))
+
+    async def retry_async(self, factory):
+        """Versão assíncrona de retry; factory() cria uma nova corrotina a cada tentativa."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await factory()
+            except Exception as error:
+                final = self._give_up(error, attempt)
+                if final is error:
+                    raise
+                if final is not None:
+                    raise final from error
+            await asyncio.sleep(self._backoff(attempt))
+
+    def call(self, func):
+        """Uma chamada à API: admissão seguida de novas tentativas, com a vaga mantida entre elas."""
+        with self.slot():
+            return self.retry(func)
+
+    async def call_async(self, factory):
+        async with self.slot_async():
+            return await self.retry_async(factory)
+
+    # --- Coalescência ---
+
+    def coalesce(self, key, func):
+        """
+        Executa func() uma única vez para todas as requisições com a mesma
+        chave em andamento; as demais recebem o mesmo resultado (ou exceção).
+        Sem chave, ou com LLM_COALESCE desativado, apenas executa func().
+        """
+        if key is None or not self._coalesce:
+            return func()
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._counts["coalesced"] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def coalesce_async(self, key, factory):
+        """
+        Versão assíncrona de coalesce. A chamada roda em uma tarefa própria:
+        se o cliente que a iniciou desconectar, as demais continuam esperando
+        pelo mesmo resultado.
+        """
+        if key is None or not self._coalesce:
+            return await factory()
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        with self._lock:
+            task = self._async_flights.get(flight_key)
+            if task is None:
+                task = loop.create_task(factory())
+                self._async_flights[flight_key] = task
+                task.add_done_callback(functools.partial(self._flight_done, flight_key))
+            else:
+                self._counts["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _flight_done(self, flight_key, task):
+        with self._lock:
+            self._async_flights.pop(flight_key, None)
+        if not task.cancelled():
+            # Marca a exceção como lida mesmo que todos os clientes tenham desistido.
+            task.exception()
+
+    def stats(self):
+        """Ocupação atual e contadores de eventos neste processo."""
+        with self._lock:
+            return {
+                "max_concurrency": self._max_concurrency,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "max_queue": self._max_queue,
+                "avg_call_seconds": self._avg_call_seconds,
+                **self._counts,
+            }
+
+
+llm_gateway = LLMGateway(
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+    LLM_RETRY_ATTEMPTS,
+    LLM_RETRY_BASE_SECONDS,
+    LLM_RETRY_MAX_SECONDS,
+    LLM_COALESCE
+)
+
+def _collect_metrics():
+    stats = llm_gateway.stats()
+    return {
+        "jarvis_llm_in_flight": ("gauge", "Chamadas ao Gemini em andamento.", {
+            (): stats["in_flight"],
+        }),
+        "jarvis_llm_queue_depth": ("gauge", "Requisições esperando vaga para chamar o Gemini.", {
+            (): stats["queue_depth"],
+        }),
+        "jarvis_llm_gateway_events_total": ("counter", "Eventos do controle de admissão das chamadas ao Gemini.", {
+            (("event", name),): stats[name]
+            for name in ("admitted", "queued", "queue_full", "timeout", "rate_limited", "retries", "coalesced")
+        }),
+    }
+
+register_collector(_collect_metrics)
@@ -0,0 +1,180 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from connection_pool import db_connection, close_connection
+from metrics import register_collector
+from config import (
+    LOG_RETENTION_DAYS,
+    LOG_RETENTION_MAX_ROWS,
+    LOG_RETENTION_INTERVAL_SECONDS,
+    LOG_RETENTION_BATCH_SIZE,
+    LOG_RETENTION_AUTOSTART
+)
+
+# Limite de lotes por execução, para que uma execução atrasada não segure o
+# banco por muito tempo; o restante fica para a próxima.
+_MAX_BATCHES_PER_RUN = 100
+# Pausa entre lotes, para que os demais escritores consigam o lock do banco.
+_PAUSE_BETWEEN_BATCHES_SECONDS = 0.01
+
+class LogRetention:
+    """
+    Poda periódica da tabela de logs.
+    Uma thread em segundo plano remove, em lotes limitados, os logs mais
+    antigos que o limite de idade e os que excedem o limite de linhas. Antes de
+    apagar cada lote, suas linhas são somadas em log_rollup (contagem por hora
+    e tipo). Com vários workers, o horário da última execução fica em
+    app_metadata, e só um deles poda a cada intervalo.
+
+    Sem autostart, a thread só é iniciada por uma chamada explícita a start
+    (no Gunicorn com preload, em cada worker; ver gunicorn.conf.py).
+    """
+
+    def __init__(self, max_age_days: float, max_rows: int, interval: float, batch_size: int,
+                 autostart: bool = LOG_RETENTION_AUTOSTART):
+        self._max_age_days = max_age_days
+        self._max_rows = max_rows
+        self._interval = interval
+        self._batch_size = batch_size
+        self._autostart = autostart
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.runs = 0
+        self.deleted = 0
+        self.failed_runs = 0
+
+    @property
+    def enabled(self):
+        return self._interval > 0 and (self._max_age_days > 0 or self._max_rows > 0)
+
+    def ensure_started(self):
+        """Inicia a thread de poda (de novo, se o processo foi bifurcado), se o autostart estiver ativo."""
+        if self._autostart:
+            self.start()
+
+    def start(self):
+        """Inicia a thread de poda neste processo, se ainda não estiver rodando."""
+        if not self.enabled or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="log-retention", daemon=True)
+            self._thread.start()
+
+    def shutdown(self, timeout: float = 5.0):
+        """Encerra a thread de poda deste processo (aguardando o lote em andamento)."""
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._thread = None
+            self._stop.set()
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                if self._claim_run():
+                    self.prune()
+            except Exception as e:
+                # Qualquer falha encerraria a thread e a poda pararia em silêncio.
+                with self._lock:
+                    self.failed_runs += 1
+                # Não usa log_message: a falha pode ser justamente no banco de logs.
+                print(f"Erro na retenção de logs: {e}", file=sys.stderr)
+            stop.wait(self._interval)
+        close_connection()
+
+    def _claim_run(self):
+        """Reserva a execução deste intervalo; retorna False se outro worker já podou."""
+        now = time.time()
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT value FROM app_metadata WHERE key = 'log_retention_last_run'").fetchone()
+            if row and now - float(row['value']) < self._interval:
+                return False
+            conn.execute('''
+                INSERT INTO app_metadata (key, value) VALUES ('log_retention_last_run', ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            ''', (str(now),))
+        return True
+
+    def prune(self, max_batches: int = _MAX_BATCHES_PER_RUN):
+        """Aplica os limites de idade e de linhas; retorna o número de logs removidos."""
+        deleted = 0
+        batches = 0
+        if self._max_age_days > 0:
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=self._max_age_days)).strftime('%Y-%m-%d %H:%M:%S')
+            while batches < max_batches:
+                removed = self._prune_batch(
+                    'SELECT id FROM logs WHERE timestamp < ? ORDER BY timestamp LIMIT ?', (cutoff, self._batch_size))
+                deleted += removed
+                batches += 1
+                if removed < self._batch_size:
+                    break
+                time.sleep(_PAUSE_BETWEEN_BATCHES_SECONDS)
+        if self._max_rows > 0 and batches < max_batches:
+            # Id da linha mais recente que excede o limite, calculado uma vez por
+            # execução: os lotes seguintes só apagam ids até ele.
+            with db_connection() as conn:
+                row = conn.execute('SELECT id FROM logs ORDER BY id DESC LIMIT 1 OFFSET ?', (self._max_rows,)).fetchone()
+            while row is not None and batches < max_batches:
+                removed = self._prune_batch(
+                    'SELECT id FROM logs WHERE id <= ? ORDER BY id LIMIT ?', (row['id'], self._batch_size))
+                deleted += removed
+                batches += 1
+                if removed < self._batch_size:
+                    break
+                time.sleep(_PAUSE_BETWEEN_BATCHES_SECONDS)
+        with self._lock:
+            self.runs += 1
+            self.deleted += deleted
+        return deleted
+
+    def _prune_batch(self, select_sql: str, params: tuple):
+        """Soma um lote de logs em log_rollup e o remove, na mesma transação."""
+        with db_connection() as conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS log_prune_batch (id INTEGER PRIMARY KEY)')
+            conn.execute('DELETE FROM log_prune_batch')
+            conn.execute(f'INSERT INTO log_prune_batch {select_sql}', params)
+            conn.execute('''
+                INSERT INTO log_rollup (hour, log_type, count)
+                SELECT strftime('%Y-%m-%d %H:00:00', timestamp), log_type, COUNT(*)
+                FROM logs WHERE id IN (SELECT id FROM log_prune_batch)
+                GROUP BY 1, 2
+                ON CONFLICT (hour, log_type) DO UPDATE SET count = count + excluded.count
+            ''')
+            return conn.execute('DELETE FROM logs WHERE id IN (SELECT id FROM log_prune_batch)').rowcount
+
+    def stats(self):
+        """Contadores das execuções de poda neste processo."""
+        with self._lock:
+            return {"enabled": self.enabled, "runs": self.runs, "deleted": self.deleted, "failed_runs": self.failed_runs}
+
+
+log_retention = LogRetention(
+    LOG_RETENTION_DAYS,
+    LOG_RETENTION_MAX_ROWS,
+    LOG_RETENTION_INTERVAL_SECONDS,
+    LOG_RETENTION_BATCH_SIZE
+)
+
+def _collect_metrics():
+    stats = log_retention.stats()
+    return {
+        "jarvis_log_retention_deleted_total": ("counter", "Logs removidos pela retenção neste processo.", {
+            (): stats["deleted"],
+        }),
+        "jarvis_log_retention_runs_total": ("counter", "Execuções da retenção de logs, por resultado.", {
+            (("result", "ok"),): stats["runs"],
+            (("result", "error"),): stats["failed_runs"],
+        }),
+    }
+
+register_collector(_collect_metrics)
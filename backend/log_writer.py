@@ -0,0 +1,162 @@
+import atexit
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from connection_pool import db_connection, close_connection
+from metrics import register_collector, instrumented, db_seconds
+from config import LOG_QUEUE_MAX_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL_SECONDS
+
+# Marcador colocado na fila para pedir o encerramento da thread de escrita.
+_STOP = object()
+
+class BatchedLogWriter:
+    """
+    Grava os logs em segundo plano.
+    As mensagens entram em uma fila limitada e uma thread as grava em lotes
+    (executemany em uma única transação), quando o lote enche ou quando o
+    intervalo de flush expira. Se a fila estiver cheia, a mensagem é
+    descartada e contabilizada, para que a requisição nunca espere pelo log.
+    """
+
+    def __init__(self, max_queue_size: int, batch_size: int, flush_interval: float):
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def _ensure_started(self):
+        """Inicia a thread de escrita (de novo, se o processo foi bifurcado)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                # A fila herdada do processo pai pode conter itens pela metade.
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, log_type: str, message: str):
+        """Enfileira uma mensagem de log sem bloquear."""
+        self._ensure_started()
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self._queue.put_nowait((log_type, message, timestamp))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = []
+            stopping = False
+            deadline = None
+            while len(batch) < self._batch_size:
+                timeout = self._flush_interval if deadline is None else deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self._flush_interval
+
+            if stopping:
+                # Esvazia o que sobrou na fila antes de encerrar.
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+                    else:
+                        self._queue.task_done()
+
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+            if stopping:
+                # A conexão desta thread não deve sobreviver a ela (nem ser
+                # herdada por um fork, ver gunicorn.conf.py).
+                close_connection()
+                return
+
+    @instrumented(db_seconds, 'log_batch_write')
+    def _write(self, batch: list):
+        try:
+            with db_connection() as conn:
+                conn.executemany('INSERT INTO logs (log_type, message, timestamp) VALUES (?, ?, ?)', batch)
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+        except sqlite3.Error as e:
+            with self._lock:
+                self.failed += len(batch)
+            # Evita um loop de logs se o próprio log falhar
+            print(f"Erro ao gravar lote de {len(batch)} logs no banco de dados: {e}", file=sys.stderr)
+
+    def flush(self):
+        """Bloqueia até que todas as mensagens enfileiradas tenham sido gravadas."""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.join()
+
+    def shutdown(self, timeout: float = 5.0):
+        """Grava as mensagens pendentes e encerra a thread de escrita."""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        """Contadores da fila de logs."""
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches,
+            }
+
+
+log_writer = BatchedLogWriter(LOG_QUEUE_MAX_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL_SECONDS)
+
+# Garante que os logs pendentes sejam gravados quando o processo terminar.
+atexit.register(log_writer.shutdown)
+
+def _collect_metrics():
+    stats = log_writer.stats()
+    return {
+        "jarvis_log_writer_messages_total": ("counter", "Mensagens de log por destino.", {
+            (("result", name),): stats[name] for name in ("written", "dropped", "failed")
+        }),
+        "jarvis_log_writer_queue_depth": ("gauge", "Mensagens de log aguardando gravação.", {
+            (): stats["queued"],
+        }),
+    }
+
+register_collector(_collect_metrics)
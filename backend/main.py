@@ -1,35 +1,81 @@
+# O módulo startup é importado primeiro para medir toda a inicialização.
+from startup import startup_phase, startup_report, mark_ready
 # Primeiro, inicialize o banco de dados para garantir que as tabelas existam.
 import sys
 import os
-from database_schema import create_schema
+from database_schema import ensure_schema
 
 # --- Inicialização Crítica ---
 # Garante que o schema do banco de dados seja criado antes que qualquer
-# outro módulo que dependa do banco de dados seja importado.
+# outro módulo que dependa do banco de dados seja importado. Se o marcador
+# de versão do banco já estiver atualizado, nenhum DDL é executado.
 try:
     print("Inicializando o backend do JARVIS...")
-    print("Verificando e criando o schema do banco de dados...")
-    create_schema()
-    print("Schema do banco de dados 'jarvis.db' garantido.")
+    with startup_phase('schema'):
+        if ensure_schema():
+            print("Schema do banco de dados criado/atualizado.")
 except Exception as e:
     print(f"\033[91mERRO CRÍTICO: Falha ao criar o schema do banco de dados: {e}\033[0m")
     sys.exit(1)
 # --- Fim da Inicialização Crítica ---
 
 
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-from jarvis_controller import process_chat_message
-from knowledge_base_manager import log_message
+with startup_phase('imports'):
+    import hmac
+    import json
+    import time
+    from datetime import datetime, timedelta, timezone
+    from flask import Flask, Response, g, request, jsonify, stream_with_context
+    from flask_cors import CORS
+    from jarvis_controller import process_chat_message, stream_chat_message
+    from learning_module import learn_new_rule
+    from bulk_data import import_ndjson, export_ndjson
+    from knowledge_base_manager import log_message, get_logs, get_log_counts
+    from intent_classifier import get_intent_stats
+    from rule_engine import rule_index
+    from log_writer import log_writer
+    from log_retention import log_retention
+    from llm_gateway import llm_gateway, LLMOverloaded
+    from response_cache import response_cache
+    from static_assets import frontend_assets, FRONTEND_BUILD_PATH
+    from metrics import request_timing, request_seconds, format_server_timing, render_prometheus
+    from config import METRICS_TIMING_HEADER, LOGS_API_TOKEN, BULK_API_TOKEN
 
-# Determinar o caminho para o frontend build
-FRONTEND_BUILD_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend', 'dist')
+# O frontend buildado é lido uma única vez para a memória (ver static_assets.py);
+# a rota estática padrão do Flask fica desativada em favor de serve_frontend.
+with startup_phase('static_manifest'):
+    frontend_assets.load()
 
-app = Flask(__name__, static_folder=FRONTEND_BUILD_PATH, static_url_path='')
+app = Flask(__name__, static_folder=None)
 
 # Configuração do CORS
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+# --- Métricas por requisição ---
+@app.before_request
+def _start_request_timing():
+    if request.path.startswith('/api/'):
+        g.request_started = time.perf_counter()
+        g.timing_scope = request_timing()
+        g.request_timings = g.timing_scope.__enter__()
+
+@app.after_request
+def _finish_request_timing(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint or 'desconhecido')
+    timings = g.pop('request_timings', {})
+    if timings and (METRICS_TIMING_HEADER or request.headers.get('X-Request-Timing') == '1'):
+        response.headers['Server-Timing'] = format_server_timing(timings)
+    return response
+
+@app.teardown_request
+def _close_request_timing(exc):
+    scope = g.pop('timing_scope', None)
+    if scope is not None:
+        scope.__exit__(None, None, None)
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Endpoint principal para interação com o JARVIS."""
@@ -45,10 +91,19 @@ def chat():
         # Log anônimo da requisição recebida
         log_message("INFO", f"Nova requisição recebida em /api/chat para a conversa: {conversation_id or 'nova'}")
 
-        response = process_chat_message(prompt, conversation_id)
+        use_cache = _use_cache(data)
+
+        # Clientes que pedem text/event-stream recebem a resposta em streaming
+        if request.accept_mimetypes.best == 'text/event-stream':
+            return _event_stream(prompt, conversation_id, use_cache)
+
+        response = process_chat_message(prompt, conversation_id, use_cache)
 
         return jsonify(response)
 
+    except LLMOverloaded as e:
+        log_message("WARN", f"Requisição para /api/chat recusada: {e}")
+        return _overloaded_response(e)
     except Exception as e:
         # Usar o logger do KBM para registrar o erro no banco de dados
         log_message("CRITICAL", f"Erro fatal no endpoint /api/chat: {e}")
@@ -56,6 +111,58 @@ def chat():
         print(f"Erro em /api/chat: {e}", file=sys.stderr)
         return jsonify({"error": "Ocorreu um erro interno no servidor."}), 500
 
+# Mensagem devolvida quando o Gemini não tem vaga para a requisição (HTTP 429).
+_OVERLOADED_MESSAGE = "O JARVIS está recebendo muitas mensagens agora. Tente novamente em instantes."
+
+def _overloaded_response(error: LLMOverloaded):
+    return jsonify({"error": _OVERLOADED_MESSAGE, "retry_after": error.retry_after}), 429, \
+        {"Retry-After": str(error.retry_after)}
+
+def _use_cache(data: dict):
+    """
+    O cliente pode ignorar o cache de respostas com {"cache": false} no corpo
+    ou com o cabeçalho 'Cache-Control: no-cache'.
+    """
+    if data.get('cache') is False:
+        return False
+    return 'no-cache' not in request.headers.get('Cache-Control', '').lower()
+
+def _format_sse(event: str, data: dict):
+    """Formata um evento no padrão Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _event_stream(prompt: str, conversation_id: str = None, use_cache: bool = True):
+    """Resposta HTTP que repassa os eventos de stream_chat_message ao cliente."""
+    def generate():
+        try:
+            for event, data in stream_chat_message(prompt, conversation_id, use_cache):
+                yield _format_sse(event, data)
+        except LLMOverloaded as e:
+            # O status 200 já foi enviado: a recusa vai como evento de erro.
+            log_message("WARN", f"Streaming de /api/chat recusado: {e}")
+            yield _format_sse('error', {"error": _OVERLOADED_MESSAGE, "retry_after": e.retry_after})
+        except Exception as e:
+            log_message("CRITICAL", f"Erro fatal no streaming de /api/chat: {e}")
+            yield _format_sse('error', {"error": "Ocorreu um erro interno no servidor."})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Versão do /api/chat que transmite a resposta via Server-Sent Events."""
+    data = request.json
+    if not data or 'prompt' not in data:
+        log_message("WARN", "Recebida requisição para /api/chat/stream sem o campo 'prompt'.")
+        return jsonify({"error": "O campo 'prompt' é obrigatório."}), 400
+
+    conversation_id = data.get('conversation_id')
+    log_message("INFO", f"Nova requisição recebida em /api/chat/stream para a conversa: {conversation_id or 'nova'}")
+    return _event_stream(data.get('prompt'), conversation_id, _use_cache(data))
+
 @app.route('/api/teach_rule', methods=['POST'])
 def teach_rule():
     """
@@ -75,6 +182,56 @@ def teach_rule():
         log_message("CRITICAL", f"Erro fatal no endpoint /api/teach_rule: {e}")
         return jsonify({"error": "Ocorreu um erro interno no servidor."}), 500
 
+def _iter_request_lines(stream):
+    """Lê o corpo da requisição linha a linha, sem carregá-lo inteiro na memória."""
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        yield line
+
+def _token_access_error(expected_token: str, area: str):
+    """
+    Resposta de erro se a requisição não puder usar endpoints administrativos:
+    sem o token configurado eles não existem; com ele, o cabeçalho
+    Authorization deve trazê-lo ("Bearer <token>").
+    """
+    if not expected_token:
+        return jsonify({"error": "Não encontrado."}), 404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), expected_token.encode()):
+        return jsonify({"error": f"Token de acesso {area} inválido ou ausente."}), 401
+    return None
+
+@app.route('/api/bulk/<kind>', methods=['POST'])
+def bulk_import(kind):
+    """Importa regras ou fatos enviados como NDJSON no corpo da requisição."""
+    denied = _token_access_error(BULK_API_TOKEN, 'à importação e exportação')
+    if denied:
+        return denied
+    if kind not in ('rules', 'facts'):
+        return jsonify({"error": "Tipo inválido. Use 'rules' ou 'facts'."}), 404
+    try:
+        summary = import_ndjson(kind, _iter_request_lines(request.stream))
+        return jsonify(summary), (200 if summary["imported"] or not summary["error_count"] else 400)
+    except Exception as e:
+        log_message("CRITICAL", f"Erro fatal no endpoint /api/bulk/{kind}: {e}")
+        return jsonify({"error": "Ocorreu um erro interno no servidor."}), 500
+
+@app.route('/api/bulk/<kind>', methods=['GET'])
+def bulk_export(kind):
+    """Exporta regras ou fatos como NDJSON, transmitido em blocos."""
+    denied = _token_access_error(BULK_API_TOKEN, 'à importação e exportação')
+    if denied:
+        return denied
+    if kind not in ('rules', 'facts'):
+        return jsonify({"error": "Tipo inválido. Use 'rules' ou 'facts'."}), 404
+    return Response(
+        stream_with_context(export_ndjson(kind)),
+        mimetype='application/x-ndjson',
+        headers={"Content-Disposition": f"attachment; filename=jarvis-{kind}.ndjson"},
+    )
+
 @app.route('/api/explain', methods=['GET'])
 def explain():
     # TODO: Implementar a lógica para rastrear e explicar o raciocínio.
@@ -85,24 +242,78 @@ def health():
     """Endpoint de health check"""
     return jsonify({"status": "ok", "service": "JARVIS Backend"})
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Métricas do processo no formato texto do Prometheus."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Contadores internos: classificador de intenção, regras, logs, cache de respostas, frontend, LLM e inicialização."""
+    return jsonify({
+        "intent_classifier": get_intent_stats(),
+        "rule_index": rule_index.stats(),
+        "log_writer": log_writer.stats(),
+        "response_cache": response_cache.stats(),
+        "log_retention": log_retention.stats(),
+        "static_assets": frontend_assets.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "startup": startup_report(),
+    })
+
+# Tamanho máximo de uma página de /api/logs.
+_MAX_LOGS_PAGE = 500
+
+@app.route('/api/logs', methods=['GET'])
+def logs():
+    """
+    Logs mais recentes, paginados por id.
+    Parâmetros: log_type, limit (até 500) e before_id (o next_before_id da
+    página anterior).
+    """
+    denied = _token_access_error(LOGS_API_TOKEN, 'aos logs')
+    if denied:
+        return denied
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), _MAX_LOGS_PAGE)
+        before_id = request.args.get('before_id', type=int)
+    except ValueError:
+        return jsonify({"error": "Os parâmetros 'limit' e 'before_id' devem ser inteiros."}), 400
+    entries = get_logs(request.args.get('log_type') or None, before_id, limit)
+    next_before_id = entries[-1]["id"] if len(entries) == limit else None
+    return jsonify({"logs": entries, "next_before_id": next_before_id})
+
+@app.route('/api/logs/hourly', methods=['GET'])
+def logs_hourly():
+    """Contagem de logs por hora e tipo nas últimas N horas (parâmetros hours e log_type)."""
+    denied = _token_access_error(LOGS_API_TOKEN, 'aos logs')
+    if denied:
+        return denied
+    try:
+        hours = min(max(int(request.args.get('hours', 24)), 1), 24 * 366)
+    except ValueError:
+        return jsonify({"error": "O parâmetro 'hours' deve ser inteiro."}), 400
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S')
+    return jsonify({"since": since, "counts": get_log_counts(since, request.args.get('log_type') or None)})
+
 # Servir o frontend React
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_frontend(path):
     """
-    Serve o frontend React construído.
+    Serve o frontend React construído, a partir do manifesto em memória.
     Se o arquivo não existir, serve o index.html para o React Router funcionar.
     """
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
-    else:
+    asset_path = frontend_assets.lookup(path)
+    if asset_path is None:
         # Se o frontend ainda não foi buildado, retorna mensagem informativa
-        if not os.path.exists(app.static_folder):
-            return jsonify({
-                "message": "Frontend não encontrado. Execute 'npm run build' no diretório frontend/",
-                "frontend_path": app.static_folder
-            }), 404
-        return send_from_directory(app.static_folder, 'index.html')
+        return jsonify({
+            "message": "Frontend não encontrado. Execute 'npm run build' no diretório frontend/ e reinicie o servidor.",
+            "frontend_path": FRONTEND_BUILD_PATH
+        }), 404
+    status, body, headers = frontend_assets.respond(
+        asset_path, request.headers.get('Accept-Encoding', ''), request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
 
 def final_initialization_check():
     """Verificações finais antes de iniciar o servidor."""
@@ -115,7 +326,7 @@ def final_initialization_check():
         print("Chave da API do Gemini encontrada.")
         # A configuração real da API acontece no módulo gemini_integration
 
-    print(f"\033[92mInicialização do JARVIS concluída. Servidor pronto para receber requisições.\033[0m")
+    print(f"\033[92mInicialização do JARVIS concluída em {mark_ready() * 1000:.0f} ms. Servidor pronto para receber requisições.\033[0m")
     print(f"Frontend será servido de: {FRONTEND_BUILD_PATH}")
 
 # Executa a verificação final durante a inicialização do módulo.
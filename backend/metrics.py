@@ -0,0 +1,225 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites (em segundos) dos buckets dos histogramas de latência.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Tempos da requisição atual, por etapa (ver request_timing). Como é uma
+# ContextVar, cada requisição (e cada thread do pipeline que copiar o
+# contexto) acumula em seu próprio dicionário.
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Counter:
+    """Contador monotônico com rótulos."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histograma cumulativo com rótulos, no formato do Prometheus."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self._buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self._buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self._buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self._buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+def _format_labels(key: tuple):
+    if not key:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in key)
+    return "{" + ",".join(escaped) + "}"
+
+
+# --- Métricas do JARVIS ---
+stage_seconds = Histogram('jarvis_stage_seconds', 'Duração de cada etapa do processamento de uma mensagem.')
+db_seconds = Histogram('jarvis_db_seconds', 'Duração das operações do knowledge_base_manager.')
+llm_seconds = Histogram('jarvis_llm_seconds', 'Duração das chamadas do gemini_integration.')
+request_seconds = Histogram('jarvis_http_request_seconds', 'Duração das requisições HTTP da API.')
+llm_queue_wait_seconds = Histogram('jarvis_llm_queue_wait_seconds', 'Espera na fila de admissão antes de cada chamada ao Gemini.')
+# Chamadas efetivamente enviadas à API (não inclui respostas do cache).
+llm_api_calls = Counter('jarvis_llm_api_calls_total', 'Chamadas enviadas à API do Gemini, por operação.')
+rule_matches = Counter('jarvis_rule_matches_total', 'Mensagens avaliadas pelo motor de regras, por resultado.')
+errors_total = Counter('jarvis_errors_total', 'Exceções nas operações instrumentadas.')
+
+_histograms = [stage_seconds, db_seconds, llm_seconds, request_seconds, llm_queue_wait_seconds]
+_counters = [llm_api_calls, rule_matches, errors_total]
+# Funções que devolvem {nome_da_métrica: (tipo, ajuda, {rótulos: valor})}
+# com contadores mantidos por outros módulos (caches, fila de logs...).
+_collectors = []
+
+def register_collector(callback):
+    """Registra uma função que fornece métricas adicionais no momento da coleta."""
+    _collectors.append(callback)
+
+
+@contextmanager
+def request_timing():
+    """Abre o registro dos tempos por etapa de uma requisição; produz o dicionário."""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+def _record(histogram: Histogram, label: str, name: str, elapsed: float):
+    histogram.observe(elapsed, **{label: name})
+    timings = _request_timings.get()
+    if timings is not None:
+        # dict.get/atribuição são atômicos o suficiente para este uso (GIL).
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+@contextmanager
+def timed_stage(name: str):
+    """Mede a duração de uma etapa do processamento de mensagens."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(stage_seconds, 'stage', name, time.perf_counter() - start)
+
+def instrumented(histogram: Histogram, name: str):
+    """
+    Decorador que mede cada chamada da função no histograma indicado.
+    Para funções geradoras, mede o tempo total de consumo do gerador; para
+    corrotinas e geradores assíncronos, o tempo decorrido até a conclusão
+    (incluindo a espera por E/S).
+    """
+    label = 'operation'
+
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_generator_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                generator = func(*args, **kwargs)
+                try:
+                    async for item in generator:
+                        yield item
+                except Exception:
+                    errors_total.inc(operation=name)
+                    raise
+                finally:
+                    await generator.aclose()
+                    _record(histogram, label, name, time.perf_counter() - start)
+            return async_generator_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def coroutine_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    errors_total.inc(operation=name)
+                    raise
+                finally:
+                    _record(histogram, label, name, time.perf_counter() - start)
+            return coroutine_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                elapsed = 0.0
+                generator = func(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                except Exception:
+                    errors_total.inc(operation=name)
+                    raise
+                finally:
+                    generator.close()
+                    _record(histogram, label, name, elapsed)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors_total.inc(operation=name)
+                raise
+            finally:
+                _record(histogram, label, name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def format_server_timing(timings: dict):
+    """Formata os tempos por etapa para o cabeçalho Server-Timing (em ms)."""
+    return ", ".join(f"{name.replace('.', '-')};dur={elapsed * 1000:.2f}" for name, elapsed in timings.items())
+
+def render_prometheus():
+    """Exporta todas as métricas no formato texto do Prometheus."""
+    lines = []
+    for metric in _histograms + _counters:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            collected = collector()
+        except Exception:
+            continue
+        for name, (metric_type, help_text, values) in collected.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in values.items():
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels)))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from connection_pool import db_connection
+from metrics import register_collector
+from knowledge_base_manager import register_rule_listener, register_fact_listener, log_message
+from config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MEMORY_SIZE,
+    RESPONSE_CACHE_MAX_ROWS,
+    RESPONSE_CACHE_HISTORY_WINDOW,
+    RESPONSE_CACHE_GENERATION_CACHE_SECONDS
+)
+
+# A poda da camada persistente roda a cada N inserções.
+_PRUNE_EVERY = 100
+
+class ResponseCache:
+    """
+    Cache exato das respostas do LLM, em duas camadas: um LRU em memória e uma
+    tabela SQLite compartilhada entre os workers.
+
+    A chave é o hash do modelo, do prompt, das últimas mensagens do histórico,
+    dos fatos usados como contexto e da "geração" atual do cache. Invalidar o
+    cache (quando regras ou fatos mudam) incrementa a geração no banco, o que
+    torna obsoletas de uma só vez as entradas de todos os workers; as linhas
+    das gerações antigas são removidas pela poda. Cada processo guarda a
+    geração lida por generation_cache_seconds, para que um acerto na camada
+    em memória não precise do banco.
+    """
+
+    def __init__(self, ttl: float, memory_size: int, max_rows: int, history_window: int,
+                 generation_cache_seconds: float = RESPONSE_CACHE_GENERATION_CACHE_SECONDS):
+        self._ttl = ttl
+        self._memory_size = memory_size
+        self._max_rows = max_rows
+        self._history_window = history_window
+        self._generation_cache_seconds = generation_cache_seconds
+        # (geração, instante em que deixa de valer)
+        self._cached_generation = None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+
+    def _count(self, field: str):
+        with self._lock:
+            self._counters[field] += 1
+
+    def _generation(self):
+        """Geração atual do cache, relida do banco quando a cópia local expira."""
+        cached = self._cached_generation
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        with db_connection() as conn:
+            generation = self._read_generation(conn)
+        self._cached_generation = (generation, time.monotonic() + self._generation_cache_seconds)
+        return generation
+
+    @staticmethod
+    def _read_generation(conn):
+        row = conn.execute("SELECT value FROM app_metadata WHERE key = 'response_cache_generation'").fetchone()
+        return str(row['value']) if row else '0'
+
+    def make_key(self, model: str, prompt: str, conversation_history: list = None, knowledge: list = None):
+        """Calcula a chave do cache (sem a geração)."""
+        window = (conversation_history or [])[-self._history_window:] if self._history_window > 0 else []
+        payload = json.dumps({
+            "model": model,
+            "prompt": prompt,
+            "history": window,
+            "knowledge": [item.get('fact') for item in (knowledge or [])],
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Retorna a resposta em cache para a chave, ou None."""
+        now = time.time()
+        try:
+            full_key = f"{self._generation()}:{key}"
+            with self._lock:
+                entry = self._memory.get(full_key)
+                if entry is not None and entry["expires_at"] > now:
+                    self._memory.move_to_end(full_key)
+                    entry["hits"] += 1
+                    self._counters["memory_hits"] += 1
+                    return entry["response"]
+
+            with db_connection() as conn:
+                row = conn.execute(
+                    'SELECT response, expires_at, hits FROM response_cache WHERE cache_key = ? AND expires_at > ?',
+                    (full_key, now)
+                ).fetchone()
+                if row is None:
+                    self._count("misses")
+                    return None
+                conn.execute(
+                    'UPDATE response_cache SET hits = hits + 1, last_hit_at = ? WHERE cache_key = ?',
+                    (now, full_key)
+                )
+        except sqlite3.Error as e:
+            log_message("WARN", f"Falha ao consultar o cache de respostas: {e}")
+            return None
+
+        self._count("persistent_hits")
+        self._remember(full_key, row['response'], row['expires_at'], row['hits'] + 1)
+        return row['response']
+
+    def put(self, key: str, model: str, response: str):
+        """Armazena uma resposta nas duas camadas."""
+        now = time.time()
+        expires_at = now + self._ttl
+        try:
+            full_key = f"{self._generation()}:{key}"
+            with db_connection() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO response_cache
+                        (cache_key, model, response, created_at, expires_at, last_hit_at, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, 0)
+                ''', (full_key, model, response, now, expires_at, now))
+        except sqlite3.Error as e:
+            log_message("WARN", f"Falha ao gravar no cache de respostas: {e}")
+            return
+        self._count("stores")
+        self._remember(full_key, response, expires_at, 0)
+
+        with self._lock:
+            self._inserts += 1
+            should_prune = self._inserts % _PRUNE_EVERY == 0
+        if should_prune:
+            self.prune()
+
+    def _remember(self, full_key: str, response: str, expires_at: float, hits: int):
+        if self._memory_size <= 0:
+            return
+        with self._lock:
+            self._memory[full_key] = {"response": response, "expires_at": expires_at, "hits": hits}
+            self._memory.move_to_end(full_key)
+            while len(self._memory) > self._memory_size:
+                self._memory.popitem(last=False)
+
+    def prune(self):
+        """
+        Remove as entradas de gerações anteriores, as expiradas e, acima do
+        limite, as menos usadas recentemente.
+        """
+        try:
+            with db_connection() as conn:
+                generation = self._read_generation(conn)
+                conn.execute('DELETE FROM response_cache WHERE expires_at <= ? OR substr(cache_key, 1, ?) != ?',
+                             (time.time(), len(generation) + 1, f"{generation}:"))
+                count = conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0]
+                excess = count - self._max_rows
+                if excess > 0:
+                    conn.execute('''
+                        DELETE FROM response_cache WHERE cache_key IN (
+                            SELECT cache_key FROM response_cache ORDER BY last_hit_at LIMIT ?
+                        )
+                    ''', (excess,))
+        except sqlite3.Error as e:
+            log_message("WARN", f"Falha ao podar o cache de respostas: {e}")
+
+    def invalidate(self, *_):
+        """
+        Descarta todo o cache (chamado quando regras ou fatos mudam). Só a
+        geração muda; as linhas antigas ficam para a próxima poda.
+        """
+        with self._lock:
+            self._memory.clear()
+        try:
+            with db_connection() as conn:
+                conn.execute('''
+                    INSERT INTO app_metadata (key, value) VALUES ('response_cache_generation', '1')
+                    ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+                ''')
+                generation = self._read_generation(conn)
+        except sqlite3.Error as e:
+            # Sem a nova geração, as entradas antigas continuariam valendo neste
+            # processo: força a releitura na próxima consulta.
+            self._cached_generation = None
+            log_message("WARN", f"Falha ao invalidar o cache de respostas: {e}")
+            return
+        self._cached_generation = (generation, time.monotonic() + self._generation_cache_seconds)
+        log_message("INFO", "Cache de respostas invalidado após mudança no conhecimento.")
+
+    def stats(self):
+        """Contadores de acertos/erros e tamanho da camada em memória."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        return stats
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MEMORY_SIZE,
+    RESPONSE_CACHE_MAX_ROWS,
+    RESPONSE_CACHE_HISTORY_WINDOW
+)
+
+# Novas regras ou fatos podem mudar as respostas: invalida o cache.
+register_rule_listener(response_cache.invalidate)
+register_fact_listener(response_cache.invalidate)
+
+def cache_enabled(use_cache: bool = True):
+    """Indica se o cache deve ser usado nesta requisição."""
+    if RESPONSE_CACHE_ENABLED and not use_cache:
+        response_cache._count("bypassed")
+    return RESPONSE_CACHE_ENABLED and use_cache
+
+def _collect_metrics():
+    stats = response_cache.stats()
+    return {
+        "jarvis_response_cache_events_total": ("counter", "Eventos do cache de respostas do LLM.", {
+            (("event", name),): stats[name]
+            for name in ("memory_hits", "persistent_hits", "misses", "stores", "bypassed")
+        }),
+        "jarvis_response_cache_memory_entries": ("gauge", "Entradas na camada em memória do cache de respostas.", {
+            (): stats["memory_entries"],
+        }),
+    }
+
+register_collector(_collect_metrics)
@@ -1,22 +1,474 @@
-from knowledge_base_manager import get_all_rules
+from knowledge_base_manager import (
+    get_all_rules,
+    get_rules_after,
+    get_rule_set_signature,
+    register_rule_listener,
+    log_message
+)
+from safe_regex import RegexSet, analyze_condition, check_condition
+from config import (
+    RULE_INDEX_REFRESH_SECONDS,
+    RULE_SAFE_MATCHING,
+    RULE_MATCH_BUDGET_MS,
+    RULE_MATCH_MAX_INPUT_CHARS
+)
+from metrics import rule_matches, register_collector
+import bisect
+import heapq
+import math
 import re
+import threading
+import time
 
-def process_rules(prompt: str):
+# Caracteres que fazem uma condição deixar de ser um texto literal.
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+def _is_literal(condition: str):
+    """Indica se a condição pode ser tratada como texto literal (sem regex)."""
+    return not any(ch in _REGEX_METACHARS for ch in condition)
+
+def validate_condition(condition: str):
     """
-    Processa o prompt do usuário contra o conjunto de regras.
-    Retorna a ação da primeira regra correspondente ou None.
+    Validação feita quando uma regra é ensinada. Lança ValueError se a
+    condição não for uma regex válida ou, no modo seguro, se puder levar
+    tempo exponencial para ser avaliada.
+    """
+    if _is_literal(condition):
+        return
+    if RULE_SAFE_MATCHING:
+        check_condition(condition)
+        return
+    try:
+        re.compile(f"(?i){condition}")
+    except re.error as e:
+        raise ValueError(f"condição não é uma regex válida: {e}")
+
+def _rule_key(rule: dict):
+    """Chave de ordenação equivalente a 'ORDER BY priority DESC' (empates pelo id)."""
+    return (-(rule.get('priority') or 0), rule['id'])
+
+
+class _AhoCorasick:
+    """
+    Autômato Aho-Corasick para encontrar, em uma única passada sobre o texto,
+    todas as condições literais presentes no prompt.
+    Novos padrões são inseridos na trie incrementalmente; os links de falha
+    são recalculados de forma preguiçosa na próxima busca (ou em prepare).
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._dict_link = [0]
+        self._dirty = False
+
+    def add(self, word: str, key):
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._dict_link.append(0)
+                self._goto[node][ch] = nxt
+            node = nxt
+        self._out[node].append(key)
+        self._dirty = True
+
+    def copy(self):
+        """Cópia independente da trie, para alterar o autômato sem afetar as buscas em andamento."""
+        clone = _AhoCorasick()
+        clone._goto = [dict(edges) for edges in self._goto]
+        clone._fail = list(self._fail)
+        clone._out = [list(keys) for keys in self._out]
+        clone._dict_link = list(self._dict_link)
+        clone._dirty = self._dirty
+        return clone
+
+    def prepare(self):
+        """Recalcula os links de falha pendentes; depois disso, best_match não altera o autômato."""
+        if self._dirty:
+            self._build()
+
+    def _build(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+            self._dict_link[node] = 0
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                fail_node = self._fail[child]
+                self._dict_link[child] = fail_node if self._out[fail_node] else self._dict_link[fail_node]
+                queue.append(child)
+        self._dirty = False
+
+    def best_match(self, text: str):
+        """Retorna a menor chave entre os padrões encontrados no texto, ou None."""
+        self.prepare()
+        goto, fail, out, dict_link = self._goto, self._fail, self._out, self._dict_link
+        best = min(out[0]) if out[0] else None
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            match_node = node if out[node] else dict_link[node]
+            while match_node:
+                candidate = min(out[match_node])
+                if best is None or candidate < best:
+                    best = candidate
+                match_node = dict_link[match_node]
+        return best
+
+
+class _RuleSegment:
+    """
+    Uma parte do índice de regras: o autômato das condições literais, o
+    RegexSet das regex de tempo linear e a lista das regex do módulo re em
+    ordem de prioridade. Guarda também as condições inseridas, para que outra
+    parte possa ser mesclada a esta (merge).
+    """
+
+    def __init__(self):
+        self.literals = _AhoCorasick()
+        self.linear = RegexSet()
+        self.regex_keys = []
+        self.regex_rules = []
+        self.literal_entries = []
+        self.linear_entries = []
+
+    def __len__(self):
+        return len(self.literal_entries) + len(self.linear_entries) + len(self.regex_rules)
+
+    def add_literal(self, word: str, key):
+        self.literals.add(word, key)
+        self.literal_entries.append((word, key))
+
+    def add_linear(self, condition: str, key):
+        """Lança ValueError se a condição não for suportada pelo RegexSet."""
+        self.linear.add(condition, key)
+        self.linear_entries.append((condition, key))
+
+    def add_regex(self, pattern, key, rule_id):
+        position = bisect.bisect_left(self.regex_keys, key)
+        self.regex_keys.insert(position, key)
+        self.regex_rules.insert(position, (pattern, key, rule_id))
+
+    def copy(self):
+        clone = _RuleSegment()
+        clone.literals = self.literals.copy()
+        clone.linear = self.linear.copy()
+        clone.regex_keys = list(self.regex_keys)
+        clone.regex_rules = list(self.regex_rules)
+        clone.literal_entries = list(self.literal_entries)
+        clone.linear_entries = list(self.linear_entries)
+        return clone
+
+    def merge(self, other):
+        """Nova parte com as regras desta e de other (nenhuma das duas é alterada)."""
+        merged = self.copy()
+        for word, key in other.literal_entries:
+            merged.add_literal(word, key)
+        for condition, key in other.linear_entries:
+            merged.add_linear(condition, key)
+        for entry in other.regex_rules:
+            merged.add_regex(*entry)
+        merged.literals.prepare()
+        return merged
+
+    def without_regex_rules(self, rule_ids: set):
+        """Nova parte sem as regex do módulo re das regras indicadas; o restante é compartilhado."""
+        clone = _RuleSegment()
+        clone.literals, clone.linear = self.literals, self.linear
+        clone.literal_entries, clone.linear_entries = self.literal_entries, self.linear_entries
+        kept = [(key, entry) for key, entry in zip(self.regex_keys, self.regex_rules) if entry[2] not in rule_ids]
+        clone.regex_keys = [key for key, _ in kept]
+        clone.regex_rules = [entry for _, entry in kept]
+        return clone
+
+    def best_match(self, prompt: str):
+        """Menor chave entre as condições literais e lineares encontradas no prompt."""
+        best = self.literals.best_match(prompt.lower())
+        if len(self.linear):
+            linear = self.linear.best_match(prompt)
+            if linear is not None and (best is None or linear < best):
+                best = linear
+        return best
+
+
+# A parte incremental do índice é mesclada à principal quando passa de
+# max(_MIN_DELTA_RULES, raiz quadrada do tamanho da principal) regras: cada
+# inserção custa O(√n) amortizado, em vez de reconstruir o índice inteiro.
+_MIN_DELTA_RULES = 64
+
+class RuleIndex:
+    """
+    Índice em memória do conjunto de regras.
+    As condições são compiladas uma única vez; as literais são agrupadas em
+    um autômato Aho-Corasick e as demais são mantidas como regex compiladas,
+    preservando a ordem de prioridade do banco de dados.
+
+    No modo seguro (RULE_SAFE_MATCHING), as regex suportadas vão para um
+    RegexSet de tempo linear. Só as que precisam do módulo re ficam na lista
+    de regex compiladas, avaliadas com orçamento de tempo; condições com
+    risco de backtracking exponencial são ignoradas.
+
+    O índice tem duas partes (_RuleSegment): a principal, montada em load, e
+    uma pequena parte incremental que recebe as regras novas e é consultada
+    junto com ela até ser mesclada. As partes publicadas nunca são alteradas:
+    inserções e quarentenas trabalham em cópias, trocadas com o lock
+    adquirido. Assim, match só usa o lock para pegar as referências e faz as
+    buscas fora dele.
     """
-    rules = get_all_rules()
 
-    for rule in rules:
-        # Usando expressões regulares para uma correspondência mais flexível
-        # A condição da regra é tratada como um padrão regex.
-        # '(?i)' faz a correspondência ser case-insensitive.
-        condition_pattern = f"(?i){rule['rule_condition']}"
+    def __init__(self, safe_matching: bool = RULE_SAFE_MATCHING,
+                 budget_ms: float = RULE_MATCH_BUDGET_MS, max_input_chars: int = RULE_MATCH_MAX_INPUT_CHARS):
+        self._safe_matching = safe_matching
+        self._budget = budget_ms / 1000
+        self._max_input_chars = max_input_chars
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._last_check = 0.0
+        # A quarentena vale para o processo todo, inclusive após recarregar o índice.
+        self._quarantined_ids = set()
+        self._budget_exhausted = 0
+        self._merges = 0
+        self._reset()
+
+    def _reset(self):
+        # Só recebe chaves novas (nunca remove), então pode ser alterado no lugar.
+        self._actions = {}
+        self._main = _RuleSegment()
+        self._delta = _RuleSegment()
+        self._rejected = 0
+        self._ids = set()
+        self._max_id = 0
+
+    def _insert(self, rule: dict, segment: _RuleSegment):
+        """Insere uma regra em uma parte ainda não publicada. Deve ser chamado com o lock adquirido."""
+        if rule['id'] in self._ids:
+            return
+        # Regras inválidas também são registradas para que a contagem continue
+        # batendo com a do banco e não force reconstruções.
+        self._ids.add(rule['id'])
+        self._max_id = max(self._max_id, rule['id'])
+        condition = rule['rule_condition']
+        key = _rule_key(rule)
+        if _is_literal(condition):
+            segment.add_literal(condition.lower(), key)
+        elif self._safe_matching:
+            if not self._insert_safe(rule['id'], condition, key, segment):
+                return
+        else:
+            try:
+                pattern = re.compile(f"(?i){condition}")
+            except re.error as e:
+                log_message("WARN", f"Regra {rule['id']} ignorada por condição inválida '{condition}': {e}")
+                return
+            segment.add_regex(pattern, key, rule['id'])
+        self._actions[key] = rule['rule_action']
+
+    def _insert_safe(self, rule_id, condition: str, key, segment: _RuleSegment):
+        """
+        Insere uma condição regex no modo seguro; retorna False se ela for
+        ignorada. Regras anteriores à validação feita no ensino podem ter
+        condições perigosas, então a análise é repetida aqui.
+        """
+        if rule_id in self._quarantined_ids:
+            return False
+        analysis = analyze_condition(condition)
+        if analysis.error is None and analysis.linear:
+            try:
+                segment.add_linear(condition, key)
+                return True
+            except ValueError as e:
+                analysis = analysis._replace(error=str(e))
+        if analysis.error is not None or analysis.risky:
+            reason = analysis.error or "risco de backtracking excessivo"
+            log_message("WARN", f"Regra {rule_id} ignorada por condição insegura '{condition}': {reason}")
+            self._rejected += 1
+            return False
+        segment.add_regex(re.compile(f"(?i){condition}"), key, rule_id)
+        return True
+
+    def load(self, rules: list):
+        """Reconstrói o índice a partir da lista completa de regras ativas."""
+        with self._lock:
+            self._reset()
+            for rule in rules:
+                self._insert(rule, self._main)
+            self._main.literals.prepare()
+            self._loaded = True
+            self._last_check = time.monotonic()
+
+    def add(self, rule: dict):
+        """Adiciona uma regra ao índice sem reconstruí-lo."""
+        self.add_many([rule])
+
+    def add_many(self, rules: list):
+        """
+        Adiciona regras ao índice sem reconstruí-lo: elas entram na parte
+        incremental (copiada uma vez por chamada), que é mesclada à principal
+        quando fica grande demais.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            rules = [rule for rule in rules if rule['id'] not in self._ids]
+            if not rules:
+                return
+            delta = self._delta.copy()
+            for rule in rules:
+                self._insert(rule, delta)
+            delta.literals.prepare()
+            if len(delta) > max(_MIN_DELTA_RULES, math.isqrt(len(self._main))):
+                self._main = self._main.merge(delta)
+                self._delta = _RuleSegment()
+                self._merges += 1
+            else:
+                self._delta = delta
 
-        if re.search(condition_pattern, prompt):
-            # A regra correspondeu, retorna a ação correspondente
-            return rule['rule_action']
+    def refresh_if_stale(self, force: bool = False):
+        """
+        Sincroniza o índice com o banco de dados. Regras novas (de outros
+        processos ou de importações em lote) são aplicadas incrementalmente; a
+        reconstrução completa só acontece se regras forem removidas ou
+        desativadas. Sem force, a verificação respeita RULE_INDEX_REFRESH_SECONDS.
+        """
+        if not self._loaded:
+            self.load(get_all_rules())
+            return
+        now = time.monotonic()
+        if not force and now - self._last_check < RULE_INDEX_REFRESH_SECONDS:
+            return
+        self._last_check = now
 
-    # Nenhuma regra correspondeu
-    return None
+        count, max_id = get_rule_set_signature()
+        if max_id > self._max_id:
+            self.add_many(get_rules_after(self._max_id))
+        if count != len(self._ids):
+            self.load(get_all_rules())
+
+    def match(self, prompt: str):
+        """Retorna a ação da regra de maior prioridade que corresponde ao prompt."""
+        with self._lock:
+            main, delta, actions = self._main, self._delta, self._actions
+        best = main.best_match(prompt)
+        if len(delta):
+            candidate = delta.best_match(prompt)
+            if candidate is not None and (best is None or candidate < best):
+                best = candidate
+        regex_rules = main.regex_rules
+        if delta.regex_rules:
+            regex_rules = heapq.merge(main.regex_rules, delta.regex_rules, key=lambda entry: entry[1])
+        if self._safe_matching:
+            best = self._match_regex_budgeted(regex_rules, prompt, best)
+        else:
+            for pattern, key, _ in regex_rules:
+                if best is not None and key > best:
+                    break
+                if pattern.search(prompt):
+                    best = key
+                    break
+        return actions[best] if best is not None else None
+
+    def _match_regex_budgeted(self, regex_rules, prompt: str, best):
+        """
+        Avalia as regex que dependem do módulo re dentro do orçamento de tempo.
+        Esgotado o orçamento, as regras restantes (de menor prioridade) ficam
+        de fora desta mensagem; uma regra que sozinha estoura o orçamento vai
+        para a quarentena e deixa de ser avaliada até o índice ser recarregado.
+        """
+        text = prompt[:self._max_input_chars]
+        started = time.perf_counter()
+        exhausted = False
+        quarantined = set()
+        for pattern, key, rule_id in regex_rules:
+            if best is not None and key > best:
+                break
+            before = time.perf_counter()
+            if before - started > self._budget:
+                exhausted = True
+                break
+            found = pattern.search(text)
+            if time.perf_counter() - before > self._budget:
+                quarantined.add(rule_id)
+            if found:
+                best = key
+                break
+        if exhausted or quarantined:
+            self._record_budget_overrun(exhausted, quarantined)
+        return best
+
+    def _record_budget_overrun(self, exhausted: bool, quarantined: set):
+        with self._lock:
+            if exhausted:
+                self._budget_exhausted += 1
+            quarantined -= self._quarantined_ids
+            if not quarantined:
+                return
+            self._quarantined_ids |= quarantined
+            self._main = self._main.without_regex_rules(quarantined)
+            self._delta = self._delta.without_regex_rules(quarantined)
+        for rule_id in sorted(quarantined):
+            log_message("WARN", f"Regra {rule_id} em quarentena: a condição excedeu o orçamento de {self._budget * 1000:g} ms.")
+
+    def stats(self):
+        """Tamanho de cada parte do índice e contadores do modo seguro."""
+        with self._lock:
+            return {
+                "safe_matching": self._safe_matching,
+                "rules": len(self._actions),
+                "linear_rules": len(self._main.linear) + len(self._delta.linear),
+                "regex_rules": len(self._main.regex_rules) + len(self._delta.regex_rules),
+                "pending_merge": len(self._delta),
+                "merges": self._merges,
+                "rejected": self._rejected,
+                "quarantined": len(self._quarantined_ids),
+                "budget_exhausted": self._budget_exhausted,
+            }
+
+
+rule_index = RuleIndex()
+register_rule_listener(rule_index.add)
+
+def _collect_metrics():
+    stats = rule_index.stats()
+    return {
+        "jarvis_rule_index_rules": ("gauge", "Regras no índice, por motor de casamento.", {
+            (("engine", "linear"),): stats["linear_rules"],
+            (("engine", "re"),): stats["regex_rules"],
+        }),
+        "jarvis_rule_index_skipped_rules": ("gauge", "Regras fora do índice por condição insegura ou lenta.", {
+            (("reason", "rejected"),): stats["rejected"],
+            (("reason", "quarantined"),): stats["quarantined"],
+        }),
+        "jarvis_rule_match_budget_exhausted_total": ("counter", "Mensagens em que o orçamento de tempo das regex esgotou.", {
+            (): stats["budget_exhausted"],
+        }),
+    }
+
+register_collector(_collect_metrics)
+
+def process_rules(prompt: str):
+    """
+    Processa o prompt do usuário contra o conjunto de regras.
+    Retorna a ação da primeira regra correspondente ou None.
+    """
+    # As condições já estão compiladas no índice; aqui apenas garantimos que
+    # ele esteja em dia com o banco de dados.
+    rule_index.refresh_if_stale()
+    action = rule_index.match(prompt)
+    rule_matches.inc(result='hit' if action is not None else 'miss')
+    return action
@@ -0,0 +1,526 @@
+"""
+Casamento seguro das condições das regras ensinadas pelos usuários.
+
+As condições são expressões regulares escritas pelos usuários e, com o motor
+de backtracking do módulo re, um padrão como '(a+)+$' pode levar tempo
+exponencial no tamanho da mensagem. Este módulo oferece:
+
+- analyze_condition/check_condition: análise feita quando a regra é ensinada,
+  que recusa padrões inválidos, complexos demais ou com risco de backtracking
+  exponencial (quantificadores aninhados, alternativas sobrepostas repetidas);
+- RegexSet: um motor de tempo linear para o subconjunto de regex sem
+  retrorreferências nem lookarounds. Todas as condições são combinadas em um
+  único autômato (NFA de Thompson), simulado como um DFA construído sob
+  demanda: cada caractere da mensagem é processado uma única vez, qualquer
+  que seja o padrão.
+"""
+import re
+import threading
+from collections import namedtuple
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+C = sre_constants
+# Limite de estados do autômato por condição (repetições {m,n} são expandidas).
+MAX_STATES_PER_PATTERN = 2000
+MAX_CONDITION_LENGTH = 500
+# Acima deste número de estados do DFA em cache, o cache é descartado e
+# reconstruído sob demanda (o consumo de memória fica limitado).
+MAX_DFA_STATES = 5000
+
+ConditionAnalysis = namedtuple('ConditionAnalysis', ['linear', 'risky', 'error'])
+
+_UNSUPPORTED = {
+    C.GROUPREF: "retrorreferências",
+    C.GROUPREF_EXISTS: "grupos condicionais",
+    C.ASSERT: "lookahead/lookbehind",
+    C.ASSERT_NOT: "lookahead/lookbehind negativos",
+}
+for _name, _description in (('ATOMIC_GROUP', "grupos atômicos"), ('POSSESSIVE_REPEAT', "quantificadores possessivos")):
+    if hasattr(C, _name):
+        _UNSUPPORTED[getattr(C, _name)] = _description
+
+_REPEATS = (C.MAX_REPEAT, C.MIN_REPEAT)
+_ALLOWED_FLAGS = C.SRE_FLAG_IGNORECASE | C.SRE_FLAG_UNICODE | C.SRE_FLAG_VERBOSE | C.SRE_FLAG_DOTALL
+
+
+def _parse(condition: str):
+    return sre_parse.parse(condition)
+
+def _global_flags(parsed):
+    state = getattr(parsed, 'state', None) or getattr(parsed, 'pattern', None)
+    return getattr(state, 'flags', 0)
+
+def _children(op, av):
+    """Subsequências de um nó da árvore do sre_parse."""
+    if op == C.SUBPATTERN:
+        return [av[-1]]
+    if op in _REPEATS or (hasattr(C, 'POSSESSIVE_REPEAT') and op == C.POSSESSIVE_REPEAT):
+        return [av[2]]
+    if op == C.BRANCH:
+        return list(av[1])
+    if op in (C.ASSERT, C.ASSERT_NOT):
+        return [av[1]]
+    if op == C.GROUPREF_EXISTS:
+        return [branch for branch in av[1:] if branch is not None]
+    if hasattr(C, 'ATOMIC_GROUP') and op == C.ATOMIC_GROUP:
+        return [av]
+    return []
+
+def _unsupported_constructs(seq, found: set):
+    for op, av in seq:
+        if op in _UNSUPPORTED:
+            found.add(_UNSUPPORTED[op])
+        if op == C.SUBPATTERN and (av[1] | av[2]) & ~_ALLOWED_FLAGS:
+            found.add("flags locais além de (?i) e (?s)")
+        for child in _children(op, av):
+            _unsupported_constructs(child, found)
+    return found
+
+
+# --- Análise de risco de backtracking ---
+
+def _can_repeat_many(op, av):
+    return op in _REPEATS and av[1] > 1
+
+def _variable_repeat(op, av):
+    """Quantificador que pode consumir quantidades diferentes de texto (ex.: a+, \\w*, x{1,3})."""
+    if op not in _REPEATS or av[0] == av[1]:
+        return False
+    return av[2].getwidth()[1] > 0
+
+def _first_chars(seq):
+    """
+    Conjunto aproximado dos caracteres que podem iniciar um casamento da
+    sequência, ou None quando ele é amplo demais para ser calculado
+    (classes, '.', sequências que podem ser vazias).
+    """
+    for op, av in seq:
+        if op == C.LITERAL:
+            return {chr(av).lower()}
+        if op == C.AT:
+            continue
+        if op == C.SUBPATTERN:
+            return _first_chars(av[-1])
+        if op == C.BRANCH:
+            result = set()
+            for branch in av[1]:
+                chars = _first_chars(branch)
+                if chars is None:
+                    return None
+                result |= chars
+            return result
+        if op in _REPEATS and av[0] > 0:
+            return _first_chars(av[2])
+        return None
+    return None
+
+def _overlapping_branches(branches):
+    seen = set()
+    for branch in branches:
+        chars = _first_chars(branch)
+        if chars is None or chars & seen:
+            return True
+        seen |= chars
+    return False
+
+def _risky(seq, inside_repeat: bool = False):
+    """
+    Heurística (semelhante à de ferramentas como safe-regex): há risco de
+    backtracking exponencial quando um quantificador ilimitado contém outro
+    quantificador de largura variável, ou alternativas que podem começar pelo
+    mesmo caractere.
+    """
+    for op, av in seq:
+        if inside_repeat and _variable_repeat(op, av):
+            return True
+        if _can_repeat_many(op, av):
+            if _risky(av[2], inside_repeat=True):
+                return True
+        elif op == C.BRANCH:
+            if inside_repeat and _overlapping_branches(av[1]):
+                return True
+            if any(_risky(branch, inside_repeat) for branch in av[1]):
+                return True
+        else:
+            if any(_risky(child, inside_repeat) for child in _children(op, av)):
+                return True
+    return False
+
+def _unbounded_repeats(seq):
+    """Número de quantificadores sem limite superior (*, +, {n,}) na sequência."""
+    count = 0
+    for op, av in seq:
+        if op in _REPEATS and av[1] == C.MAXREPEAT:
+            count += 1
+        count += sum(_unbounded_repeats(child) for child in _children(op, av))
+    return count
+
+def _unbounded_groups(seq, found: set):
+    """Números dos grupos que podem capturar texto de tamanho ilimitado."""
+    for op, av in seq:
+        if op == C.SUBPATTERN and av[0] is not None and av[-1].getwidth()[1] >= C.MAXREPEAT:
+            found.add(av[0])
+        for child in _children(op, av):
+            _unbounded_groups(child, found)
+    return found
+
+def _unbounded_backrefs(seq, groups: set):
+    """Indica se há retrorreferência a um dos grupos de tamanho ilimitado."""
+    for op, av in seq:
+        if op == C.GROUPREF and av in groups:
+            return True
+        if op == C.GROUPREF_EXISTS and av[0] in groups:
+            return True
+        if any(_unbounded_backrefs(child, groups) for child in _children(op, av)):
+            return True
+    return False
+
+def analyze_condition(condition: str):
+    """
+    Analisa uma condição de regra. Retorna ConditionAnalysis com:
+    linear (pode usar o motor de tempo linear), risky (risco de backtracking
+    excessivo no módulo re) e error (motivo para recusar a condição, ou None).
+    """
+    if len(condition) > MAX_CONDITION_LENGTH:
+        return ConditionAnalysis(False, False, f"a condição tem mais de {MAX_CONDITION_LENGTH} caracteres")
+    try:
+        parsed = _parse(condition)
+        re.compile(f"(?i){condition}")
+    except (re.error, OverflowError) as e:
+        return ConditionAnalysis(False, False, f"condição não é uma regex válida: {e}")
+    try:
+        risky = _risky(parsed)
+        unsupported = _unsupported_constructs(parsed, set())
+        if _global_flags(parsed) & ~_ALLOWED_FLAGS:
+            unsupported.add("flags além de (?i) e (?s)")
+        linear = not unsupported
+        # Fora do motor linear, dois quantificadores ilimitados já bastam para
+        # tempo polinomial alto (ex.: '(\\w+)\\s*\\1.*z'), que o orçamento de
+        # tempo não consegue interromper no meio de uma busca.
+        # O mesmo vale para uma retrorreferência a um grupo ilimitado
+        # ('(\\w+)\\1'): cada tamanho possível do grupo é comparado de novo.
+        if not linear and (_unbounded_repeats(parsed) > 1
+                           or _unbounded_backrefs(parsed, _unbounded_groups(parsed, set()))):
+            risky = True
+        if linear:
+            _Compiler(_global_flags(parsed) & C.SRE_FLAG_DOTALL).compile(parsed, key=None)
+    except RecursionError:
+        return ConditionAnalysis(False, False, "a condição tem grupos aninhados demais")
+    except ValueError as e:
+        return ConditionAnalysis(False, risky, str(e))
+    return ConditionAnalysis(linear, risky, None)
+
+def check_condition(condition: str):
+    """
+    Validação feita quando uma regra é ensinada. Lança ValueError se a
+    condição for inválida ou puder causar backtracking exponencial.
+    """
+    analysis = analyze_condition(condition)
+    if analysis.error:
+        raise ValueError(analysis.error)
+    if analysis.risky:
+        raise ValueError(
+            "a condição pode levar tempo excessivo para ser avaliada "
+            "(quantificadores aninhados como '(a+)+', alternativas repetidas que se sobrepõem, como '(a|ab)*', "
+            "retrorreferências a grupos ilimitados, como '(\\w+)\\1', ou vários quantificadores ilimitados "
+            "junto com lookarounds); "
+            "simplifique o padrão"
+        )
+    return analysis
+
+
+# --- Motor de tempo linear ---
+
+# Tipos de estado do NFA
+_CHAR, _SPLIT, _ASSERT, _MATCH = range(4)
+
+def _is_word(ch):
+    return ch is not None and (ch.isalnum() or ch == '_')
+
+def _category_test(category):
+    if category in (C.CATEGORY_DIGIT, C.CATEGORY_UNI_DIGIT):
+        return str.isdecimal
+    if category in (C.CATEGORY_NOT_DIGIT, C.CATEGORY_UNI_NOT_DIGIT):
+        return lambda ch: not ch.isdecimal()
+    if category in (C.CATEGORY_SPACE, C.CATEGORY_UNI_SPACE):
+        return str.isspace
+    if category in (C.CATEGORY_NOT_SPACE, C.CATEGORY_UNI_NOT_SPACE):
+        return lambda ch: not ch.isspace()
+    if category in (C.CATEGORY_WORD, C.CATEGORY_UNI_WORD):
+        return _is_word
+    if category in (C.CATEGORY_NOT_WORD, C.CATEGORY_UNI_NOT_WORD):
+        return lambda ch: not _is_word(ch)
+    raise ValueError(f"categoria de caracteres não suportada: {category}")
+
+def _class_test(items):
+    """Predicado para uma classe [...], sem diferenciar maiúsculas de minúsculas."""
+    negate = False
+    tests = []
+    for op, av in items:
+        if op == C.NEGATE:
+            negate = True
+        elif op == C.LITERAL:
+            tests.append(lambda ch, code=av: ord(ch) == code)
+        elif op == C.RANGE:
+            tests.append(lambda ch, low=av[0], high=av[1]: low <= ord(ch) <= high)
+        elif op == C.CATEGORY:
+            tests.append(_category_test(av))
+        else:
+            raise ValueError(f"elemento de classe não suportado: {op}")
+
+    def test(ch):
+        # O texto chega em minúsculas; a maiúscula cobre classes como [A-Z].
+        upper = ch.upper()
+        hit = any(t(ch) for t in tests) or (len(upper) == 1 and upper != ch and any(t(upper) for t in tests))
+        return hit != negate
+    return test
+
+class _Compiler:
+    """Converte a árvore do sre_parse em estados de um NFA de Thompson."""
+
+    def __init__(self, dotall: bool, states: list = None):
+        self.dotall = dotall
+        self.states = states if states is not None else []
+        self._created = 0
+
+    def _new(self, kind, a=None, b=None):
+        self._created += 1
+        if self._created > MAX_STATES_PER_PATTERN:
+            raise ValueError("a condição é complexa demais (repetições muito longas)")
+        self.states.append([kind, a, b])
+        return len(self.states) - 1
+
+    def compile(self, parsed, key):
+        """Retorna o estado inicial de um NFA que termina em MATCH(key)."""
+        return self._sequence(parsed, self._new(_MATCH, key))
+
+    def _sequence(self, seq, out):
+        for op, av in reversed(list(seq)):
+            out = self._item(op, av, out)
+        return out
+
+    def _item(self, op, av, out):
+        if op == C.LITERAL:
+            ch = chr(av).lower()
+            return self._new(_CHAR, lambda c, ch=ch: c == ch, out)
+        if op == C.NOT_LITERAL:
+            ch = chr(av).lower()
+            return self._new(_CHAR, lambda c, ch=ch: c != ch, out)
+        if op == C.ANY:
+            return self._new(_CHAR, (lambda c: True) if self.dotall else (lambda c: c != '\n'), out)
+        if op == C.IN:
+            return self._new(_CHAR, _class_test(av), out)
+        if op == C.AT:
+            return self._new(_ASSERT, av, out)
+        if op == C.SUBPATTERN:
+            group, add_flags, del_flags, body = av
+            previous = self.dotall
+            if add_flags & C.SRE_FLAG_DOTALL:
+                self.dotall = True
+            if del_flags & C.SRE_FLAG_DOTALL:
+                self.dotall = False
+            try:
+                return self._sequence(body, out)
+            finally:
+                self.dotall = previous
+        if op == C.BRANCH:
+            return self._new(_SPLIT, [self._sequence(branch, out) for branch in av[1]])
+        if op in _REPEATS:
+            return self._repeat(av[0], av[1], av[2], out)
+        raise ValueError(f"construção não suportada pelo motor linear: {op}")
+
+    def _repeat(self, minimum, maximum, body, out):
+        if maximum == C.MAXREPEAT:
+            # Laço: split -> (corpo -> split) | saída
+            loop = self._new(_SPLIT, [])
+            self.states[loop][1] = [self._sequence(body, loop), out]
+            tail = loop
+        else:
+            tail = out
+            for _ in range(maximum - minimum):
+                tail = self._new(_SPLIT, [self._sequence(body, tail), out])
+                out = tail
+        for _ in range(minimum):
+            tail = self._sequence(body, tail)
+        return tail
+
+
+class _DFACache:
+    """Estados e transições do DFA construídos sob demanda para um RegexSet."""
+    __slots__ = ('ids', 'states', 'transitions', 'finals')
+
+    # Estado inicial: nenhum estado do NFA pendente, no início do texto.
+    START = (frozenset(), False, True)
+
+    def __init__(self):
+        # Estados do DFA: (conjunto de estados do NFA, anterior é palavra, início do texto)
+        self.ids = {self.START: 0}
+        self.states = [self.START]
+        self.transitions = {}
+        self.finals = {}
+
+
+class RegexSet:
+    """
+    Conjunto de condições casadas em tempo linear no tamanho do texto.
+    best_match retorna a menor chave (maior prioridade) entre as condições
+    encontradas no texto, como o _AhoCorasick de rule_engine.py faz para as
+    condições literais.
+
+    best_match pode ser chamado por várias threads ao mesmo tempo: só a
+    construção de um estado novo do DFA usa o lock do conjunto, e as
+    transições já conhecidas são seguidas sem ele. add não é thread-safe; quem
+    altera um conjunto em uso deve alterar uma cópia (copy) e trocá-la.
+    """
+
+    def __init__(self):
+        self._states = []
+        self._starts = []
+        self._min_key = None
+        self._cache_lock = threading.Lock()
+        self._cache = _DFACache()
+
+    def __len__(self):
+        return len(self._starts)
+
+    def copy(self):
+        """Cópia independente das condições, com o cache do DFA vazio."""
+        clone = RegexSet()
+        clone._states = list(self._states)
+        clone._starts = list(self._starts)
+        clone._min_key = self._min_key
+        return clone
+
+    def add(self, condition: str, key):
+        """Compila e adiciona uma condição. Lança ValueError se ela não for suportada."""
+        parsed = _parse(condition)
+        unsupported = _unsupported_constructs(parsed, set())
+        if _global_flags(parsed) & ~_ALLOWED_FLAGS:
+            unsupported.add("flags além de (?i) e (?s)")
+        if unsupported:
+            raise ValueError(f"construções não suportadas pelo motor linear: {', '.join(sorted(unsupported))}")
+        size = len(self._states)
+        try:
+            start = _Compiler(_global_flags(parsed) & C.SRE_FLAG_DOTALL, self._states).compile(parsed, key)
+        except ValueError:
+            del self._states[size:]
+            raise
+        self._starts.append(start)
+        if self._min_key is None or key < self._min_key:
+            self._min_key = key
+        self._cache = _DFACache()
+
+    @staticmethod
+    def _dfa_state(cache: _DFACache, core: frozenset, prev_word: bool, at_start: bool):
+        signature = (core, prev_word, at_start)
+        state_id = cache.ids.get(signature)
+        if state_id is None:
+            state_id = len(cache.states)
+            cache.ids[signature] = state_id
+            cache.states.append(signature)
+        return state_id
+
+    def _closure(self, signature, next_char, final_newline: bool = False):
+        """
+        Segue as transições vazias e asserções; retorna (estados de caractere,
+        menor chave aceita). final_newline indica que next_char é um '\\n' no
+        fim do texto, antes do qual '$' também casa (como no módulo re).
+        """
+        core, prev_word, at_start = signature
+        states = self._states
+        stack = list(core) + self._starts
+        seen = set()
+        char_states = []
+        best = None
+        while stack:
+            index = stack.pop()
+            if index in seen:
+                continue
+            seen.add(index)
+            kind, a, b = states[index]
+            if kind == _CHAR:
+                char_states.append(index)
+            elif kind == _SPLIT:
+                stack.extend(a)
+            elif kind == _MATCH:
+                if best is None or a < best:
+                    best = a
+            elif self._assertion_holds(a, prev_word, at_start, next_char, final_newline):
+                stack.append(b)
+        return char_states, best
+
+    @staticmethod
+    def _assertion_holds(at, prev_word, at_start, next_char, final_newline):
+        if at in (C.AT_BEGINNING, C.AT_BEGINNING_STRING):
+            return at_start
+        if at == C.AT_END:
+            return next_char is None or final_newline
+        if at == C.AT_END_STRING:
+            return next_char is None
+        if at in (C.AT_BOUNDARY, C.AT_UNI_BOUNDARY):
+            return prev_word != _is_word(next_char)
+        if at in (C.AT_NON_BOUNDARY, C.AT_UNI_NON_BOUNDARY):
+            return prev_word == _is_word(next_char)
+        return False
+
+    def _step(self, cache: _DFACache, state_id, ch, final_newline: bool = False):
+        with self._cache_lock:
+            if not final_newline:
+                result = cache.transitions.get((state_id, ch))
+                if result is not None:
+                    return result
+            char_states, best = self._closure(cache.states[state_id], ch, final_newline)
+            states = self._states
+            core = frozenset(states[index][2] for index in char_states if states[index][1](ch))
+            result = (self._dfa_state(cache, core, _is_word(ch), False), best)
+            if not final_newline:
+                cache.transitions[(state_id, ch)] = result
+            return result
+
+    def _final(self, cache: _DFACache, state_id):
+        with self._cache_lock:
+            if state_id not in cache.finals:
+                cache.finals[state_id] = self._closure(cache.states[state_id], None)[1]
+            return cache.finals[state_id]
+
+    def best_match(self, text: str):
+        """Menor chave entre as condições encontradas no texto, ou None."""
+        if not self._starts:
+            return None
+        # Todos os passos desta busca usam o mesmo cache, mesmo que outra
+        # thread o descarte no meio do caminho.
+        cache = self._cache
+        if len(cache.states) > MAX_DFA_STATES:
+            with self._cache_lock:
+                if self._cache is cache:
+                    self._cache = _DFACache()
+                cache = self._cache
+        text = text.lower()
+        transitions = cache.transitions
+        state_id = 0
+        best = None
+        min_key = self._min_key
+        last = len(text) - 1
+        for position, ch in enumerate(text):
+            if ch == '\n' and position == last:
+                step = self._step(cache, state_id, ch, final_newline=True)
+            else:
+                step = transitions.get((state_id, ch))
+                if step is None:
+                    step = self._step(cache, state_id, ch)
+            state_id, matched = step
+            if matched is not None and (best is None or matched < best):
+                best = matched
+                if best == min_key:
+                    return best
+        matched = cache.finals.get(state_id)
+        if matched is None and state_id not in cache.finals:
+            matched = self._final(cache, state_id)
+        if matched is not None and (best is None or matched < best):
+            best = matched
+        return best
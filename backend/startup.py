@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+from metrics import register_collector
+
+# Referência para o tempo total: o momento em que este módulo foi importado,
+# que é a primeira coisa feita por main.py.
+_started = time.perf_counter()
+_ready = None
+_pid = os.getpid()
+# Duração (em segundos) de cada fase da inicialização, na ordem em que ocorreram.
+_phases = {}
+
+@contextmanager
+def startup_phase(name: str):
+    """Mede uma fase da inicialização do processo (importações, schema...)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = _phases.get(name, 0.0) + time.perf_counter() - start
+
+def mark_ready():
+    """Registra o fim da inicialização e retorna o tempo total, em segundos."""
+    global _ready
+    _ready = time.perf_counter()
+    return _ready - _started
+
+def startup_report():
+    """Relatório da inicialização do processo atual, em milissegundos."""
+    return {
+        "pid": os.getpid(),
+        # Com o preload do Gunicorn, a inicialização ocorreu no processo mestre.
+        "preloaded": os.getpid() != _pid,
+        "total_ms": (_ready - _started) * 1000 if _ready is not None else None,
+        "phases_ms": {name: elapsed * 1000 for name, elapsed in _phases.items()},
+        "sdk_loaded": 'google.generativeai' in sys.modules,
+        "modules_loaded": len(sys.modules),
+    }
+
+def _collect_metrics():
+    values = {(("phase", name),): elapsed for name, elapsed in _phases.items()}
+    if _ready is not None:
+        values[(("phase", "total"),)] = _ready - _started
+    return {
+        "jarvis_startup_seconds": ("gauge", "Duração das fases de inicialização do processo.", values),
+    }
+
+register_collector(_collect_metrics)
@@ -0,0 +1,259 @@
+"""
+Servidor dos arquivos estáticos do frontend (frontend/dist).
+
+Na inicialização, todo o diretório é lido para um manifesto em memória: para
+cada arquivo, o conteúdo, o tipo, um ETag forte (hash do conteúdo) e as
+variantes comprimidas em gzip e brotli. As variantes vêm dos arquivos .gz/.br
+gerados no build (python static_assets.py <dist>) ou, se não existirem, são
+comprimidas na carga. Cada requisição é só uma consulta a um dicionário, sem
+acesso ao disco.
+
+Os assets do Vite com hash no nome (assets/index-3f9a1c2b.js) nunca mudam de
+conteúdo e são servidos com cache imutável de um ano; os demais arquivos,
+como o index.html, são sempre revalidados com o ETag (resposta 304).
+
+Uso pela linha de comando (gera os .gz/.br ao lado de cada arquivo):
+    python static_assets.py ../frontend/dist
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import threading
+from werkzeug.utils import get_content_type
+from metrics import register_collector
+from config import STATIC_PRECOMPRESS, STATIC_MIN_COMPRESS_BYTES, STATIC_IMMUTABLE_MAX_AGE
+
+try:
+    import brotli
+except ImportError:  # dependência opcional: sem ela, só gzip
+    brotli = None
+
+# Nome de arquivo gerado pelo Vite com hash do conteúdo: <nome>-<hash>.<ext>
+_HASHED_NAME = re.compile(r'-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$')
+_COMPRESSIBLE_TYPES = frozenset({
+    'application/javascript', 'application/json', 'application/manifest+json',
+    'application/wasm', 'application/xml', 'image/svg+xml', 'image/x-icon',
+})
+# Codificações na ordem de preferência do servidor, com a extensão do arquivo pré-comprimido.
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Uma variante só é mantida se economizar ao menos esta fração do tamanho.
+_MIN_SAVING = 0.1
+# Níveis de compressão: máximos no build (precompress_directory), onde o tempo
+# não importa, e rápidos na compressão feita na inicialização de cada worker.
+_BUILD_LEVELS = {'gzip': 9, 'br': 11}
+_STARTUP_LEVELS = {'gzip': 6, 'br': 4}
+_REVALIDATE = 'no-cache'
+
+FRONTEND_BUILD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend', 'dist')
+
+mimetypes.add_type('text/javascript', '.js')
+mimetypes.add_type('text/javascript', '.mjs')
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+
+def _is_compressible(mimetype: str):
+    return mimetype.startswith('text/') or mimetype in _COMPRESSIBLE_TYPES
+
+def _compress(encoding: str, body: bytes, levels: dict = _BUILD_LEVELS):
+    if encoding == 'gzip':
+        # mtime fixo: a mesma entrada gera sempre os mesmos bytes.
+        return gzip.compress(body, compresslevel=levels['gzip'], mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(body, quality=levels['br'])
+    return None
+
+def _accepted_encodings(header: str):
+    """Codificações aceitas pelo cliente (q > 0) segundo o cabeçalho Accept-Encoding."""
+    accepted = set()
+    rejected = set()
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        (accepted if quality > 0 else rejected).add(name)
+    if '*' in accepted:
+        accepted |= {encoding for encoding, _ in _ENCODINGS} - rejected
+    return accepted
+
+def _etag_matches(header: str, etag: str):
+    """Comparação fraca do If-None-Match, como manda a RFC 9110 para o 304."""
+    if header.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return any((tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip()) == opaque
+               for tag in header.split(','))
+
+
+class _Asset:
+    """Um arquivo do manifesto: conteúdo original e variantes comprimidas."""
+    __slots__ = ('content_type', 'cache_control', 'variants')
+
+    def __init__(self, content_type: str, cache_control: str, variants: dict):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # codificação ('identity', 'gzip', 'br') -> (corpo, ETag da variante)
+        self.variants = variants
+
+
+class StaticAssets:
+    """Manifesto em memória de um diretório de arquivos estáticos."""
+
+    def __init__(self, root: str, precompress: bool = STATIC_PRECOMPRESS,
+                 min_compress_bytes: int = STATIC_MIN_COMPRESS_BYTES,
+                 immutable_max_age: int = STATIC_IMMUTABLE_MAX_AGE):
+        self.root = root
+        self._precompress = precompress
+        self._min_compress_bytes = min_compress_bytes
+        self._immutable = f"public, max-age={immutable_max_age}, immutable"
+        self._assets = {}
+        self._lock = threading.Lock()
+        self._counts = {"served": 0, "compressed": 0, "not_modified": 0}
+
+    @property
+    def available(self):
+        return bool(self._assets)
+
+    def load(self):
+        """(Re)constrói o manifesto a partir do disco; retorna o número de arquivos."""
+        assets = {}
+        if os.path.isdir(self.root):
+            for directory, _, files in os.walk(self.root):
+                names = set(files)
+                for name in files:
+                    # Variantes pré-comprimidas são lidas junto com o original.
+                    if any(name.endswith(ext) and name[:-len(ext)] in names for _, ext in _ENCODINGS):
+                        continue
+                    full_path = os.path.join(directory, name)
+                    path = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                    assets[path] = self._load_asset(path, full_path, names)
+        self._assets = assets
+        return len(assets)
+
+    def _load_asset(self, path: str, full_path: str, sibling_names: set):
+        with open(full_path, 'rb') as source:
+            body = source.read()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        hashed = path.startswith('assets/') and _HASHED_NAME.search(path) is not None
+        variants = {'identity': (body, f'"{digest}"')}
+        if _is_compressible(mimetype) and len(body) >= self._min_compress_bytes:
+            for encoding, ext in _ENCODINGS:
+                if os.path.basename(full_path) + ext in sibling_names:
+                    with open(full_path + ext, 'rb') as source:
+                        compressed = source.read()
+                elif self._precompress:
+                    compressed = _compress(encoding, body, _STARTUP_LEVELS)
+                else:
+                    compressed = None
+                if compressed is not None and len(compressed) <= len(body) * (1 - _MIN_SAVING):
+                    # Cada representação precisa do seu próprio ETag forte.
+                    variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+        return _Asset(
+            get_content_type(mimetype, 'utf-8'),
+            self._immutable if hashed else _REVALIDATE,
+            variants,
+        )
+
+    def lookup(self, path: str):
+        """Caminho do manifesto para a requisição: o próprio arquivo ou o index.html (rotas do React)."""
+        if path in self._assets:
+            return path
+        return 'index.html' if 'index.html' in self._assets else None
+
+    def respond(self, path: str, accept_encoding: str = '', if_none_match: str = None):
+        """
+        Retorna (status, corpo, cabeçalhos) para um arquivo do manifesto.
+        A variante é escolhida pelo Accept-Encoding; com If-None-Match igual ao
+        ETag dela, a resposta é 304 sem corpo.
+        """
+        asset = self._assets[path]
+        encoding = 'identity'
+        if len(asset.variants) > 1:
+            accepted = _accepted_encodings(accept_encoding)
+            encoding = next((name for name, _ in _ENCODINGS if name in asset.variants and name in accepted), 'identity')
+        body, etag = asset.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": asset.cache_control}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if if_none_match and _etag_matches(if_none_match, etag):
+            self._count("not_modified")
+            return 304, b'', headers
+        headers["Content-Type"] = asset.content_type
+        if encoding != 'identity':
+            headers["Content-Encoding"] = encoding
+            self._count("compressed")
+        self._count("served")
+        return 200, body, headers
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        """Tamanho do manifesto e contadores de respostas neste processo."""
+        variants = sum(len(asset.variants) - 1 for asset in self._assets.values())
+        with self._lock:
+            return {
+                "files": len(self._assets),
+                "compressed_variants": variants,
+                "bytes": sum(len(body) for asset in self._assets.values() for body, _ in asset.variants.values()),
+                **self._counts,
+            }
+
+
+frontend_assets = StaticAssets(FRONTEND_BUILD_PATH)
+
+def _collect_metrics():
+    stats = frontend_assets.stats()
+    return {
+        "jarvis_static_responses_total": ("counter", "Respostas de arquivos estáticos, por tipo.", {
+            (("kind", "full"),): stats["served"] - stats["compressed"],
+            (("kind", "compressed"),): stats["compressed"],
+            (("kind", "not_modified"),): stats["not_modified"],
+        }),
+        "jarvis_static_manifest_bytes": ("gauge", "Bytes dos arquivos estáticos mantidos em memória.", {
+            (): stats["bytes"],
+        }),
+    }
+
+register_collector(_collect_metrics)
+
+
+def precompress_directory(root: str, min_compress_bytes: int = STATIC_MIN_COMPRESS_BYTES):
+    """Grava as variantes .gz (e .br, se o módulo brotli existir) ao lado de cada arquivo compressível."""
+    written = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if any(name.endswith(ext) for _, ext in _ENCODINGS):
+                continue
+            full_path = os.path.join(directory, name)
+            if not _is_compressible(mimetypes.guess_type(name)[0] or ''):
+                continue
+            with open(full_path, 'rb') as source:
+                body = source.read()
+            if len(body) < min_compress_bytes:
+                continue
+            for encoding, ext in _ENCODINGS:
+                compressed = _compress(encoding, body)
+                if compressed is not None and len(compressed) <= len(body) * (1 - _MIN_SAVING):
+                    with open(full_path + ext, 'wb') as target:
+                        target.write(compressed)
+                    written += 1
+    return written
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("Uso: python static_assets.py <diretório do build>")
+    count = precompress_directory(sys.argv[1])
+    print(f"{count} variantes comprimidas gravadas em {sys.argv[1]}" + ("" if brotli else " (sem brotli: módulo não instalado)"))
@@ -0,0 +1,167 @@
+"""
+Testes do motor de casamento seguro (safe_regex.py).
+
+Executar na raiz do projeto:
+    python -m unittest discover backend/tests
+"""
+import os
+import random
+import re
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from safe_regex import RegexSet, analyze_condition, check_condition
+
+# Condições suportadas pelo motor linear, comparadas com o módulo re.
+LINEAR_PATTERNS = [
+    r'ab',
+    r'a.c',
+    r'^ab',
+    r'ab$',
+    r'^$',
+    r'a*b',
+    r'a+b?c',
+    r'(ab|ba)+',
+    r'[a-c]{2,3}',
+    r'[^ab]b',
+    r'\bab\b',
+    r'\Bb',
+    r'\d+\s*\d',
+    r'\w+ \w+$',
+    r'a{2}',
+    r'(?:a|b)c',
+    r'x?y*z+',
+    r'(?s)a.b',
+    r'\Aa',
+    r'b\Z',
+    r'olá|ola',
+    r'ç+',
+]
+ALPHABET = 'abcxyzAB1 2\nçÇá-'
+
+
+class RegexSetDifferentialTest(unittest.TestCase):
+    """O RegexSet deve concordar com re.search em qualquer texto."""
+
+    def setUp(self):
+        self.random = random.Random(1234)
+
+    def _texts(self, count=300, max_length=12):
+        yield ''
+        for _ in range(count):
+            yield ''.join(self.random.choice(ALPHABET) for _ in range(self.random.randint(1, max_length)))
+
+    def test_each_pattern_matches_like_re(self):
+        for pattern in LINEAR_PATTERNS:
+            regex_set = RegexSet()
+            regex_set.add(pattern, 0)
+            compiled = re.compile(f"(?i){pattern}")
+            for text in self._texts():
+                with self.subTest(pattern=pattern, text=text):
+                    expected = 0 if compiled.search(text) else None
+                    self.assertEqual(regex_set.best_match(text), expected)
+
+    def test_combined_set_returns_highest_priority_match(self):
+        regex_set = RegexSet()
+        compiled = []
+        for key, pattern in enumerate(LINEAR_PATTERNS):
+            regex_set.add(pattern, key)
+            compiled.append(re.compile(f"(?i){pattern}"))
+        for text in self._texts(count=500, max_length=20):
+            with self.subTest(text=text):
+                expected = next((key for key, pattern in enumerate(compiled) if pattern.search(text)), None)
+                self.assertEqual(regex_set.best_match(text), expected)
+
+    def test_cache_reset_keeps_results(self):
+        regex_set = RegexSet()
+        regex_set.add(r'(a|b)*c(a|b){3}', 0)
+        compiled = re.compile(r'(?i)(a|b)*c(a|b){3}')
+        for text in self._texts(count=200, max_length=40):
+            regex_set._cache.states.extend([None] * 6000)  # força o descarte do cache
+            self.assertEqual(regex_set.best_match(text), 0 if compiled.search(text) else None)
+
+    def test_concurrent_searches_agree_with_re(self):
+        regex_set = RegexSet()
+        for key, pattern in enumerate(LINEAR_PATTERNS):
+            regex_set.add(pattern, key)
+        compiled = [re.compile(f"(?i){pattern}") for pattern in LINEAR_PATTERNS]
+        texts = list(self._texts(count=400, max_length=20))
+        errors = []
+
+        def worker(seed):
+            shuffled = random.Random(seed).sample(texts, len(texts))
+            for text in shuffled:
+                expected = next((key for key, pattern in enumerate(compiled) if pattern.search(text)), None)
+                if regex_set.best_match(text) != expected:
+                    errors.append(text)
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_linear_time_on_pathological_input(self):
+        regex_set = RegexSet()
+        regex_set.add(r'^(a|aa)*$', 0)
+        regex_set.add(r'(x+x+)+y', 1)
+        self.assertIsNone(regex_set.best_match('a' * 5000 + '!'))
+        self.assertIsNone(regex_set.best_match('x' * 5000 + '!'))
+        self.assertEqual(regex_set.best_match('a' * 5000), 0)
+        self.assertEqual(regex_set.best_match('x' * 5000 + 'y'), 1)
+
+    def test_copy_is_independent(self):
+        regex_set = RegexSet()
+        regex_set.add(r'ab+', 0)
+        clone = regex_set.copy()
+        clone.add(r'cd', 1)
+        self.assertEqual(clone.best_match('xcd'), 1)
+        self.assertIsNone(regex_set.best_match('xcd'))
+        self.assertEqual(regex_set.best_match('abbb'), 0)
+
+    def test_unsupported_constructs_are_refused(self):
+        for pattern in (r'(ab)\1', r'(?=a)b', r'(?<!a)b', r'(?m)^a'):
+            with self.subTest(pattern=pattern):
+                with self.assertRaises(ValueError):
+                    RegexSet().add(pattern, 0)
+
+
+class ConditionAnalysisTest(unittest.TestCase):
+    """Validação feita quando uma regra é ensinada."""
+
+    def test_exponential_patterns_are_rejected(self):
+        for pattern in (r'(a+)+$', r'(a|aa)*$', r'(a*)*b', r'(x+x+)+y', r'(\w+\s?)+$'):
+            with self.subTest(pattern=pattern):
+                self.assertTrue(analyze_condition(pattern).risky)
+                with self.assertRaises(ValueError):
+                    check_condition(pattern)
+
+    def test_backrefs_to_unbounded_groups_are_rejected(self):
+        for pattern in (r'(\w+)\1', r'(a.*)=\1', r'(?P<x>\d+)-(?P=x)'):
+            with self.subTest(pattern=pattern):
+                with self.assertRaises(ValueError):
+                    check_condition(pattern)
+
+    def test_invalid_and_oversized_patterns_are_rejected(self):
+        for pattern in ('[', '(ab', 'a{1,100000}', 'a' * 600):
+            with self.subTest(pattern=pattern[:20]):
+                self.assertIsNotNone(analyze_condition(pattern).error)
+                with self.assertRaises(ValueError):
+                    check_condition(pattern)
+
+    def test_safe_patterns_are_accepted(self):
+        for pattern in (r'ola.*mundo', r'\d+\s*\d+', r'abc|abd', r'(ab)\1', r'(?=a)b', r'^(sim|não)$'):
+            with self.subTest(pattern=pattern):
+                check_condition(pattern)
+
+    def test_linear_patterns_skip_the_re_fallback(self):
+        self.assertTrue(analyze_condition(r'a.*b.*c').linear)
+        self.assertFalse(analyze_condition(r'(ab)\1').linear)
+
+
+if __name__ == '__main__':
+    unittest.main()
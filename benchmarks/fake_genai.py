@@ -0,0 +1,111 @@
+"""
+Substituto local do pacote google.generativeai para os benchmarks.
+Simula a latência até o primeiro token e a taxa de geração de tokens, sem
+acessar a rede. Use install() antes de importar o backend.
+"""
+import asyncio
+import sys
+import time
+import types
+
+class FakeSettings:
+    """Parâmetros do modelo falso, ajustáveis durante a execução."""
+    first_token_latency = 0.3   # segundos até o primeiro token
+    tokens_per_second = 50.0    # taxa de geração após o primeiro token
+    response_tokens = 40        # tamanho das respostas de chat
+    intent = 'conversa_geral'   # resposta fixa para a análise de intenção
+    calls = 0
+
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [_Part(text)]
+
+
+def _tokens(prompt: str):
+    words = (prompt.split() or ['ok'])
+    return [f"{words[i % len(words)]} " for i in range(FakeSettings.response_tokens)]
+
+def _stream(tokens):
+    time.sleep(FakeSettings.first_token_latency)
+    delay = 1 / FakeSettings.tokens_per_second if FakeSettings.tokens_per_second > 0 else 0
+    for index, token in enumerate(tokens):
+        if index:
+            time.sleep(delay)
+        yield _Response(token)
+
+async def _stream_async(tokens):
+    await asyncio.sleep(FakeSettings.first_token_latency)
+    delay = 1 / FakeSettings.tokens_per_second if FakeSettings.tokens_per_second > 0 else 0
+    for index, token in enumerate(tokens):
+        if index:
+            await asyncio.sleep(delay)
+        yield _Response(token)
+
+
+class ChatSession:
+    def __init__(self, history=None):
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        FakeSettings.calls += 1
+        tokens = _tokens(str(content))
+        if stream:
+            return _stream(tokens)
+        for _ in _stream(tokens):
+            pass
+        return _Response(''.join(tokens))
+
+    async def send_message_async(self, content, stream=False, **kwargs):
+        FakeSettings.calls += 1
+        tokens = _tokens(str(content))
+        if stream:
+            return _stream_async(tokens)
+        async for _ in _stream_async(tokens):
+            pass
+        return _Response(''.join(tokens))
+
+
+class GenerativeModel:
+    def __init__(self, model_name='fake-model', **kwargs):
+        self.model_name = model_name
+
+    def start_chat(self, history=None, **kwargs):
+        return ChatSession(history)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        FakeSettings.calls += 1
+        time.sleep(FakeSettings.first_token_latency)
+        return _Response(FakeSettings.intent)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        FakeSettings.calls += 1
+        await asyncio.sleep(FakeSettings.first_token_latency)
+        return _Response(FakeSettings.intent)
+
+
+def configure(api_key=None, **kwargs):
+    pass
+
+def install(first_token_latency: float = None, tokens_per_second: float = None, response_tokens: int = None):
+    """Registra este módulo como google.generativeai em sys.modules."""
+    if first_token_latency is not None:
+        FakeSettings.first_token_latency = first_token_latency
+    if tokens_per_second is not None:
+        FakeSettings.tokens_per_second = tokens_per_second
+    if response_tokens is not None:
+        FakeSettings.response_tokens = response_tokens
+
+    google = sys.modules.get('google') or types.ModuleType('google')
+    if not hasattr(google, '__path__'):
+        google.__path__ = []
+    google.generativeai = sys.modules[__name__]
+    sys.modules['google'] = google
+    sys.modules['google.generativeai'] = sys.modules[__name__]
+    return FakeSettings
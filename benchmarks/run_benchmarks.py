@@ -0,0 +1,434 @@
+"""
+Benchmarks do JARVIS, executados localmente com um Gemini simulado.
+
+Uso (a partir da raiz do projeto):
+    python benchmarks/run_benchmarks.py                 # todos os benchmarks
+    python benchmarks/run_benchmarks.py --only rules history
+    python benchmarks/run_benchmarks.py --quick --compare benchmarks/results/anterior.json
+
+Os resultados são gravados em JSON (benchmarks/results/ por padrão) para que
+execuções diferentes possam ser comparadas.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT_DIR, 'benchmarks')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# Métricas em que um valor maior é melhor; nas demais (latências), menor é melhor.
+_HIGHER_IS_BETTER = ('throughput_rps', 'messages_per_second')
+
+
+def _percentiles(samples: list):
+    """Resumo de latências em milissegundos."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+def _random_word(min_len: int = 3, max_len: int = 9):
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(min_len, max_len)))
+
+
+def setup_environment(args):
+    """Aponta o backend para um banco temporário e instala o Gemini simulado."""
+    db_dir = tempfile.mkdtemp(prefix='jarvis-bench-')
+    os.environ['JARVIS_DB_PATH'] = os.path.join(db_dir, 'jarvis.db')
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark-fake-key')
+    # Os benchmarks medem o servidor, não a política de admissão do llm_gateway.
+    os.environ.setdefault('LLM_MAX_CONCURRENCY', '0')
+    sys.path.insert(0, ROOT_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(0, os.path.join(ROOT_DIR, 'backend'))
+
+    import fake_genai
+    fake_genai.install(args.llm_latency, args.token_rate, args.response_tokens)
+
+    from database_schema import create_schema
+    create_schema()
+    return db_dir
+
+def _clear_tables(*tables):
+    from connection_pool import db_connection
+    with db_connection() as conn:
+        for table in tables:
+            conn.execute(f'DELETE FROM {table}')
+
+
+# --- Benchmarks ---
+
+def bench_chat(args):
+    """Vazão e latência de /api/chat pelo app WSGI, com clientes concorrentes."""
+    import wsgi
+    from log_writer import log_writer
+    client_app = wsgi.app
+    prompts = [f"me fale sobre {_random_word()} e {_random_word()}" for _ in range(max(1, args.chat_unique_prompts))]
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(requests_count):
+        nonlocal errors
+        client = client_app.test_client()
+        conversation_id = None
+        for _ in range(requests_count):
+            body = {"prompt": random.choice(prompts)}
+            if conversation_id:
+                body["conversation_id"] = conversation_id
+            start = time.perf_counter()
+            response = client.post('/api/chat', json=body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    errors += 1
+            if response.status_code == 200:
+                conversation_id = response.get_json().get("conversation_id")
+
+    per_client = max(1, args.chat_requests // args.concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(worker, per_client) for _ in range(args.concurrency)]:
+            future.result()
+    duration = time.perf_counter() - start
+    log_writer.flush()
+
+    return {
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": duration,
+        "throughput_rps": len(latencies) / duration if duration else 0,
+        "latency": _percentiles(latencies),
+        "llm_first_token_latency_s": args.llm_latency,
+        "llm_tokens_per_second": args.token_rate,
+    }
+
+def bench_chat_asgi(args):
+    """Vazão e latência de /api/chat pelo app ASGI, com muitas conversas simultâneas."""
+    try:
+        import httpx
+    except ImportError:
+        return {"skipped": "o benchmark do modo ASGI requer o pacote httpx"}
+    import asyncio
+    import asgi
+    from log_writer import log_writer
+    prompts = [f"me fale sobre {_random_word()} e {_random_word()}" for _ in range(max(1, args.chat_unique_prompts))]
+    latencies = []
+    errors = 0
+
+    async def conversation(client, requests_count):
+        nonlocal errors
+        conversation_id = None
+        for _ in range(requests_count):
+            body = {"prompt": random.choice(prompts)}
+            if conversation_id:
+                body["conversation_id"] = conversation_id
+            start = time.perf_counter()
+            response = await client.post('/api/chat', json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+            else:
+                conversation_id = response.json().get("conversation_id")
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+            per_conversation = max(1, args.chat_requests // args.async_concurrency)
+            await asyncio.gather(*(conversation(client, per_conversation) for _ in range(args.async_concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    duration = time.perf_counter() - start
+    log_writer.flush()
+
+    return {
+        "concurrency": args.async_concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": duration,
+        "throughput_rps": len(latencies) / duration if duration else 0,
+        "latency": _percentiles(latencies),
+        "llm_first_token_latency_s": args.llm_latency,
+        "llm_tokens_per_second": args.token_rate,
+    }
+
+def bench_rules(args):
+    """Latência de process_rules com diferentes tamanhos do conjunto de regras."""
+    from connection_pool import db_connection
+    from knowledge_base_manager import get_all_rules
+    import rule_engine
+
+    results = {}
+    for size in args.rule_sizes:
+        _clear_tables('rule_set')
+        rows = []
+        for index in range(size):
+            # ~10% das condições usam regex; as demais são literais.
+            if index % 10 == 0:
+                condition = f"{_random_word()}.*{_random_word()}"
+            else:
+                condition = f"{_random_word()} {_random_word()}"
+            rows.append((condition, f"acao {index}", random.randint(0, 10)))
+        with db_connection() as conn:
+            conn.executemany('INSERT INTO rule_set (rule_condition, rule_action, priority) VALUES (?, ?, ?)', rows)
+
+        start = time.perf_counter()
+        rule_engine.rule_index.load(get_all_rules())
+        build_seconds = time.perf_counter() - start
+
+        prompts = [' '.join(_random_word() for _ in range(12)) for _ in range(args.rule_queries)]
+        samples = []
+        for prompt in prompts:
+            start = time.perf_counter()
+            rule_engine.process_rules(prompt)
+            samples.append(time.perf_counter() - start)
+        results[str(size)] = {"index_build_ms": build_seconds * 1000, "latency": _percentiles(samples)}
+    return results
+
+def bench_history(args):
+    """Latência da leitura do histórico (e do contexto do LLM) com tabelas de histórico grandes."""
+    from connection_pool import db_connection
+    from knowledge_base_manager import get_conversation_history
+    from context_builder import build_conversation_context
+
+    results = {}
+    _clear_tables('conversation_history', 'conversation_summary')
+    inserted = 0
+    conversations = [f"bench-{index}" for index in range(1000)]
+    for size in sorted(args.history_sizes):
+        batch = []
+        for _ in range(size - inserted):
+            parts = json.dumps([{"text": ' '.join(_random_word() for _ in range(20))}])
+            batch.append((random.choice(conversations), random.choice(('user', 'model')), parts))
+        with db_connection() as conn:
+            conn.executemany('INSERT INTO conversation_history (conversation_id, role, parts) VALUES (?, ?, ?)', batch)
+        inserted = size
+
+        samples = []
+        context_samples = []
+        for _ in range(args.history_queries):
+            conversation_id = random.choice(conversations)
+            start = time.perf_counter()
+            get_conversation_history(conversation_id)
+            samples.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            build_conversation_context(conversation_id)
+            context_samples.append(time.perf_counter() - start)
+        results[str(size)] = {"latency": _percentiles(samples), "context_latency": _percentiles(context_samples)}
+    return results
+
+def bench_logging(args):
+    """Custo de log_message para o chamador e tempo até a gravação, com threads concorrentes."""
+    from knowledge_base_manager import log_message
+    from log_writer import log_writer
+
+    _clear_tables('logs')
+    before = log_writer.stats()
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for index in range(args.log_messages):
+            start = time.perf_counter()
+            log_message("INFO", f"benchmark {index}")
+            local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.log_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    enqueue_seconds = time.perf_counter() - start
+    log_writer.flush()
+    total_seconds = time.perf_counter() - start
+    after = log_writer.stats()
+
+    total = args.log_threads * args.log_messages
+    return {
+        "threads": args.log_threads,
+        "messages": total,
+        "call_latency": _percentiles(samples),
+        "messages_per_second": total / total_seconds if total_seconds else 0,
+        "enqueue_s": enqueue_seconds,
+        "flushed_s": total_seconds,
+        "dropped": after["dropped"] - before["dropped"],
+    }
+
+# Executado em um processo novo por bench_startup: importa o app e imprime o relatório.
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+from startup import startup_report
+print(json.dumps({{"import_ms": elapsed * 1000, "report": startup_report()}}))
+"""
+
+def bench_startup(args):
+    """Tempo de inicialização de um processo novo (importação de wsgi/asgi), com e sem importações preguiçosas."""
+    results = {}
+    for module in ('wsgi', 'asgi'):
+        for lazy in ('true', 'false'):
+            env = dict(os.environ, STARTUP_LAZY_IMPORTS=lazy, PYTHONPATH=os.pathsep.join(sys.path))
+            samples = []
+            phases = {}
+            for _ in range(args.startup_runs):
+                completed = subprocess.run(
+                    [sys.executable, '-c', _STARTUP_SCRIPT.format(module=module)],
+                    cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+                )
+                if completed.returncode != 0:
+                    return {"error": completed.stderr.strip().splitlines()[-1:]}
+                measurement = json.loads(completed.stdout.strip().splitlines()[-1])
+                samples.append(measurement["import_ms"] / 1000)
+                for name, elapsed in measurement["report"]["phases_ms"].items():
+                    phases.setdefault(name, []).append(elapsed)
+            results[f"{module}_lazy_{lazy}"] = {
+                "latency": _percentiles(samples),
+                "phases_mean_ms": {name: statistics.fmean(values) for name, values in phases.items()},
+            }
+    return results
+
+BENCHMARKS = {
+    "chat": bench_chat,
+    "chat_asgi": bench_chat_asgi,
+    "rules": bench_rules,
+    "history": bench_history,
+    "logging": bench_logging,
+    "startup": bench_startup,
+}
+
+
+# --- Comparação entre execuções ---
+
+def _flatten(prefix: str, value, output: dict):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, output)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        output[prefix] = value
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """Lista as métricas que pioraram mais que threshold (fração) em relação à base."""
+    old, new = {}, {}
+    _flatten('', baseline.get("results", {}), old)
+    _flatten('', current.get("results", {}), new)
+    regressions = []
+    for key, new_value in new.items():
+        old_value = old.get(key)
+        if not old_value or not (key.endswith('_ms') or key.endswith(_HIGHER_IS_BETTER)):
+            continue
+        change = (new_value - old_value) / old_value
+        if key.endswith(_HIGHER_IS_BETTER):
+            change = -change
+        if change > threshold:
+            regressions.append({"metric": key, "baseline": old_value, "current": new_value, "worse_by": change})
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do backend do JARVIS com Gemini simulado.")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="Executa apenas os benchmarks indicados.")
+    parser.add_argument('--quick', action='store_true', help="Tamanhos reduzidos, para uma verificação rápida.")
+    parser.add_argument('--output', help="Arquivo JSON de saída (padrão: benchmarks/results/<data>.json).")
+    parser.add_argument('--compare', help="JSON de uma execução anterior para detectar regressões.")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Piora tolerada na comparação (fração, padrão 0.10).")
+    parser.add_argument('--seed', type=int, default=42)
+    # Gemini simulado
+    parser.add_argument('--llm-latency', type=float, default=0.3, help="Segundos até o primeiro token.")
+    parser.add_argument('--token-rate', type=float, default=50.0, help="Tokens por segundo após o primeiro.")
+    parser.add_argument('--response-tokens', type=int, default=40)
+    # /api/chat
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--chat-requests', type=int, default=400)
+    parser.add_argument('--chat-unique-prompts', type=int, default=100)
+    parser.add_argument('--async-concurrency', type=int, default=200, help="Conversas simultâneas no benchmark chat_asgi.")
+    # Microbenchmarks
+    parser.add_argument('--rule-sizes', type=int, nargs='+', default=[10, 1000, 50000])
+    parser.add_argument('--rule-queries', type=int, default=500)
+    parser.add_argument('--history-sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--history-queries', type=int, default=500)
+    parser.add_argument('--log-threads', type=int, default=8)
+    parser.add_argument('--log-messages', type=int, default=5000, help="Mensagens por thread.")
+    parser.add_argument('--startup-runs', type=int, default=5, help="Processos iniciados por variante no benchmark startup.")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.llm_latency = min(args.llm_latency, 0.02)
+        args.token_rate = max(args.token_rate, 2000.0)
+        args.chat_requests = min(args.chat_requests, 100)
+        args.rule_sizes = [size for size in args.rule_sizes if size <= 1000] or [10]
+        args.history_sizes = [size for size in args.history_sizes if size <= 100000] or [10000]
+        args.rule_queries = min(args.rule_queries, 200)
+        args.history_queries = min(args.history_queries, 200)
+        args.log_messages = min(args.log_messages, 1000)
+        args.startup_runs = min(args.startup_runs, 2)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    db_dir = setup_environment(args)
+
+    results = {}
+    for name in (args.only or list(BENCHMARKS)):
+        print(f"Executando benchmark '{name}'...")
+        start = time.perf_counter()
+        results[name] = BENCHMARKS[name](args)
+        print(f"  concluído em {time.perf_counter() - start:.1f}s")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": sys.version.split()[0],
+        "database": os.environ['JARVIS_DB_PATH'],
+        "arguments": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        "results": results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    print(f"Resultados gravados em {output} (banco temporário em {db_dir}).")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+        regressions = compare(baseline, report, args.threshold)
+        for item in regressions:
+            print(f"REGRESSÃO: {item['metric']}: {item['baseline']:.3f} -> {item['current']:.3f} (+{item['worse_by']:.0%})")
+        if regressions:
+            return 1
+        print("Nenhuma regressão acima do limite.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,11 @@ npm install
 # Build do frontend
 echo "🔨 Construindo frontend..."
 npm run build
+cd ..
+
+# Variantes gzip/brotli dos arquivos, servidas pelo backend (static_assets.py)
+echo "🗜️  Comprimindo arquivos estáticos..."
+python backend/static_assets.py frontend/dist
 
 echo "✅ Build concluído com sucesso!"
 echo "📁 Frontend buildado em: frontend/dist"
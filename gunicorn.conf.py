@@ -0,0 +1,48 @@
+"""
+Configuração do Gunicorn, lida automaticamente quando ele é iniciado na raiz
+do projeto (wsgi:app ou asgi:app).
+
+Com preload_app, o app é importado uma única vez no processo mestre: a
+verificação do schema e as importações acontecem antes do fork e os workers
+já nascem prontos, compartilhando a memória dessas páginas com o mestre.
+Desative com GUNICORN_PRELOAD=false (ex.: para recarregar o código a cada
+reinício de worker).
+
+Threads e conexões não sobrevivem ao fork: antes de cada fork, o mestre grava
+os logs pendentes, encerra suas threads de segundo plano e fecha as conexões
+SQLite; a retenção de logs nem chega a começar no mestre e é iniciada em cada
+worker (post_fork).
+"""
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# Aplicado ao ambiente antes do preload (ver config.py).
+raw_env = []
+if preload_app and 'LOG_RETENTION_AUTOSTART' not in os.environ:
+    raw_env.append('LOG_RETENTION_AUTOSTART=false')
+
+def pre_fork(server, worker):
+    if preload_app:
+        from log_writer import log_writer
+        from log_retention import log_retention
+        from connection_pool import close_connection
+        # As threads fecham as próprias conexões ao encerrar.
+        log_writer.shutdown()
+        log_retention.shutdown()
+        # A conexão SQLite aberta pelo mestre durante o preload não pode ser
+        # usada pelos workers (cada um abre a sua, ver connection_pool.py).
+        close_connection()
+
+def post_fork(server, worker):
+    # Sem preload, o app ainda não foi importado aqui e a retenção começa
+    # sozinha com o primeiro log do worker.
+    if preload_app:
+        from log_retention import log_retention
+        log_retention.start()
+
+def post_worker_init(worker):
+    from startup import startup_report
+    report = startup_report()
+    origin = " (pré-carregada no processo mestre)" if report["preloaded"] else ""
+    worker.log.info("Worker %s pronto; inicialização do app: %.0f ms%s", worker.pid, report["total_ms"] or 0, origin)